@@ -0,0 +1,814 @@
+import argparse
+import contextlib
+import csv
+import difflib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from colorTerminal import OK, WARN, ERROR
+from logger import flush as flush_log
+from normalize import normalize_string
+from catalog_db import DB_FILE, connect
+from fuzzy_index import ensure_fuzzy_index, fuzzy_lookup
+from datetime import date, datetime, timedelta
+from rewe_products_import import import_rows
+
+@contextlib.contextmanager
+def quiet():
+    # Ausgaben der gemessenen Module verwerfen, inklusive gepufferter Log-Zeilen
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            yield
+        finally:
+            flush_log()
+
+def perturb(name, rng):
+    # Simuliert Bon-Namen: Tippfehler, fehlende und zusätzliche Zeichen
+    chars = list(name)
+    for _ in range(rng.randint(0, 8)):
+        pos = rng.randrange(len(chars) + 1)
+        op = rng.random()
+        if op < 0.3 and pos < len(chars):
+            del chars[pos]
+        elif op < 0.6:
+            chars.insert(pos, rng.choice("abcdefghijklmnop 0123456789"))
+        elif pos < len(chars):
+            chars[pos] = rng.choice("abcdefghijklmnop ")
+    return "".join(chars)
+
+def regression_set(names, size, seed):
+    rng = random.Random(seed)
+    queries = [perturb(rng.choice(names), rng) for _ in range(size)]
+    queries += [n.split()[0] for n in rng.sample(names, size // 5) if n.split()]
+    queries += ["", "a", "banane", "rewe bio gurke", "h-milch 1,5%"]
+    return queries
+
+def bench_fuzzy(conn, size, seed):
+    """Vergleicht den Fuzzy-Index mit dem bisherigen difflib-Scan (cutoff=0.8)."""
+    t0 = time.perf_counter()
+    rebuilt = ensure_fuzzy_index(conn)
+    print(f"Index {'neu aufgebaut' if rebuilt else 'aktuell'} in {time.perf_counter() - t0:.3f}s")
+
+    names = []
+    name_to_ean = {}
+    for name, ean in conn.execute("SELECT name, ean FROM products"):
+        # bisheriges Verhalten: normalize_string auf jeden Namen, letzte EAN gewinnt
+        n = normalize_string(name)
+        names.append(n)
+        name_to_ean[n] = ean
+
+    queries = regression_set(names, size, seed)
+    t_scan = t_index = 0.0
+    mismatches = 0
+    for q in queries:
+        t0 = time.perf_counter()
+        matches = difflib.get_close_matches(q, names, n=1, cutoff=0.8)
+        t_scan += time.perf_counter() - t0
+        expected = (matches[0], name_to_ean[matches[0]]) if matches else None
+
+        t0 = time.perf_counter()
+        result = fuzzy_lookup(conn, q, n=1, cutoff=0.8)
+        t_index += time.perf_counter() - t0
+        got = (result[0][1], result[0][2]) if result else None
+
+        if got != expected:
+            mismatches += 1
+            print(f"{ERROR} Abweichung für '{q}': difflib={expected} index={got}")
+
+    print(f"Anfragen: {len(queries)}, Abweichungen: {mismatches}")
+    print(f"difflib-Scan: {t_scan / len(queries) * 1000:.2f} ms/Anfrage")
+    print(f"Fuzzy-Index:  {t_index / len(queries) * 1000:.2f} ms/Anfrage (inkl. Laden)")
+    if mismatches == 0:
+        print(f"{OK} Fuzzy-Index liefert identische Treffer.")
+    return mismatches == 0
+
+# Lookups aus grocy_connector / rewe_products_import: vor und nach Migration v1
+LOOKUPS_BEFORE = {
+    "name": "SELECT ean FROM products WHERE lower(trim(name)) = ?",
+    "rewe_code": "SELECT ean FROM products WHERE trim(ean) = ?",
+    "image": "SELECT image FROM products WHERE ean = ?",
+}
+LOOKUPS_AFTER = {
+    "name": "SELECT ean FROM products WHERE name_norm = ? ORDER BY id LIMIT 1",
+    "rewe_code": "SELECT ean FROM products WHERE ean_norm = ?",
+    "image": "SELECT image FROM products WHERE ean_norm = ?",
+}
+
+def time_lookups(conn, queries, keys):
+    result = {}
+    for kind, sql in queries.items():
+        t0 = time.perf_counter()
+        for key in keys[kind]:
+            conn.execute(sql, (key,)).fetchone()
+        result[kind] = (time.perf_counter() - t0) / len(keys[kind]) * 1e6
+    return result
+
+def bench_lookup(db_file, size, seed):
+    """Misst die Lookup-Latenz vor und nach der Schema-Migration auf einer Kopie der DB."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "bench.db")
+        shutil.copyfile(db_file, copy)
+        conn = sqlite3.connect(copy)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        rows = conn.execute("SELECT name, ean FROM products").fetchall()
+        sample = rng.sample(rows, min(size, len(rows)))
+        # Je zur Hälfte Treffer und Fehlschläge (Fehlschläge scannen die ganze Tabelle)
+        misses = [f"kein produkt {i}" for i in range(size // 2)]
+        keys = {
+            "name": [normalize_string(n) for n, _ in sample[:size // 2]] + misses,
+            "rewe_code": [e for _, e in sample[:size // 2]] + misses,
+            "image": [e for _, e in sample[:size // 2]] + misses,
+        }
+        before = None
+        if version == 0:
+            before = time_lookups(conn, LOOKUPS_BEFORE, keys)
+        conn.close()
+
+        conn = connect(copy)
+        after = time_lookups(conn, LOOKUPS_AFTER, keys)
+        conn.close()
+
+    print(f"Zeilen: {len(rows)}, Anfragen je Lookup: {len(keys['name'])}")
+    for kind in LOOKUPS_AFTER:
+        if before:
+            print(f"{kind:10s} vorher {before[kind]:9.1f} µs  nachher {after[kind]:7.1f} µs  "
+                  f"(Faktor {before[kind] / after[kind]:.0f})")
+        else:
+            print(f"{kind:10s} nachher {after[kind]:7.1f} µs (DB war bereits migriert)")
+    return True
+
+def table_bytes(conn, *names):
+    placeholders = ",".join("?" * len(names))
+    row = conn.execute(f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({placeholders})", names).fetchone()
+    return row[0] or 0
+
+def bench_history(db_file, days, change_rate, seed):
+    """Simuliert tägliche Importe und misst das Wachstum der Preishistorie."""
+    rng = random.Random(seed)
+    history_tables = ("price_history", "eans", "sqlite_autoindex_eans_1")
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "bench.db")
+        shutil.copyfile(db_file, copy)
+        conn = connect(copy)
+        columns = ["name", "brand", "ean", "price", "grammage", "category", "sale", "image"]
+        catalog = {}
+        for row in conn.execute(f"SELECT {', '.join(columns)} FROM products ORDER BY id"):
+            catalog[row[2]] = dict(zip(columns, row))
+        start_day = date.fromisoformat(conn.execute("SELECT MAX(date) FROM products").fetchone()[0])
+        size_before = table_bytes(conn, *history_tables)
+        rows_before = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+        for offset in range(1, days + 1):
+            for item in catalog.values():
+                if rng.random() < change_rate:
+                    item["price"] = round(max(0.19, item["price"] * rng.uniform(0.8, 1.25)), 2)
+            day_rows = [dict(item, price=f"{item['price']:.2f}".replace(".", ",")) for item in catalog.values()]
+            with quiet():
+                import_rows(conn, iter(day_rows), (start_day + timedelta(days=offset)).isoformat(), "bench")
+        size_after = table_bytes(conn, *history_tables)
+        rows_after = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+        conn.close()
+
+    print(f"EANs: {len(catalog)}, simulierte Tage: {days}, Preisänderungsrate: {change_rate:.0%}")
+    print(f"Historie vorher: {rows_before} Einträge, {size_before / 1024:.0f} KiB")
+    print(f"Historie nachher: {rows_after} Einträge, {size_after / 1024:.0f} KiB")
+    print(f"Wachstum pro Tag: {(rows_after - rows_before) / days:.0f} Einträge, "
+          f"{(size_after - size_before) / days / 1024:.1f} KiB")
+    return True
+
+def bench_bon(conn, size, seed):
+    # eBon aus Katalogartikeln: ca. 20 % doppelte Zeilen und Artikel ohne
+    # Katalogeintrag, die nach dem Kürzen der Menge denselben Namen haben
+    rng = random.Random(seed)
+    rows = conn.execute("SELECT name, ean FROM products WHERE name IS NOT NULL ORDER BY id").fetchall()
+    bon = [{"productName": name, "nan": ean, "quantity": rng.randint(1, 3), "unitPrice": rng.randint(49, 999)}
+           for name, ean in rng.sample(rows, min(size, len(rows)))]
+    bon += [dict(rng.choice(bon)) for _ in range(size // 5)]
+    bon += [{"productName": f"Testartikel {i % 3} {250 * (i // 3 + 1)}g", "nan": 900000 + i, "quantity": 1, "unitPrice": 199}
+            for i in range(6)]
+    rng.shuffle(bon)
+    return bon
+
+def grocy_state(fake):
+    names = {p["id"]: p["name"] for p in fake.products}
+    barcodes = sorted((b["barcode"], names[b["product_id"]]) for b in fake.barcodes)
+    stock = sorted((names[s["product_id"]], s["amount"], s["price"]) for s in fake.stock)
+    duplicates = len(names) - len(set(names.values()))
+    return barcodes, stock, duplicates
+
+def stock_amounts(state):
+    # Gesamtmenge und -wert je Produkt, unabhängig davon, wie die Buchungen aufgeteilt sind
+    totals = {}
+    for name, amount, price in state[1]:
+        total = totals.setdefault(name, [0, 0.0])
+        total[0] += amount
+        total[1] += amount * price
+    return {name: (amount, round(value, 2)) for name, (amount, value) in totals.items()}
+
+def bench_pipeline(db_file, size, seed, concurrency, latency):
+    """Vergleicht die serielle mit der parallelen Artikel-Pipeline gegen ein lokales Fake-Grocy."""
+    from fake_servers import FakeGrocy, FakeImageHost, FakeOpenFoodFacts
+    fake = FakeGrocy(latency=latency).start()
+    off = FakeOpenFoodFacts(latency=latency).start()
+    images = FakeImageHost(latency=latency).start()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # grocy_connector öffnet die Katalog-DB relativ zum Arbeitsverzeichnis: auf einer Kopie arbeiten
+        shutil.copyfile(db_file, os.path.join(tmp, DB_FILE))
+        os.chdir(tmp)
+        try:
+            import config
+            config.GROCY_API_URL = fake.url
+            import grocy_connector
+            from bon_pipeline import process_articles
+            from http_client import client
+            from tenants import current_tenant
+            grocy_connector.OFF_PRODUCT_URL = off.product_url
+            grocy_connector.get_image_url_by_ean = lambda ean: f"{images.url}/img/{ean}.jpg"
+            with grocy_connector.db_lock:
+                ensure_fuzzy_index(grocy_connector.get_db())
+            bon = bench_bon(grocy_connector.get_db(), size, seed)
+
+            results = {}
+            stock_posts = {}
+            # "einzeln": ohne Zusammenfassen gleicher Zeilen (eine Bestandsbuchung pro Zeile)
+            for label, workers, coalesce in (("seriell", 1, True), ("parallel", concurrency, True),
+                                             ("einzeln", concurrency, False)):
+                for server in (fake, off, images):
+                    server.reset()
+                client.reset_stats()
+                current_tenant().grocy_cache = None
+                t0 = time.perf_counter()
+                with quiet():
+                    processed = process_articles(bon, purchased_date="2025-06-20", concurrency=workers,
+                                                 coalesce=coalesce)
+                    grocy_connector.wait_for_image_uploads()
+                elapsed = time.perf_counter() - t0
+                calls = sum(sum(server.calls.values()) for server in (fake, off, images))
+                stock_posts[label] = fake.calls["POST /api/stock/products/{id}/add"]
+                results[label] = (elapsed, processed, calls, grocy_state(fake))
+            grocy_connector.close_db()
+        finally:
+            os.chdir(cwd)
+            for server in (fake, off, images):
+                server.stop()
+
+    print(f"Bon-Zeilen: {len(bon)}, Latenz pro Request: {latency * 1000:.0f} ms")
+    for label, (elapsed, processed, calls, state) in results.items():
+        print(f"{label:9s} {elapsed:7.2f}s  {processed} Zeilen übertragen, {calls} Requests, "
+              f"{len(state[0])} Barcodes, {state[2]} doppelte Produkte")
+    serial, parallel, single = results["seriell"], results["parallel"], results["einzeln"]
+    print(f"Beschleunigung mit --concurrency {concurrency}: Faktor {serial[0] / parallel[0]:.1f}")
+    print(f"Bestandsbuchungen: {stock_posts['parallel']} zusammengefasst statt {stock_posts['einzeln']} einzeln "
+          f"({stock_posts['einzeln'] - stock_posts['parallel']} Schreibzugriffe gespart)")
+    ok = serial[1:] == parallel[1:] and parallel[3][2] == 0 and single[1] == parallel[1]
+    if stock_amounts(single[3]) != stock_amounts(parallel[3]):
+        ok = False
+        print(f"{ERROR} Zusammengefasste Buchungen ergeben einen anderen Bestand als einzelne.")
+    if ok:
+        print(f"{OK} Parallele Pipeline erzeugt denselben Grocy-Stand wie die serielle.")
+    else:
+        print(f"{ERROR} Grocy-Stand weicht zwischen serieller und paralleler Pipeline ab.")
+    return ok
+
+def bench_resolve(db_file, size, seed):
+    """Genauigkeit und Laufzeit von resolve_eans über alle EANs des Katalogs."""
+    rng = random.Random(seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # grocy_connector öffnet die Katalog-DB relativ zum Arbeitsverzeichnis: auf einer Kopie arbeiten
+        shutil.copyfile(db_file, os.path.join(tmp, DB_FILE))
+        os.chdir(tmp)
+        try:
+            with quiet():
+                import grocy_connector
+                grocy_connector.resolve_eans([("banane", None)])  # Fuzzy-Index bauen und laden
+            conn = grocy_connector.get_db()
+            catalog = {}
+            for name, ean in conn.execute("SELECT name, ean_norm FROM products WHERE name IS NOT NULL ORDER BY id"):
+                catalog.setdefault(ean, name)
+            eans_by_name = defaultdict(set)
+            for ean, name in catalog.items():
+                eans_by_name[normalize_string(name)].add(ean)
+
+            t0 = time.perf_counter()
+            results = grocy_connector.resolve_eans([(name, None) for name in catalog.values()], use_cache=False)
+            t_exact = time.perf_counter() - t0
+            correct = sum(r["ean"] == ean for ean, r in zip(catalog, results))
+            # Gleicher Name bei mehreren EANs: jede dieser EANs gilt als richtig
+            ambiguous = sum(r["ean"] != ean and len(eans_by_name[normalize_string(name)]) > 1
+                            for (ean, name), r in zip(catalog.items(), results))
+
+            sample = rng.sample(list(catalog.items()), min(size, len(catalog)))
+            queries = [(perturb(normalize_string(name), rng), None) for _ean, name in sample]
+            t0 = time.perf_counter()
+            fuzzy = grocy_connector.resolve_eans(queries, n=1, use_cache=False)
+            t_fuzzy = time.perf_counter() - t0
+            top1 = sum(r["ean"] == ean for (ean, _n), r in zip(sample, fuzzy))
+            t0 = time.perf_counter()
+            fuzzy = grocy_connector.resolve_eans(queries, n=3, use_cache=False)
+            t_top3 = time.perf_counter() - t0
+            top3 = sum(any(c[2] == ean for c in r["candidates"]) for (ean, _n), r in zip(sample, fuzzy))
+            conn.close()
+        finally:
+            os.chdir(cwd)
+
+    print(f"Katalog: {len(catalog)} EANs in {t_exact:.3f}s aufgelöst "
+          f"({t_exact / len(catalog) * 1e6:.0f} µs/Artikel)")
+    print(f"  richtige EAN: {correct} ({correct / len(catalog):.1%}), "
+          f"davon abweichend bei gleichem Namen: {ambiguous}, sonst falsch: {len(catalog) - correct - ambiguous}")
+    print(f"Verrauschte Namen: {len(sample)} in {t_fuzzy:.3f}s ({t_fuzzy / len(sample) * 1000:.1f} ms/Artikel)")
+    print(f"  Top-1: {top1 / len(sample):.1%}; Top-3: {top3 / len(sample):.1%} "
+          f"({t_top3 / len(sample) * 1000:.1f} ms/Artikel mit n=3)")
+    return True
+
+# Umkehrung der Bon-Kürzel für den synthetischen Korpus
+BON_STYLE = {"Vollmilch": "VOLLM.", "Joghurt": "JOGH.", "Erdbeere": "ERDB.", "Original": "ORIG.",
+             "Klassik": "KLASS.", "Natur": "NAT.", "Gemischt": "GEM.", "Mozzarella": "MOZZ.", "Zitrone": "ZITR."}
+BON_BRANDS = {"REWE Beste Wahl": ("RW BW", "REWE BW", "REWE BESTE WAHL"), "REWE Bio": ("RW BIO", "REWE BIO"),
+              "REWE Feine Welt": ("RW FEINE WELT", "REWE FW")}
+
+def bon_style(name, rng):
+    # Simuliert die Schreibweise auf dem eBon: Großbuchstaben, Umlaute
+    # ausgeschrieben, meist ohne Menge, Marken- und Wortkürzel, selten Tippfehler
+    from normalize import remove_quantity_from_name
+    if rng.random() < 0.7:
+        name = remove_quantity_from_name(name)
+    for brand, aliases in BON_BRANDS.items():
+        if name.startswith(brand):
+            name = rng.choice(aliases) + name[len(brand):]
+    for word, short in BON_STYLE.items():
+        if word in name and rng.random() < 0.5:
+            name = name.replace(word, short)
+    name = name.upper().replace("Ä", "AE").replace("Ö", "OE").replace("Ü", "UE").replace("ß", "SS")
+    if rng.random() < 0.1:
+        name = perturb(name, rng)
+    return name
+
+def load_bon_corpus(path):
+    # JSON-Datei mit eBons ({"articles": [...]}) oder einer Liste von Artikeln
+    import json
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    names = []
+    for item in data:
+        for article in item.get("articles", [item]):
+            if article.get("productName"):
+                names.append(article["productName"])
+    return names
+
+def bench_normalize(db_file, size, seed, bons=None):
+    """Anteil exakter Treffer und Auflösungszeit mit und ohne Matching-Schlüssel (name_key)."""
+    rng = random.Random(seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copyfile(db_file, os.path.join(tmp, DB_FILE))
+        os.chdir(tmp)
+        try:
+            with quiet():
+                import grocy_connector
+                grocy_connector.resolve_eans([("banane", None)])  # Fuzzy-Index bauen und laden
+            conn = grocy_connector.get_db()
+            if bons:
+                corpus = [(name, None) for name in load_bon_corpus(bons)]
+                expected = None
+            else:
+                rows = conn.execute("SELECT name, ean FROM products WHERE name IS NOT NULL").fetchall()
+                sample = rng.sample(rows, min(size, len(rows)))
+                corpus = [(bon_style(name, rng), None) for name, _ean in sample]
+                expected = [ean for _name, ean in sample]
+
+            results = {}
+            for label in ("ohne Schlüssel", "mit Schlüssel"):
+                if label == "ohne Schlüssel":
+                    conn.execute("UPDATE products SET name_key = NULL")
+                else:
+                    conn.execute("UPDATE products SET name_key = nullif(match_key(name), '')")
+                conn.commit()
+                t0 = time.perf_counter()
+                resolved = grocy_connector.resolve_eans(corpus, n=1, use_cache=False)
+                elapsed = time.perf_counter() - t0
+                results[label] = (elapsed, resolved)
+            conn.close()
+        finally:
+            os.chdir(cwd)
+
+    print(f"Bon-Artikel: {len(corpus)} ({'aus ' + bons if bons else 'synthetisch aus dem Katalog'})")
+    for label, (elapsed, resolved) in results.items():
+        methods = defaultdict(int)
+        for r in resolved:
+            methods[r["method"] or "keine"] += 1
+        exact = methods["name"] + methods["key"]
+        line = (f"{label:15s} exakt {exact / len(corpus):6.1%}  Ø {elapsed / len(corpus) * 1000:6.2f} ms/Artikel  "
+                + ", ".join(f"{m} {n}" for m, n in sorted(methods.items()) if n))
+        if expected:
+            correct = sum(r["ean"] == ean for r, ean in zip(resolved, expected))
+            line += f"  richtig {correct / len(corpus):.1%}"
+        print(line)
+    return True
+
+# Synthetischer Katalog für den End-to-End-Benchmark
+E2E_BRANDS = ("REWE Beste Wahl", "REWE Bio", "ja!", "Milka", "Barilla", "Dr. Oetker", "Alnatura", "Landliebe")
+E2E_PRODUCTS = ("Vollmilch", "Joghurt Erdbeere", "Gouda jung", "Spaghetti", "Mozzarella", "Apfelsaft",
+                "Haferflocken", "Zitrone", "Tomaten passiert", "Schokolade Nuss", "Butter", "Brötchen")
+E2E_VARIANTS = ("", "Original", "Klassik", "Natur", "extra", "laktosefrei", "fein", "Vollkorn")
+E2E_SIZES = ("100g", "250g", "500g", "1kg", "0,5l", "1l", "6x1,5l", "10 Stück")
+E2E_COLUMNS = ["name", "brand", "ean", "price", "grammage", "category", "sale", "image"]
+
+def synthetic_product(rng, eans, image_url):
+    while True:
+        ean = f"40{rng.randrange(10 ** 11):011d}"
+        if ean not in eans:
+            eans.add(ean)
+            break
+    brand = rng.choice(E2E_BRANDS)
+    size = rng.choice(E2E_SIZES)
+    name = " ".join(w for w in (brand, rng.choice(E2E_PRODUCTS), rng.choice(E2E_VARIANTS), size) if w)
+    return {"name": name, "brand": brand, "ean": ean, "price": round(rng.uniform(0.39, 9.99), 2),
+            "grammage": size, "category": "Benchmark", "sale": "", "image": f"{image_url}/img/{ean}.jpg"}
+
+def catalog_csv(catalog):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=E2E_COLUMNS)
+    writer.writeheader()
+    for item in catalog.values():
+        writer.writerow(dict(item, price=f"{item['price']:.2f}".replace(".", ",")))
+    return out.getvalue().encode("utf-8")
+
+def synthetic_rewe_data(size, days, receipts, lines, change_rate, seed, image_url, region):
+    """Tages-CSVs (Preisänderungen, ein paar neue Artikel pro Tag) und eBons aus dem Katalog."""
+    rng = random.Random(seed)
+    eans = set()
+    catalog = {}
+    for _ in range(size):
+        item = synthetic_product(rng, eans, image_url)
+        catalog[item["ean"]] = item
+    first_day = date.today() - timedelta(days=days - 1)
+    csv_files = {}
+    for offset in range(days):
+        if offset:
+            for item in catalog.values():
+                if rng.random() < change_rate:
+                    item["price"] = round(max(0.19, item["price"] * rng.uniform(0.8, 1.25)), 2)
+            for _ in range(max(1, size // 200)):
+                item = synthetic_product(rng, eans, image_url)
+                catalog[item["ean"]] = item
+        csv_files[f"{(first_day + timedelta(days=offset)).isoformat()}_{region}.csv"] = catalog_csv(catalog)
+
+    items = list(catalog.values())
+    receipt_list = []
+    articles = {}
+    for i in range(receipts):
+        receipt_id = f"00000000-0000-4000-8000-{i:012d}"
+        bon = [{"productName": bon_style(item["name"], rng), "nan": item["ean"],
+                "quantity": rng.randint(1, 3), "unitPrice": int(round(item["price"] * 100))}
+               for item in rng.sample(items, min(lines, len(items)))]
+        articles[receipt_id] = bon
+        day = first_day + timedelta(days=rng.randrange(days))
+        receipt_list.append({"receiptId": receipt_id, "receiptTimestamp": f"{day.isoformat()}T10:00:00Z",
+                             "receiptTotalPrice": sum(a["quantity"] * a["unitPrice"] for a in bon)})
+    receipt_list.sort(key=lambda r: r["receiptTimestamp"], reverse=True)
+    return csv_files, receipt_list, articles
+
+def run_e2e_scenario(scenario, workdir, urls, options):
+    """Läuft in einem eigenen Prozess: saubere Modulzustände und eigener Peak-RSS."""
+    import itertools
+    os.chdir(workdir)
+    import catalog_db
+    statements = itertools.count()
+    catalog_db.trace_callback = lambda _sql: next(statements)
+    import config
+    config.GROCY_API_URL = urls["grocy"]
+    from http_client import client
+
+    t0 = time.perf_counter()
+    with quiet():
+        if scenario == "import":
+            import rewe_products_import
+            rewe_products_import.BASE_URL = urls["rewe"] + "/"
+            rewe_products_import.START_DATE = datetime.combine(
+                date.today() - timedelta(days=options["days"] - 1), datetime.min.time())
+            rewe_products_import.main()
+            conn = catalog_db.connect(DB_FILE)
+            units = conn.execute("SELECT SUM(rows) FROM import_manifest WHERE status = 'imported'").fetchone()[0] or 0
+            conn.close()
+            ok = units
+        else:
+            import builtins
+            import grocy_connector
+            import main as app
+            grocy_connector.OFF_PRODUCT_URL = urls["off"]
+            app.RECEIPT_URL = urls["rewe"] + "/api/receipts/"
+            if scenario == "bon":
+                # Interaktiver Weg: die ersten BON_HISTORY eBons nacheinander auswählen
+                units = ok = 0
+                for i in range(min(options["receipts"], config.BON_HISTORY)):
+                    builtins.input = lambda _prompt="", i=i: str(i)
+                    rewe_bon, purchased_date, receipt_id = app.fetch_rewe_bon(config.HARDCODED_RTSP_TOKEN)
+                    if rewe_bon:
+                        units += len(rewe_bon)
+                        ok += app.processrewe_bon(rewe_bon, purchased_date, options["concurrency"], receipt_id=receipt_id)
+                grocy_connector.wait_for_image_uploads()
+                grocy_connector.close_db()
+            else:
+                app.main(concurrency=options["concurrency"], sync_all_receipts=True, refresh="never")
+                conn = catalog_db.connect(DB_FILE)
+                units = options["receipts"] * options["lines"]
+                ok = conn.execute("SELECT COALESCE(SUM(lines), 0) FROM synced_receipts").fetchone()[0]
+                conn.close()
+    elapsed = time.perf_counter() - t0
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux: KiB
+    except ImportError:
+        peak_rss = None
+    client_errors = sum(s["errors"] for s in client.stats().values())
+    return {"seconds": elapsed, "units": units, "ok": ok, "sql": next(statements),
+            "peak_rss": peak_rss, "client_errors": client_errors}
+
+def bench_e2e(size, days, receipts, lines, concurrency, latency, error_rate, change_rate, seed):
+    """Import und eBon-Übertragung Ende-zu-Ende gegen lokale Fake-Server (REWE, Grocy, OFF, Bilder)."""
+    import multiprocessing
+    from fake_servers import FakeGrocy, FakeImageHost, FakeOpenFoodFacts, FakeRewe
+    from rewe_products_import import BUNDESLAND
+    kwargs = {"latency": latency, "error_rate": error_rate, "seed": seed}
+    images = FakeImageHost(**kwargs).start()
+    csv_files, receipt_list, articles = synthetic_rewe_data(
+        size, days, receipts, lines, change_rate, seed, images.url, BUNDESLAND)
+    servers = {
+        "rewe": FakeRewe(receipt_list, articles, csv_files, **kwargs).start(),
+        "grocy": FakeGrocy(**kwargs).start(),
+        "off": FakeOpenFoodFacts(**kwargs).start(),
+        "images": images,
+    }
+    urls = {name: server.url for name, server in servers.items()}
+    urls["off"] = servers["off"].product_url
+    options = {"days": days, "receipts": receipts, "lines": lines, "concurrency": concurrency}
+    units_label = {"import": "Zeilen", "bon": "Artikel", "sync": "Artikel"}
+
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for scenario in ("import", "bon", "sync"):
+                workdir = os.path.join(tmp, scenario)
+                os.makedirs(workdir)
+                if scenario != "import":
+                    # Beide eBon-Szenarien starten vom frisch importierten Katalog und leerem Grocy
+                    shutil.copyfile(os.path.join(tmp, "import", DB_FILE), os.path.join(workdir, DB_FILE))
+                for server in servers.values():
+                    server.reset()
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(run_e2e_scenario, (scenario, workdir, urls, options))
+                result["http"] = sum(sum(server.calls.values()) for server in servers.values())
+                result["injected"] = sum(server.errors for server in servers.values())
+                results[scenario] = result
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    print(f"Katalog: {size} Artikel, {days} Tage; eBons: {receipts} à {lines} Zeilen; "
+          f"Latenz {latency * 1000:.0f} ms, Fehlerquote {error_rate:.1%}, --concurrency {concurrency}")
+    for scenario, r in results.items():
+        units = max(r["units"], 1)
+        rss = f"{r['peak_rss'] / 2 ** 20:6.0f} MiB" if r["peak_rss"] else "     n/a"
+        print(f"{scenario:7s} {r['seconds']:7.2f}s  {r['units']:6d} {units_label[scenario]:7s} "
+              f"({r['ok']} ok)  HTTP {r['http']:5d} ({r['http'] / units:.2f}/Einheit)  "
+              f"SQL {r['sql']:6d} ({r['sql'] / units:.1f}/Einheit)  Peak-RSS {rss}  "
+              f"Fehler injiziert {r['injected']}, beim Client {r['client_errors']}")
+    ok = all(r["ok"] == r["units"] for r in results.values())
+    if ok:
+        print(f"{OK} Alle Zeilen und Artikel wurden übertragen.")
+    elif error_rate:
+        print(f"{WARN} Nicht alles übertragen (erwartet bei Fehlerquote > 0).")
+    else:
+        print(f"{ERROR} Nicht alle Zeilen oder Artikel wurden übertragen.")
+    return ok or error_rate > 0
+
+# Läuft in einem frischen Interpreter, damit auch die Importzeit von main.py
+# realistisch ist: von dort bis zur Auswahl-Frage nach der eBon-Liste
+STARTUP_SCRIPT = """
+import time
+t0 = time.perf_counter()
+import builtins, json, os, sys
+workdir, urls, background = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3] == "1"
+os.chdir(workdir)
+import config
+config.GROCY_API_URL = urls["grocy"]
+config.CATALOG_REFRESH_BACKGROUND = background
+import main as app
+import rewe_products_import
+t_import = time.perf_counter() - t0
+app.RECEIPT_URL = urls["rewe"] + "/api/receipts/"
+rewe_products_import.BASE_URL = urls["rewe"] + "/"
+
+def prompt(_prompt=""):
+    with open("startup.json", "w") as f:
+        json.dump({"import": t_import, "receipt_list": time.perf_counter() - t0}, f)
+    os._exit(0)
+
+builtins.input = prompt
+app.main(concurrency=1, refresh="auto")
+"""
+
+def run_startup_scenario(workdir, urls, background):
+    import json
+    import subprocess
+    import sys
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, workdir, json.dumps(urls), "1" if background else "0"],
+                   env=env, capture_output=True, timeout=600)
+    try:
+        with open(os.path.join(workdir, "startup.json")) as f:
+            return json.load(f)
+    except OSError:
+        return {"import": None, "receipt_list": None}
+
+def bench_startup(db_file, latency, seed):
+    """Zeit bis zur eBon-Liste: Katalog fällig (Vorder-/Hintergrund) und heute schon aktualisiert."""
+    from fake_servers import FakeGrocy, FakeRewe
+    from rewe_products_import import record_catalog_refresh
+    rng = random.Random(seed)
+    receipts = [{"receiptId": f"00000000-0000-4000-8000-{i:012d}",
+                 "receiptTimestamp": f"{date.today() - timedelta(days=i)}T10:00:00Z",
+                 "receiptTotalPrice": rng.randint(500, 9000)} for i in range(10)]
+    # Ohne Tages-CSVs: der Import fragt wie im echten Betrieb fehlende Tage ab, bis MAX_DAYS_WITHOUT_FILE
+    servers = {"rewe": FakeRewe(receipts, latency=latency).start(), "grocy": FakeGrocy(latency=latency).start()}
+    urls = {name: server.url for name, server in servers.items()}
+    scenarios = (
+        ("Katalog fällig, Vordergrund", False, False),
+        ("Katalog fällig, Hintergrund", True, False),
+        ("heute schon aktualisiert", True, True),
+    )
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Einmal migrieren, damit die Migration nicht in jede Messung eingeht
+            migrated = os.path.join(tmp, "migrated.db")
+            shutil.copyfile(db_file, migrated)
+            with quiet():
+                connect(migrated).close()
+            for label, background, fresh in scenarios:
+                workdir = os.path.join(tmp, str(len(results)))
+                os.makedirs(workdir)
+                shutil.copyfile(migrated, os.path.join(workdir, DB_FILE))
+                if fresh:
+                    conn = connect(os.path.join(workdir, DB_FILE))
+                    record_catalog_refresh(conn)
+                    conn.close()
+                for server in servers.values():
+                    server.reset()
+                result = run_startup_scenario(workdir, urls, background)
+                result["catalog_requests"] = sum(n for key, n in servers["rewe"].calls.items() if key.endswith(".csv"))
+                results[label] = result
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    print(f"Latenz pro Request: {latency * 1000:.0f} ms")
+    for label, r in results.items():
+        if r["receipt_list"] is None:
+            print(f"{ERROR} {label}: eBon-Liste wurde nicht angezeigt")
+            continue
+        print(f"{label:28s} Import von main.py {r['import']:5.2f}s  eBon-Liste nach {r['receipt_list']:6.2f}s  "
+              f"Katalog-Requests {r['catalog_requests']}")
+    return all(r["receipt_list"] is not None for r in results.values())
+
+SNAPSHOT_SCRIPT = """
+import json, resource, sys, time
+backend, db_file, snap_file, query_file = sys.argv[1:5]
+with open(query_file) as f:
+    queries = json.load(f)
+import catalog_db
+from catalog_snapshot import CatalogSnapshot, SqliteCatalog
+def rss():
+    # Aktueller RSS (Linux), sonst Peak laut getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+rss_before = rss()
+t0 = time.perf_counter()
+catalog = SqliteCatalog(catalog_db.connect(db_file)) if backend == "sqlite" else CatalogSnapshot(snap_file)
+index = catalog.fuzzy_index()
+t_load = time.perf_counter() - t0
+t0 = time.perf_counter()
+for q in queries:
+    catalog.ean_by_name(q) or index.lookup(q, n=1, cutoff=0.8)
+t_queries = time.perf_counter() - t0
+print(json.dumps({"load": t_load, "queries": t_queries, "rss": rss() - rss_before, "total": rss()}))
+"""
+
+def run_snapshot_backend(backend, db_file, snap_file, query_file):
+    import json
+    import subprocess
+    import sys
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", SNAPSHOT_SCRIPT, backend, db_file, snap_file, query_file],
+                         env=env, capture_output=True, text=True, timeout=600, check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+def bench_snapshot(db_file, size, seed, runs=3):
+    """mmap-Snapshot gegen SQLite: gleiche Ergebnisse, Ladezeit und Speicher je frischem Prozess."""
+    import json
+    from catalog_snapshot import CatalogSnapshot, SqliteCatalog, export_snapshot
+    from normalize import match_key
+    with tempfile.TemporaryDirectory() as tmp:
+        db_copy = os.path.join(tmp, DB_FILE)
+        snap_file = os.path.join(tmp, "rewe_products.snap")
+        shutil.copyfile(db_file, db_copy)
+        with quiet():
+            conn = connect(db_copy)
+        ensure_fuzzy_index(conn)
+        t0 = time.perf_counter()
+        count = export_snapshot(conn, snap_file)
+        t_export = time.perf_counter() - t0
+
+        names = [n for (n,) in conn.execute("SELECT name_norm FROM products WHERE name_norm IS NOT NULL")]
+        codes = [c for (c,) in conn.execute("SELECT ean_norm FROM products WHERE ean_norm IS NOT NULL")]
+        queries = regression_set(names, size, seed)
+        a, b = SqliteCatalog(conn), CatalogSnapshot(snap_file)
+        checks = mismatches = 0
+        for n in names + queries:
+            key = match_key(n)
+            checks += 2
+            mismatches += a.ean_by_name(n) != b.ean_by_name(n)
+            mismatches += bool(key) and a.ean_by_key(key) != b.ean_by_key(key)
+        for c in codes + ["", "0000000000000"]:
+            checks += 2
+            mismatches += a.ean_by_code(c) != b.ean_by_code(c)
+            mismatches += a.image_by_ean(c) != b.image_by_ean(c)
+        for q in queries:
+            checks += 1
+            mismatches += a.fuzzy_index().lookup(q, n=3) != b.fuzzy_index().lookup(q, n=3)
+        b.close()
+        conn.close()
+
+        query_file = os.path.join(tmp, "queries.json")
+        with open(query_file, "w") as f:
+            json.dump(queries, f)
+        results = {}
+        for backend in ("sqlite", "snapshot"):
+            runs_ = [run_snapshot_backend(backend, db_copy, snap_file, query_file) for _ in range(runs)]
+            results[backend] = {key: min(r[key] for r in runs_) for key in runs_[0]}
+        snap_size = os.path.getsize(snap_file)
+
+    print(f"Snapshot: {count} Namen, {snap_size / 1024:.0f} KiB, geschrieben in {t_export:.3f}s")
+    print(f"Abweichungen zu SQLite: {mismatches} von {checks} Lookups")
+    for backend, r in results.items():
+        print(f"{backend:9s} Laden {r['load'] * 1000:7.1f} ms  {len(queries)} Suchen {r['queries'] * 1000:7.1f} ms  "
+              f"RSS +{r['rss'] / 2**20:5.1f} MiB (gesamt {r['total'] / 2**20:5.1f} MiB)")
+    return mismatches == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks für die Katalog-Suche")
+    parser.add_argument("benchmark", choices=["fuzzy", "lookup", "history", "pipeline", "resolve", "normalize", "e2e",
+                                              "startup", "snapshot"])
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--change-rate", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--bons", help="JSON mit echten eBons für den normalize-Benchmark")
+    parser.add_argument("--latency", type=float, default=0.02, help="Sekunden pro Fake-Request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Anteil der Fake-Requests mit 503")
+    parser.add_argument("--receipts", type=int, default=10, help="eBons für den e2e-Benchmark")
+    parser.add_argument("--lines", type=int, default=25, help="Zeilen pro eBon im e2e-Benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark == "lookup":
+        ok = bench_lookup(args.db, args.size, args.seed)
+    elif args.benchmark == "history":
+        ok = bench_history(args.db, args.days, args.change_rate, args.seed)
+    elif args.benchmark == "normalize":
+        ok = bench_normalize(args.db, args.size, args.seed, args.bons)
+    elif args.benchmark == "resolve":
+        ok = bench_resolve(args.db, args.size, args.seed)
+    elif args.benchmark == "startup":
+        ok = bench_startup(args.db, args.latency, args.seed)
+    elif args.benchmark == "snapshot":
+        ok = bench_snapshot(args.db, args.size, args.seed)
+    elif args.benchmark == "e2e":
+        ok = bench_e2e(args.size, args.days, args.receipts, args.lines, args.concurrency,
+                       args.latency, args.error_rate, args.change_rate, args.seed)
+    elif args.benchmark == "pipeline":
+        ok = bench_pipeline(args.db, args.size, args.seed, args.concurrency, args.latency)
+    else:
+        conn = connect(args.db)
+        try:
+            ok = bench_fuzzy(conn, args.size, args.seed)
+        finally:
+            conn.close()
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
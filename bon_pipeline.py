@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+from colorTerminal import OK, WARN
+from config import BON_COALESCE_LINES
+from logger import log
+from metrics import metrics
+from grocy_connector import add_or_update_product, get_grocy_cache, resolve_eans, get_db, db_lock
+from grocy_journal import open_journal_entries, journal_coalesce
+from tenants import current_tenant, submit
+
+def resolve_articles(items):
+    """Lokaler Teil: EAN, Menge und Preis aus der Katalog-DB.
+
+    `items` ist eine Liste von (Bon-Artikel, Kaufdatum, eBon-ID, Zeile); alle
+    Namen werden mit einem einzigen resolve_eans-Aufruf aufgelöst. Die Zeile
+    (Position im eBon) ist zusammen mit der eBon-ID der Journal-Schlüssel.
+    """
+    valid = []
+    for item in items:
+        if item[0].get("productName"):
+            valid.append(item)
+        else:
+            log.warning(f"{WARN} Produkt ohne 'productName' gefunden, wird übersprungen: {item[0]}")
+    resolutions = resolve_eans([(product["productName"], product.get("nan", "")) for product, _d, _r, _l in valid], n=1)
+    articles = []
+    for (product, purchased_date, receipt_id, line), resolution in zip(valid, resolutions):
+        quantity = int(product.get("quantity", 0))
+        unit_price = product.get("unitPrice", 0) / 100
+        # Kein Treffer und kein REWE-Code: ohne EAN weiter, gebucht wird über den Namen
+        ean = resolution["ean"] or None
+        log.info(f"Verarbeite Produkt: Name='{product['productName']}', EAN={ean} ({resolution['method'] or 'keine Zuordnung'}), "
+                 f"Menge={quantity}, Preis={unit_price:.2f}€")
+        articles.append({"name": product["productName"], "ean": ean, "quantity": quantity, "price": unit_price,
+                         "purchased_date": purchased_date, "receipt_id": receipt_id, "line": line})
+    return articles
+
+def plan_articles(articles, coalesce=BON_COALESCE_LINES):
+    """Planungsschritt: Zeilen eines eBons mit derselben EAN und demselben
+    Kaufdatum werden zu einer Bestandsbuchung zusammengefasst.
+
+    Die Menge wird addiert, der Preis nach Menge gewichtet. Liefert die
+    Buchungen als Artikel-Dicts, "indexes" sind die Positionen der
+    enthaltenen Zeilen in `articles`. Zeilen ohne EAN bleiben einzeln.
+    Gruppen mit eBon-ID werden vorab im Journal angelegt; steht dieselbe
+    Gruppe dort schon (früherer Lauf), wird sie wieder über ihre erste Zeile
+    gebucht. Stehen die Zeilen anders im Journal, laufen sie einzeln, wobei
+    zusammengefasste Zeilen nie selbst buchen.
+    """
+    plans = []
+    by_key = {}
+    for index, article in enumerate(articles):
+        ean = str(article["ean"]).strip() if article["ean"] else ""
+        key = (article.get("receipt_id"), ean, article["purchased_date"])
+        if coalesce and ean and key in by_key:
+            by_key[key]["indexes"].append(index)
+            continue
+        plan = dict(article, indexes=[index])
+        plans.append(plan)
+        by_key.setdefault(key, plan)
+
+    planned = []
+    tenant = current_tenant().name
+    for plan in plans:
+        group = [articles[i] for i in plan["indexes"]]
+        if len(group) == 1:
+            planned.append(plan)
+            continue
+        quantity = sum(a["quantity"] for a in group)
+        if quantity:
+            plan["price"] = round(sum(a["quantity"] * a["price"] for a in group) / quantity, 4)
+        plan["quantity"] = quantity
+        if plan.get("receipt_id"):
+            rows = [(plan["line"], plan["name"], plan["ean"], plan["quantity"], plan["price"], plan["purchased_date"])]
+            rows += [(a["line"], a["name"], a["ean"], a["quantity"], a["price"], a["purchased_date"]) for a in group[1:]]
+            with db_lock:
+                coalesced = journal_coalesce(get_db(), plan["receipt_id"], rows, tenant)
+            if not coalesced:
+                planned.extend(dict(article, indexes=[i]) for i, article in zip(plan["indexes"], group))
+                continue
+        planned.append(plan)
+    return planned
+
+def transfer_articles(articles, concurrency=1, coalesce=BON_COALESCE_LINES):
+    """plan_articles + run_pipeline; liefert je Bon-Zeile True/False und meldet je eBon,
+    wie viele Bestandsbuchungen (HTTP-POSTs) das Zusammenfassen gespart hat."""
+    plans = plan_articles(articles, coalesce)
+    results = [False] * len(articles)
+    for plan, ok in zip(plans, run_pipeline(plans, concurrency)):
+        for i in plan["indexes"]:
+            results[i] = ok
+    counts = {}
+    for plan in plans:
+        lines, bookings = counts.get(plan.get("receipt_id"), (0, 0))
+        counts[plan.get("receipt_id")] = (lines + len(plan["indexes"]), bookings + 1)
+    for receipt_id, (lines, bookings) in counts.items():
+        saved = lines - bookings
+        metrics.count("stock_writes_saved", saved)
+        if saved:
+            log.info(f"{OK} eBon {receipt_id or ''}: {lines} Zeilen in {bookings} Bestandsbuchungen, "
+                     f"{saved} Schreibzugriffe an Grocy gespart.")
+    return results
+
+def process_article(article):
+    # Namensauflösung ist in resolve_articles bereits passiert, nicht doppelt suchen
+    journal_key = (article["receipt_id"], article["line"]) if article.get("receipt_id") else None
+    with metrics.timer("process_article"):
+        ok = bool(add_or_update_product(article["ean"], article["quantity"], article["price"],
+                                        bon_product_name=article["name"],
+                                        purchased_date=article["purchased_date"], resolve_name=False,
+                                        journal_key=journal_key))
+    metrics.count("articles_ok" if ok else "articles_failed")
+    return ok
+
+def process_group(articles):
+    return [process_article(article) for article in articles]
+
+def run_pipeline(articles, concurrency=1):
+    """Überträgt aufgelöste Artikel an Grocy; liefert je Artikel True/False.
+
+    Die Netzwerkschritte (Open Food Facts, Anlegen, Bild, Barcode, Bestand)
+    laufen für verschiedene EANs parallel in `concurrency` Threads. Alle
+    Zeilen mit derselben EAN landen in derselben Gruppe und werden dort in
+    Listen-Reihenfolge abgearbeitet, damit ein Produkt nie doppelt angelegt
+    wird: die erste Zeile legt es an, alle weiteren buchen nur Bestand.
+    """
+    if concurrency <= 1:
+        return [process_article(article) for article in articles]
+
+    # Grocy-Cache vorab laden, statt ihn im ersten Schwung mehrfach anzufordern
+    get_grocy_cache()
+    groups = {}
+    for index, article in enumerate(articles):
+        groups.setdefault(str(article["ean"]).strip(), []).append(index)
+    results = [False] * len(articles)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            submit(executor, process_group, [articles[i] for i in indexes]): indexes
+            for indexes in groups.values()
+        }
+        for future, indexes in futures.items():
+            for i, ok in zip(indexes, future.result()):
+                results[i] = ok
+    return results
+
+def process_articles(rewe_bon, purchased_date=None, concurrency=1, receipt_id=None, coalesce=BON_COALESCE_LINES):
+    """Verarbeitet alle Artikel eines eBons; liefert die Anzahl erfolgreicher Zeilen.
+
+    Die EANs werden zuerst lokal in einem Durchgang aufgelöst, danach werden
+    gleiche Artikel zusammengefasst (plan_articles) und übertragen. Mit
+    receipt_id wird jede Zeile im Journal geführt, ein erneuter Lauf bucht
+    bereits erledigte Zeilen nicht doppelt.
+    """
+    articles = resolve_articles([(product, purchased_date, receipt_id, line) for line, product in enumerate(rewe_bon)])
+    return sum(transfer_articles(articles, concurrency, coalesce))
+
+def process_receipts(receipts, concurrency=1):
+    """Verarbeitet mehrere eBons in einem Durchgang.
+
+    `receipts` ist eine Liste von (receipt_id, purchased_date, articles),
+    ältester Bon zuerst. Die Artikel aller Bons werden zusammengeführt: jedes
+    Produkt wird einmal aufgelöst und einmal angelegt, danach folgen die
+    Bestandsbuchungen je Kaufdatum. Liefert {receipt_id: (Zeilen, Fehler)}.
+    """
+    summary = {receipt_id: [0, 0] for receipt_id, _date, _bon in receipts}
+    # Ein Auflösungsdurchgang über alle Bons: jeder Bon-Name wird nur einmal gesucht
+    articles = resolve_articles([
+        (product, purchased_date, receipt_id, line)
+        for receipt_id, purchased_date, rewe_bon in receipts for line, product in enumerate(rewe_bon)
+    ])
+    for article, ok in zip(articles, transfer_articles(articles, concurrency)):
+        summary[article["receipt_id"]][0] += 1
+        summary[article["receipt_id"]][1] += int(not ok)
+    log.info(f"{len(articles)} Bon-Zeilen aus {len(receipts)} eBons, "
+             f"{len({str(a['ean']).strip() for a in articles})} verschiedene Produkte.")
+    return {receipt_id: tuple(counts) for receipt_id, counts in summary.items()}
+
+def retry_journal(concurrency=1):
+    """Wiederholt alle fehlgeschlagenen oder abgebrochenen Journal-Zeilen in einem Durchgang.
+
+    EAN, Menge, Preis und Kaufdatum kommen aus dem Journal, es wird nichts
+    neu aufgelöst. Liefert {receipt_id: (Zeilen, Fehler)} der wiederholten Zeilen.
+    """
+    with db_lock:
+        entries = open_journal_entries(get_db(), current_tenant().name)
+    articles = [
+        {"name": e["product_name"], "ean": e["ean"], "quantity": e["amount"], "price": e["price"],
+         "purchased_date": e["purchased_date"], "receipt_id": e["receipt_id"], "line": e["line"]}
+        for e in entries
+    ]
+    summary = {}
+    for article, ok in zip(articles, run_pipeline(articles, concurrency)):
+        counts = summary.setdefault(article["receipt_id"], [0, 0])
+        counts[0] += 1
+        counts[1] += int(not ok)
+    return {receipt_id: tuple(counts) for receipt_id, counts in summary.items()}
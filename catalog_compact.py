@@ -0,0 +1,79 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+from colorTerminal import OK
+from catalog_db import DB_FILE, TABLE_NAME, MIGRATIONS, migrate, migrate_v13
+from catalog_delta import export_deltas
+from catalog_snapshot import SqliteCatalog
+from fuzzy_index import ensure_fuzzy_index
+from logger import log, flush as flush_log
+from normalize import normalize_string
+
+# Kompaktiert die Katalog-DB: eine Zeile pro EAN (Schema-Version 13, die
+# jüngste Zeile bleibt), danach VACUUM. Vorher und nachher werden Größe und
+# Lookup-Zeit gemessen; optional werden die Tages-Deltas (catalog_delta)
+# neu geschrieben.
+#
+#   python catalog_compact.py [--db rewe_products.db] [--deltas catalog_deltas]
+
+def _checkpoint(conn):
+    # Im WAL-Modus stehen Änderungen sonst noch in der -wal-Datei
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def catalog_stats(conn, db_file, names, eans):
+    """Zeilen, EANs, Dateigröße und mittlere Lookup-Zeit (µs) über Namen und EANs."""
+    _checkpoint(conn)
+    rows, distinct = conn.execute(f"SELECT COUNT(*), COUNT(DISTINCT ean_norm) FROM {TABLE_NAME}").fetchone()
+    catalog = SqliteCatalog(conn)
+    start = time.perf_counter()
+    for name in names:
+        catalog.ean_by_name(name)
+    for ean in eans:
+        catalog.ean_by_code(ean)
+        catalog.image_by_ean(ean)
+    lookups = len(names) + 2 * len(eans)
+    micros = (time.perf_counter() - start) / lookups * 1e6 if lookups else 0.0
+    return {"rows": rows, "eans": distinct, "bytes": os.path.getsize(db_file), "lookup_us": micros}
+
+def compact_catalog(db_file=DB_FILE, delta_dir=None, sample=2000, seed=1):
+    """Dedupliziert, erzwingt eine Zeile pro EAN und gibt den Speicher frei; liefert (vorher, nachher)."""
+    conn = sqlite3.connect(db_file)
+    # Bis vor die Deduplizierung migrieren, damit "vorher" mit denselben Lookups misst
+    migrate(conn, MIGRATIONS.index(migrate_v13))
+    rows = conn.execute(f"SELECT name, ean_norm FROM {TABLE_NAME} WHERE ean_norm IS NOT NULL").fetchall()
+    picked = random.Random(seed).sample(rows, min(sample, len(rows)))
+    # Je zur Hälfte Treffer und Fehlschläge
+    names = [normalize_string(name) for name, _ean in picked if name] + [f"kein produkt {i}" for i in range(len(picked))]
+    eans = [ean for _name, ean in picked] + [f"00{i}" for i in range(len(picked))]
+    before = catalog_stats(conn, db_file, names, eans)
+
+    migrate(conn)
+    log.info(f"{OK} {before['rows'] - conn.execute(f'SELECT COUNT(*) FROM {TABLE_NAME}').fetchone()[0]} "
+             f"doppelte Zeilen entfernt.")
+    if ensure_fuzzy_index(conn):
+        log.info("Fuzzy-Index neu aufgebaut.")
+    conn.execute("VACUUM")
+    after = catalog_stats(conn, db_file, names, eans)
+
+    log.info(f"{'':12s} {'vorher':>12s} {'nachher':>12s}")
+    log.info(f"{'Zeilen':12s} {before['rows']:12d} {after['rows']:12d}")
+    log.info(f"{'EANs':12s} {before['eans']:12d} {after['eans']:12d}")
+    log.info(f"{'Größe':12s} {before['bytes'] / 1024:9.0f} KiB {after['bytes'] / 1024:9.0f} KiB")
+    log.info(f"{'Lookup':12s} {before['lookup_us']:10.1f} µs {after['lookup_us']:10.1f} µs")
+
+    if delta_dir:
+        written, unchanged, total_bytes = export_deltas(conn, delta_dir)
+        log.info(f"{OK} {written + unchanged} Tages-Deltas in {delta_dir}/, zusammen {total_bytes / 1024:.0f} KiB "
+                 f"({written} neu geschrieben).")
+    conn.close()
+    return before, after
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Katalog-DB deduplizieren und kompaktieren")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--deltas", metavar="DIR", help="Danach die Tages-Deltas nach DIR schreiben")
+    args = parser.parse_args()
+    compact_catalog(args.db, args.deltas)
+    flush_log()
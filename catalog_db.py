@@ -0,0 +1,326 @@
+import sqlite3
+from logger import log
+from normalize import normalize_string, match_key
+from price_history import CREATE_EANS_SQL, CREATE_PRICE_HISTORY_SQL, CREATE_REGIONS_SQL, CREATE_REGION_PRICES_SQL, SQL_DAY
+from receipt_ledger import CREATE_SYNCED_RECEIPTS_SQL
+from name_resolution import CREATE_NAME_RESOLUTION_SQL, STABLE_METHODS
+from off_cache import CREATE_OFF_PRODUCTS_SQL
+from grocy_journal import CREATE_GROCY_JOURNAL_SQL, CREATE_GROCY_JOURNAL_EAN_INDEX_SQL, CREATE_GROCY_JOURNAL_TENANT_EAN_INDEX_SQL
+
+DB_FILE = "rewe_products.db"
+TABLE_NAME = "products"
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    brand TEXT,
+    ean TEXT,
+    price REAL,
+    grammage TEXT,
+    category TEXT,
+    sale TEXT,
+    image TEXT,
+    date TEXT
+);
+"""
+
+# Eine Zeile pro EAN: die jüngste (Datum, dann zuletzt angelegt) bleibt
+DEDUP_PRODUCTS_SQL = f"""
+DELETE FROM {TABLE_NAME}
+WHERE ean_norm IS NOT NULL AND id NOT IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY ean_norm ORDER BY date DESC, id DESC) AS rank
+        FROM {TABLE_NAME} WHERE ean_norm IS NOT NULL
+    ) WHERE rank = 1
+)
+"""
+
+# Temporäre Staging-Tabelle für Importe (rewe_products_import) und Tages-Deltas
+# (catalog_delta): Zeilen werden hineingestreamt und danach mit wenigen
+# mengenbasierten Statements in die Produkttabelle gemergt.
+STAGING_TABLE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS staging (
+    name TEXT,
+    brand TEXT,
+    ean TEXT,
+    price REAL,
+    grammage TEXT,
+    category TEXT,
+    sale TEXT,
+    image TEXT,
+    name_norm TEXT,
+    ean_norm TEXT,
+    name_key TEXT
+);
+"""
+
+# Merge der Staging-Tabelle, für Importe und Tages-Deltas gleich: vorhandene
+# EANs bekommen nur Preis und Datum, Name und Stammdaten bleiben vom ersten
+# Auftreten. Die Produktzeile hält nur den jüngsten Preis der ersten Region; ältere
+# Tage (Nachimport) landen ausschließlich in der Preishistorie. Weitere
+# Regionen legen nur neue Produkte an, ihre Preise stehen in region_prices.
+UPDATE_FROM_STAGING_SQL = f"""
+UPDATE {TABLE_NAME} SET price = s.price, date = :date
+FROM staging AS s
+WHERE {TABLE_NAME}.ean_norm = s.ean_norm
+  AND ({TABLE_NAME}.date IS NULL OR {TABLE_NAME}.date <= :date)
+"""
+
+# Neue EANs anlegen; vorhandene fängt der UNIQUE-Index auf ean_norm ab
+INSERT_FROM_STAGING_SQL = f"""
+INSERT INTO {TABLE_NAME}
+    (name, brand, ean, price, grammage, category, sale, image, date, first_date, name_norm, ean_norm, name_key)
+SELECT name, brand, ean, price, grammage, category, sale, image, :date, :date, name_norm, ean_norm, name_key
+FROM staging AS s
+WHERE true
+ORDER BY s.rowid
+ON CONFLICT (ean_norm) DO NOTHING
+"""
+
+# Zähler in app_state für Änderungen an Namen, EAN oder Bild vorhandener
+# Zeilen (fuzzy_index.catalog_signature); neue und gelöschte Zeilen erfasst
+# die Signatur schon über COUNT(*) und MAX(id)
+CATALOG_EDITS_KEY = "catalog_edits"
+
+CREATE_PRODUCTS_EDITED_TRIGGER_SQL = f"""
+CREATE TRIGGER IF NOT EXISTS {TABLE_NAME}_edited
+AFTER UPDATE OF name, name_norm, name_key, ean, ean_norm, image ON {TABLE_NAME}
+WHEN OLD.name_norm IS NOT NEW.name_norm OR OLD.name_key IS NOT NEW.name_key OR OLD.ean IS NOT NEW.ean
+  OR OLD.ean_norm IS NOT NEW.ean_norm OR OLD.image IS NOT NEW.image
+BEGIN
+    UPDATE app_state SET value = value + 1 WHERE key = '{CATALOG_EDITS_KEY}';
+    DELETE FROM name_resolution
+    WHERE ean IN (OLD.ean, NEW.ean) OR bon_name = NEW.name_norm OR method NOT IN {STABLE_METHODS};
+END
+"""
+
+def migrate_v1(conn):
+    # Persistierte Suchspalten statt lower(trim(name)) / trim(ean) pro Anfrage
+    conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN name_norm TEXT")
+    conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN ean_norm TEXT")
+    conn.execute(f"UPDATE {TABLE_NAME} SET name_norm = normalize_string(name), ean_norm = trim(ean)")
+    # Covering-Indizes: die Lookups in grocy_connector lesen nur aus dem Index
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_name_norm ON {TABLE_NAME} (name_norm, ean)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_ean_norm ON {TABLE_NAME} (ean_norm, ean, image)")
+
+def migrate_v2(conn):
+    # Manifest der bereits abgerufenen Tages-CSVs (inkl. ETag/Last-Modified
+    # für bedingte Requests), damit ein Neustart fertige Tage überspringt
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_manifest (
+            date TEXT NOT NULL,
+            region TEXT NOT NULL,
+            status TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            rows INTEGER,
+            checked_at TEXT,
+            PRIMARY KEY (date, region)
+        ) WITHOUT ROWID
+    """)
+
+def migrate_v3(conn):
+    # Preishistorie statt Überschreiben: Startwerte sind die vorhandenen Zeilen
+    conn.execute(CREATE_EANS_SQL)
+    conn.execute(CREATE_PRICE_HISTORY_SQL)
+    conn.execute(f"""
+        INSERT OR IGNORE INTO eans (ean)
+        SELECT ean_norm FROM {TABLE_NAME} WHERE price > 0 AND ean_norm IS NOT NULL ORDER BY id
+    """)
+    conn.execute(f"""
+        INSERT OR REPLACE INTO price_history (ean_id, day, price_cents)
+        SELECT e.id, {SQL_DAY.format("p.date")}, CAST(round(p.price * 100) AS INTEGER)
+        FROM {TABLE_NAME} AS p JOIN eans AS e ON e.ean = p.ean_norm
+        WHERE p.price > 0 AND p.date IS NOT NULL
+        ORDER BY p.id
+    """)
+
+def migrate_v4(conn):
+    # Ledger der übertragenen eBons (main.py --sync-all)
+    conn.execute(CREATE_SYNCED_RECEIPTS_SQL)
+
+def migrate_v5(conn):
+    # Cache der EAN-Auflösung von Bon-Namen
+    conn.execute(CREATE_NAME_RESOLUTION_SQL)
+
+def migrate_v6(conn):
+    # Lokaler Open-Food-Facts-Cache (Live-Abfragen und importierte Dumps)
+    conn.execute(CREATE_OFF_PRODUCTS_SQL)
+
+def migrate_v7(conn):
+    # Matching-Schlüssel (normalize.match_key): Bon-Schreibweisen ohne Menge,
+    # Umlaute und Kürzel treffen den Katalog über einen exakten Index-Lookup
+    conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN name_key TEXT")
+    conn.execute(f"UPDATE {TABLE_NAME} SET name_key = nullif(match_key(name), '')")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_name_key ON {TABLE_NAME} (name_key, ean)")
+
+def migrate_v8(conn):
+    # Kleine Schlüssel/Wert-Tabelle für Laufzeit-Zustand, z.B. wann der
+    # Katalog zuletzt aktualisiert wurde (rewe_products_import.refresh_catalog)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID
+    """)
+
+def migrate_v9(conn):
+    # Journal der Grocy-Änderungen je eBon-Zeile (grocy_journal.py)
+    conn.execute(CREATE_GROCY_JOURNAL_SQL)
+    conn.execute(CREATE_GROCY_JOURNAL_EAN_INDEX_SQL)
+
+def migrate_v10(conn):
+    # Preise je Bundesland; Startwerte sind die Produktpreise der bisher
+    # importierten Region(en) aus dem Manifest
+    conn.execute(CREATE_REGIONS_SQL)
+    conn.execute(CREATE_REGION_PRICES_SQL)
+    conn.execute("INSERT OR IGNORE INTO regions (name) SELECT DISTINCT region FROM import_manifest ORDER BY region")
+    conn.execute(f"""
+        INSERT OR IGNORE INTO region_prices (ean_id, region_id, day, price_cents)
+        SELECT e.id, r.id, {SQL_DAY.format("p.date")}, CAST(round(p.price * 100) AS INTEGER)
+        FROM {TABLE_NAME} AS p JOIN eans AS e ON e.ean = p.ean_norm, regions AS r
+        WHERE p.price > 0 AND p.date IS NOT NULL
+    """)
+
+def _key_by_tenant(conn, table):
+    # Baut `table` mit tenant vorn im Primärschlüssel neu auf (SQLite kann den
+    # Schlüssel nicht per ALTER TABLE ändern); Spalten bleiben wie sie sind
+    columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    key = [name for _cid, name, *_rest, pk in sorted(columns, key=lambda c: c[5]) if pk]
+    if key[0] == "tenant":
+        return
+    definitions = [f"{name} {type_}" + (" NOT NULL" if notnull else "") +
+                   (f" DEFAULT {default}" if default is not None else "")
+                   for _cid, name, type_, notnull, default, _pk in columns]
+    names = ", ".join(column[1] for column in columns)
+    conn.execute(f"CREATE TABLE {table}_new ({', '.join(definitions)}, "
+                 f"PRIMARY KEY (tenant, {', '.join(key)})) WITHOUT ROWID")
+    conn.execute(f"INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def migrate_v11(conn):
+    # Mehrere Haushalte in einer DB (tenants.py): Ledger und Journal je
+    # Haushalt, bisherige Zeilen gehören zum Standard-Haushalt "". Der
+    # Haushalt gehört zum Schlüssel, sonst teilen sich Haushalte mit
+    # demselben REWE-Konto Journal-Zeilen und Ledger-Einträge.
+    conn.execute("ALTER TABLE synced_receipts ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+    conn.execute("ALTER TABLE grocy_journal ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+    _key_by_tenant(conn, "synced_receipts")
+    _key_by_tenant(conn, "grocy_journal")
+    conn.execute("DROP INDEX IF EXISTS idx_grocy_journal_ean")
+    conn.execute(CREATE_GROCY_JOURNAL_TENANT_EAN_INDEX_SQL)
+
+def migrate_v12(conn):
+    # Zusammengefasste eBon-Zeilen: Verweis auf die Zeile, die für sie bucht
+    conn.execute("ALTER TABLE grocy_journal ADD COLUMN merged_into INTEGER")
+
+def migrate_v13(conn):
+    # Ältere Importe konnten dieselbe EAN innerhalb einer Datei doppelt
+    # anlegen; ab jetzt erzwingt ein UNIQUE-Index eine Zeile pro EAN (der
+    # Import mergt per ON CONFLICT). Speicher gibt erst catalog_compact frei.
+    conn.execute(DEDUP_PRODUCTS_SQL)
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{TABLE_NAME}_ean_unique ON {TABLE_NAME} (ean_norm)")
+
+def migrate_v14(conn):
+    # Zeilen ohne EAN standen als "None" bzw. "" im Journal und teilten sich
+    # dadurch über journal_product_id ein Produkt; ab jetzt NULL
+    conn.execute("UPDATE grocy_journal SET ean = NULL WHERE ean IN ('None', '')")
+
+def migrate_v15(conn):
+    # Gleicher Name bei mehreren EANs: wie vor den Indizes gewinnt die zuerst
+    # angelegte Zeile (kleinste id), nicht die kleinste EAN
+    for column in ("name_norm", "name_key"):
+        conn.execute(f"DROP INDEX IF EXISTS idx_{TABLE_NAME}_{column}")
+        conn.execute(f"CREATE INDEX idx_{TABLE_NAME}_{column} ON {TABLE_NAME} ({column}, id, ean)")
+
+def migrate_v16(conn):
+    # DBs, die v11 schon vor dem Neuaufbau erreicht hatten: Schlüssel ohne tenant
+    _key_by_tenant(conn, "synced_receipts")
+    _key_by_tenant(conn, "grocy_journal")
+    conn.execute(CREATE_GROCY_JOURNAL_TENANT_EAN_INDEX_SQL)
+
+def migrate_v17(conn):
+    # Umbenennungen ändern weder COUNT(*) noch MAX(id): Fuzzy-Index und
+    # Snapshot würden sonst die alten Namen weiter liefern
+    conn.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES (?, 0)", (CATALOG_EDITS_KEY,))
+    conn.execute(CREATE_PRODUCTS_EDITED_TRIGGER_SQL)
+
+def migrate_v18(conn):
+    # Tag, an dem eine EAN zuerst im Katalog stand bzw. ein Regionalpreis
+    # zuerst galt: catalog_delta legt sie in diese Tagesdatei. Für vorhandene
+    # Zeilen der früheste bekannte Tag.
+    conn.execute("ALTER TABLE region_prices ADD COLUMN since INTEGER")
+    conn.execute("UPDATE region_prices SET since = day")
+    conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN first_date TEXT")
+    conn.execute(f"UPDATE {TABLE_NAME} SET first_date = substr(date, 1, 10)")
+    conn.execute(f"""
+        UPDATE {TABLE_NAME} SET first_date = h.first_date
+        FROM (SELECT e.ean, date(min(h.day) + 1721424.5) AS first_date
+              FROM price_history AS h JOIN eans AS e ON e.id = h.ean_id GROUP BY e.ean) AS h
+        WHERE {TABLE_NAME}.ean_norm = h.ean
+          AND ({TABLE_NAME}.first_date IS NULL OR h.first_date < {TABLE_NAME}.first_date)
+    """)
+
+# Index in der Liste + 1 = user_version nach der Migration
+MIGRATIONS = [
+    migrate_v1,
+    migrate_v2,
+    migrate_v3,
+    migrate_v4,
+    migrate_v5,
+    migrate_v6,
+    migrate_v7,
+    migrate_v8,
+    migrate_v9,
+    migrate_v10,
+    migrate_v11,
+    migrate_v12,
+    migrate_v13,
+    migrate_v14,
+    migrate_v15,
+    migrate_v16,
+    migrate_v17,
+    migrate_v18,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def _normalize_or_none(s):
+    return normalize_string(s) if s is not None else None
+
+def _match_key_or_none(s):
+    return match_key(s) if s is not None else None
+
+def migrate(conn, version=SCHEMA_VERSION):
+    """Bringt eine (auch ältere) Katalog-DB auf SCHEMA_VERSION (bzw. `version`)."""
+    conn.create_function("normalize_string", 1, _normalize_or_none, deterministic=True)
+    conn.create_function("match_key", 1, _match_key_or_none, deterministic=True)
+    conn.execute(CREATE_TABLE_SQL)
+    conn.commit()
+    while conn.execute("PRAGMA user_version").fetchone()[0] < version:
+        # Schreibsperre zuerst, dann die Version erneut lesen: eine zweite
+        # Verbindung (z.B. der Katalog-Import im Hintergrund) migriert nicht doppelt
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            number = conn.execute("PRAGMA user_version").fetchone()[0] + 1
+            if number <= version:
+                MIGRATIONS[number - 1](conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if number <= version:
+            log.info(f"Katalog-DB auf Schema-Version {number} migriert.")
+    return conn
+
+# Optionaler Callback für jedes ausgeführte SQL-Statement (z.B. Zähler im Benchmark),
+# gilt für alle danach geöffneten Verbindungen
+trace_callback = None
+
+def connect(db_file=DB_FILE, **kwargs):
+    conn = sqlite3.connect(db_file, **kwargs)
+    if trace_callback:
+        conn.set_trace_callback(trace_callback)
+    return migrate(conn)
@@ -0,0 +1,221 @@
+import argparse
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import date
+from colorTerminal import OK, WARN
+from config import CATALOG_DELTA_DIR
+from catalog_db import DB_FILE, TABLE_NAME, STAGING_TABLE_SQL, UPDATE_FROM_STAGING_SQL, INSERT_FROM_STAGING_SQL, connect
+from fuzzy_index import ensure_fuzzy_index
+from logger import log, flush as flush_log
+from name_resolution import INVALIDATE_RESOLUTIONS_SQL
+from normalize import normalize_string, match_key
+from price_history import SQL_DAY
+
+# Tages-Deltas des Katalogs: eine gzip-JSON-Datei pro Tag (YYYY-MM-DD.json.gz)
+# mit den Produkten, die an diesem Tag neu in den Katalog kamen (first_date,
+# Preis von diesem Tag), den Preisänderungen des Tages aus der Preishistorie,
+# den Regionalpreisen, die seit diesem Tag gelten (region_prices.since), und
+# den EANs, die am Vortag zuletzt in der CSV standen ("delisted").
+#
+# Vorhandene Zeilen ändert der Import nur über Preis und Datum: ein Produkt
+# steht daher nur in der Datei seines ersten Tages, spätere Tage enthalten
+# nur Neues und Änderungen, und ältere Dateien bleiben beim nächsten Export
+# unverändert (bis auf Regionalpreise, die inzwischen neu gelten, und
+# wieder gelistete Produkte). Eingespielt ergibt sich derselbe Katalog wie
+# beim Import der Tages-CSVs.
+#
+# Wer den Stand bis Tag D hat, braucht nur die Dateien nach D; eine frische
+# Installation spielt alle ein statt die Tages-CSVs seit START_DATE abzurufen
+# oder die komplette DB mitzuliefern. Der zuletzt eingespielte bzw.
+# exportierte Tag steht in app_state, danach setzt der Import am letzten Tag
+# der Produkttabelle fort.
+
+DELTA_SUFFIX = ".json.gz"
+DELTA_STATE_KEY = "catalog_delta_day"
+
+PRODUCT_COLUMNS = ("name", "brand", "ean", "price", "grammage", "category", "sale", "image")
+
+# Produkte je erstem Tag; Preis an diesem Tag aus der Preishistorie (0 vor
+# dem ersten Preis), ohne Historie der Preis der Produktzeile
+PRODUCTS_BY_FIRST_DATE_SQL = f"""
+SELECT p.first_date, p.name, p.brand, p.ean,
+       CASE WHEN EXISTS (SELECT 1 FROM price_history AS h WHERE h.ean_id = e.id)
+            THEN coalesce((SELECT h.price_cents FROM price_history AS h
+                           WHERE h.ean_id = e.id AND h.day <= {SQL_DAY.format("p.first_date")}
+                           ORDER BY h.day DESC LIMIT 1) / 100.0, 0.0)
+            ELSE p.price END,
+       p.grammage, p.category, p.sale, p.image
+FROM {TABLE_NAME} AS p LEFT JOIN eans AS e ON e.ean = p.ean_norm
+WHERE p.first_date IS NOT NULL AND p.ean_norm IS NOT NULL
+ORDER BY p.id
+"""
+
+# Weiter gelistete Produkte (Datum = vorheriger Tag, nicht in "delisted")
+# bekommen das Datum des Tages wie beim CSV-Import
+STILL_LISTED_SQL = f"""
+UPDATE {TABLE_NAME} SET date = :date
+WHERE :previous < :date AND substr(date, 1, 10) = :previous
+  AND ean_norm NOT IN (SELECT value FROM json_each(:delisted))
+"""
+
+# Preisänderungen eines Tages in die Produktzeile, mit derselben Bedingung
+# wie UPDATE_FROM_STAGING_SQL beim Import; am selben Tag neue Produkte
+# tragen den Preis schon
+PRICE_CHANGES_TO_PRODUCTS_SQL = f"""
+UPDATE {TABLE_NAME} SET price = h.price_cents / 100.0, date = :date
+FROM price_history AS h JOIN eans AS e ON e.id = h.ean_id
+WHERE {TABLE_NAME}.ean_norm = e.ean AND h.day = :day AND {TABLE_NAME}.first_date IS NOT :date
+  AND ({TABLE_NAME}.date IS NULL OR {TABLE_NAME}.date <= :date)
+"""
+
+def _day(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+def delta_state(conn):
+    row = conn.execute("SELECT value FROM app_state WHERE key = ?", (DELTA_STATE_KEY,)).fetchone()
+    return row[0] if row else ""
+
+def _record_state(conn, day):
+    conn.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)", (DELTA_STATE_KEY, day))
+
+def collect_deltas(conn):
+    """{Tag: Delta-Dict} aus dem aktuellen Katalog."""
+    deltas = defaultdict(lambda: {"products": [], "price_history": [], "region_prices": [], "delisted": []})
+    for row in conn.execute(PRODUCTS_BY_FIRST_DATE_SQL):
+        deltas[row[0]]["products"].append(list(row[1:]))
+    for day, ean, cents in conn.execute(
+            "SELECT h.day, e.ean, h.price_cents FROM price_history AS h JOIN eans AS e ON e.id = h.ean_id ORDER BY h.day, e.id"):
+        deltas[_day(day)]["price_history"].append([ean, cents])
+    for day, region, ean, cents in conn.execute("""
+            SELECT p.since, r.name, e.ean, p.price_cents FROM region_prices AS p
+            JOIN regions AS r ON r.id = p.region_id JOIN eans AS e ON e.id = p.ean_id
+            ORDER BY p.since, r.id, e.id"""):
+        deltas[_day(day)]["region_prices"].append([region, ean, cents])
+    # Datum = letzter Tag in der CSV: wer vor dem jüngsten Tag zuletzt gelistet
+    # war, steht in der folgenden Tagesdatei unter "delisted"
+    listed = conn.execute(f"SELECT substr(date, 1, 10), ean_norm FROM {TABLE_NAME} "
+                          f"WHERE date IS NOT NULL AND ean_norm IS NOT NULL ORDER BY id").fetchall()
+    days = sorted(set(deltas) | {day for day, _ean in listed})
+    following = dict(zip(days, days[1:]))
+    for day in days:
+        deltas[day]
+    for day, ean in listed:
+        if day in following:
+            deltas[following[day]]["delisted"].append(ean)
+    return deltas
+
+def export_deltas(conn, out_dir=CATALOG_DELTA_DIR):
+    """Schreibt die Tages-Deltas nach `out_dir`; unveränderte Dateien bleiben liegen,
+    überholte werden gelöscht. Liefert (geschrieben, unverändert, Bytes gesamt)."""
+    os.makedirs(out_dir, exist_ok=True)
+    deltas = collect_deltas(conn)
+    written = unchanged = total_bytes = 0
+    for day in sorted(deltas):
+        payload = dict(deltas[day], day=day)
+        # mtime=0: gleicher Inhalt ergibt dieselben Bytes, die Datei wird dann nicht neu geschrieben
+        data = gzip.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), mtime=0)
+        total_bytes += len(data)
+        path = os.path.join(out_dir, day + DELTA_SUFFIX)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    unchanged += 1
+                    continue
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        written += 1
+    for name in os.listdir(out_dir):
+        if name.endswith(DELTA_SUFFIX) and name[:-len(DELTA_SUFFIX)] not in deltas:
+            os.remove(os.path.join(out_dir, name))
+    if deltas:
+        _record_state(conn, max(deltas))
+        conn.commit()
+    return written, unchanged, total_bytes
+
+def _staging_row(product):
+    name, ean = product[0], product[2]
+    return (*product, normalize_string(name) if name is not None else None, str(ean).strip(),
+            match_key(name) or None if name is not None else None)
+
+def apply_delta(conn, payload):
+    """Spielt ein Tages-Delta in einer Transaktion ein; liefert die Anzahl neuer oder geänderter Produkte."""
+    day = payload["day"]
+    ordinal = date.fromisoformat(day).toordinal()
+    conn.execute(STAGING_TABLE_SQL)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(STILL_LISTED_SQL, {"date": day, "previous": delta_state(conn),
+                                        "delisted": json.dumps(payload.get("delisted", []))})
+        conn.execute("DELETE FROM staging")
+        conn.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (_staging_row(product) for product in payload["products"]))
+        # Gleiche Regeln wie der CSV-Import: der Katalog endet im selben Stand
+        changed = conn.execute(UPDATE_FROM_STAGING_SQL, {"date": day}).rowcount
+        conn.execute(INVALIDATE_RESOLUTIONS_SQL)
+        changed += conn.execute(INSERT_FROM_STAGING_SQL, {"date": day}).rowcount
+        conn.execute("DELETE FROM staging")
+        eans = {ean for ean, _cents in payload["price_history"]}
+        eans.update(ean for _region, ean, _cents in payload["region_prices"])
+        conn.executemany("INSERT OR IGNORE INTO eans (ean) VALUES (?)", ((ean,) for ean in sorted(eans)))
+        conn.executemany("""
+            INSERT OR REPLACE INTO price_history (ean_id, day, price_cents)
+            SELECT id, ?, ? FROM eans WHERE ean = ?
+        """, ((ordinal, cents, ean) for ean, cents in payload["price_history"]))
+        changed += conn.execute(PRICE_CHANGES_TO_PRODUCTS_SQL, {"day": ordinal, "date": day}).rowcount
+        conn.executemany("INSERT OR IGNORE INTO regions (name) VALUES (?)",
+                         ((region,) for region in sorted({region for region, _e, _c in payload["region_prices"]})))
+        conn.executemany("""
+            INSERT INTO region_prices (ean_id, region_id, day, price_cents, since)
+            SELECT e.id, r.id, ?1, ?2, ?1 FROM eans AS e, regions AS r WHERE e.ean = ?3 AND r.name = ?4
+            ON CONFLICT (ean_id, region_id) DO UPDATE SET day = excluded.day, price_cents = excluded.price_cents,
+                since = excluded.since
+            WHERE excluded.day >= region_prices.day
+        """, ((ordinal, cents, ean, region) for region, ean, cents in payload["region_prices"]))
+        if day > delta_state(conn):
+            _record_state(conn, day)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return changed
+
+def apply_deltas(conn, in_dir=CATALOG_DELTA_DIR):
+    """Spielt alle Deltas aus `in_dir` nach dem zuletzt eingespielten Tag ein; liefert die Anzahl Dateien."""
+    if not os.path.isdir(in_dir):
+        return 0
+    applied = delta_state(conn)
+    names = sorted(name for name in os.listdir(in_dir)
+                   if name.endswith(DELTA_SUFFIX) and name[:-len(DELTA_SUFFIX)] > applied)
+    products = 0
+    for name in names:
+        try:
+            with gzip.open(os.path.join(in_dir, name), "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning(f"{WARN} Delta {name} nicht lesbar, überspringe: {e}")
+            continue
+        products += apply_delta(conn, payload)
+    if names:
+        ensure_fuzzy_index(conn)
+        log.info(f"{OK} {len(names)} Tages-Deltas aus {in_dir} eingespielt ({products} Produkte).")
+    return len(names)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tages-Deltas des REWE-Katalogs schreiben oder einspielen")
+    parser.add_argument("action", choices=["export", "apply"])
+    parser.add_argument("dir", nargs="?", default=CATALOG_DELTA_DIR, help=f"Verzeichnis (Standard: {CATALOG_DELTA_DIR})")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    conn = connect(args.db)
+    if args.action == "export":
+        written, unchanged, total_bytes = export_deltas(conn, args.dir)
+        log.info(f"{OK} {written} Tages-Deltas geschrieben, {unchanged} unverändert, "
+                 f"zusammen {total_bytes / 1024:.0f} KiB in {args.dir}/")
+    else:
+        apply_deltas(conn, args.dir)
+    conn.close()
+    flush_log()
@@ -0,0 +1,313 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from fuzzy_index import FuzzyIndex, catalog_signature, ensure_fuzzy_index, get_fuzzy_index
+
+# Schreibgeschützter Katalog-Snapshot als Alternative zu SQLite für die
+# Lookups in grocy_connector (Name, Matching-Schlüssel, EAN, Bild, Fuzzy).
+#
+# Die Datei wird per mmap geöffnet und nie in Python-Objekte umkopiert:
+#   - ein String-Pool (UTF-8), jeder Text genau einmal, dazu Offsets (uint32)
+#   - sortierte Schlüssel-Tabellen als uint32-Arrays von String-IDs
+#     (name_norm, name_key, ean_norm, Bigramme), Suche per Binärsuche
+#   - der Fuzzy-Index (Namen, EANs, Längen, Postings) als uint32-Arrays
+# Der Kopf ist ein kleines JSON mit Signatur (fuzzy_index.catalog_signature)
+# und Lage der Abschnitte. Sortiert wird nach UTF-8-Bytes, das entspricht
+# der BINARY-Sortierung von SQLite; bei mehreren Zeilen pro Schlüssel gilt
+# daher dieselbe Zeile wie bei den Index-Lookups in SQLite.
+
+MAGIC = b"RGSNAP01"
+NONE = 0xFFFFFFFF  # String-ID für NULL
+ALIGN = 8
+
+def _first_per_key(rows):
+    # Zeilen sind nach (Schlüssel, id) sortiert: die erste gewinnt wie beim Index-Lookup
+    result = {}
+    for key, *values in rows:
+        result.setdefault(key, values)
+    return result
+
+class _Pool:
+    def __init__(self):
+        self.ids = {}
+        self.data = bytearray()
+        self.offsets = array("I", [0])
+
+    def add(self, s):
+        if s is None:
+            return NONE
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.offsets) - 1
+            self.data += s.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return i
+
+def _sorted_table(pool, mapping):
+    keys = sorted(mapping, key=lambda k: k.encode("utf-8"))
+    return keys, array("I", (pool.add(k) for k in keys))
+
+def export_snapshot(conn, path):
+    """Schreibt den Snapshot der Katalog-DB nach `path` (atomar); liefert die Anzahl Produkte."""
+    ensure_fuzzy_index(conn)
+    signature = conn.execute("SELECT value FROM fuzzy_meta WHERE key = 'signature'").fetchone()[0]
+    pool = _Pool()
+    sections = {}
+
+    def lookup_table(prefix, sql, columns):
+        mapping = _first_per_key(conn.execute(sql))
+        keys, key_ids = _sorted_table(pool, mapping)
+        sections[f"{prefix}_key"] = key_ids
+        for n, column in enumerate(columns):
+            sections[f"{prefix}_{column}"] = array("I", (pool.add(mapping[k][n]) for k in keys))
+
+    lookup_table("name", "SELECT name_norm, ean FROM products WHERE name_norm IS NOT NULL ORDER BY name_norm, id",
+                 ("ean",))
+    lookup_table("key", "SELECT name_key, ean FROM products WHERE name_key IS NOT NULL ORDER BY name_key, id",
+                 ("ean",))
+    lookup_table("code", "SELECT ean_norm, ean, image FROM products WHERE ean_norm IS NOT NULL "
+                         "ORDER BY ean_norm, ean, image", ("ean", "image"))
+
+    # Fuzzy-Index: ID 0 ist wie in FuzzyIndex ein Platzhalter
+    fuzzy_name, fuzzy_ean, fuzzy_len = array("I", [NONE]), array("I", [NONE]), array("I", [0])
+    for _i, name, ean, length in conn.execute("SELECT id, name_norm, ean, len FROM fuzzy_names ORDER BY id"):
+        fuzzy_name.append(pool.add(name))
+        fuzzy_ean.append(pool.add(ean))
+        fuzzy_len.append(length)
+    by_len = sorted(range(1, len(fuzzy_len)), key=lambda i: fuzzy_len[i])
+    len_start = array("I", [0] * (max(fuzzy_len) + 2))
+    for i in by_len:
+        len_start[fuzzy_len[i] + 1] += 1
+    for length in range(1, len(len_start)):
+        len_start[length] += len_start[length - 1]
+    postings = dict(conn.execute("SELECT gram, ids FROM fuzzy_postings"))
+    grams, gram_ids = _sorted_table(pool, postings)
+    gram_start, gram_postings = array("I", [0]), array("I")
+    for gram in grams:
+        gram_postings.frombytes(postings[gram])
+        gram_start.append(len(gram_postings))
+    sections.update(fuzzy_name=fuzzy_name, fuzzy_ean=fuzzy_ean, fuzzy_len=fuzzy_len,
+                    len_ids=array("I", by_len), len_start=len_start,
+                    gram_key=gram_ids, gram_start=gram_start, gram_postings=gram_postings)
+    sections["pool_offsets"] = pool.offsets
+    sections["pool"] = bytes(pool.data)
+
+    layout = {}
+    body = bytearray()
+    for name, data in sections.items():
+        raw = data.tobytes() if isinstance(data, array) else data
+        body += b"\0" * (-len(body) % ALIGN)
+        layout[name] = [len(body), len(raw)]
+        body += raw
+    header = json.dumps({"signature": signature, "byteorder": sys.byteorder, "products": len(fuzzy_name) - 1,
+                         "sections": layout}).encode("utf-8")
+    header_len = len(header) + (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(header_len.to_bytes(4, "little"))
+        f.write(header.ljust(header_len))
+        f.write(body)
+    os.replace(tmp_path, path)
+    return len(fuzzy_name) - 1
+
+class _Strings:
+    """Sequenz-Sicht auf String-IDs (z.B. FuzzyIndex.names), dekodiert erst beim Zugriff."""
+
+    def __init__(self, snapshot, ids):
+        self._snapshot = snapshot
+        self._ids = ids
+
+    def __getitem__(self, i):
+        return self._snapshot.string(self._ids[i])
+
+    def __len__(self):
+        return len(self._ids)
+
+class _Postings:
+    """dict-ähnliche Sicht auf die Postings-Listen: get(gram) liefert eine memoryview ohne Kopie."""
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._found = {}  # Bereits gesuchte Bigramme (candidates fragt jedes mehrfach ab)
+
+    def get(self, gram, default=None):
+        ids = self._found.get(gram, False)
+        if ids is False:
+            s = self._snapshot
+            i = s.find("gram_key", gram)
+            start = s.section("gram_start")
+            ids = None if i is None else s.section("gram_postings")[start[i]:start[i + 1]]
+            self._found[gram] = ids
+        return default if ids is None else ids
+
+class _ByLength:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def get(self, length, default=()):
+        start = self._snapshot.section("len_start")
+        if length + 1 >= len(start):
+            return default
+        return self._snapshot.section("len_ids")[start[length]:start[length + 1]]
+
+class SnapshotFuzzyIndex(FuzzyIndex):
+    """FuzzyIndex mit denselben Suchfunktionen, aber Daten direkt aus dem Snapshot."""
+
+    def __init__(self, snapshot):
+        self.names = _Strings(snapshot, snapshot.section("fuzzy_name"))
+        self.eans = _Strings(snapshot, snapshot.section("fuzzy_ean"))
+        self.lens = snapshot.section("fuzzy_len")
+        self.max_len = max(self.lens, default=0)
+        self.by_len = _ByLength(snapshot)
+        self.postings = _Postings(snapshot)
+
+class CatalogSnapshot:
+    """Per mmap geöffneter Snapshot; gleiche Lookup-Methoden wie SqliteCatalog."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} ist kein Katalog-Snapshot")
+        header_len = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 4], "little")
+        start = len(MAGIC) + 4
+        header = json.loads(self._mmap[start:start + header_len])
+        if header["byteorder"] != sys.byteorder:
+            self.close()
+            raise ValueError(f"{path} wurde auf einer Plattform mit anderer Byte-Reihenfolge erzeugt")
+        self.signature = header["signature"]
+        self.products = header["products"]
+        view = memoryview(self._mmap)
+        base = start + header_len
+        self._views = [view]
+        self._sections = {}
+        for name, (offset, length) in header["sections"].items():
+            data = view[base + offset:base + offset + length]
+            self._views.append(data)
+            self._sections[name] = data if name == "pool" else data.cast("I")
+            self._views.append(self._sections[name])
+        self._pool_base = base + header["sections"]["pool"][0]
+        self._offsets = self._sections["pool_offsets"]
+        self._fuzzy_index = None
+
+    def close(self):
+        self._sections = {}
+        self._offsets = None
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.postings._found.clear()
+        self._fuzzy_index = None
+        for view in reversed(getattr(self, "_views", [])):
+            view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # Aufrufer hält noch Postings: das mmap wird mit ihnen freigegeben
+
+    def section(self, name):
+        return self._sections[name]
+
+    def _raw(self, i):
+        return self._mmap[self._pool_base + self._offsets[i]:self._pool_base + self._offsets[i + 1]]
+
+    def string(self, i):
+        return None if i == NONE else self._raw(i).decode("utf-8")
+
+    def find(self, table, key):
+        """Position von `key` in einer sortierten Schlüssel-Tabelle oder None."""
+        ids = self._sections[table]
+        encoded = key.encode("utf-8")
+        lo, hi = 0, len(ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._raw(ids[mid]) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(ids) and self._raw(ids[lo]) == encoded:
+            return lo
+        return None
+
+    def _get(self, prefix, key, column):
+        i = self.find(f"{prefix}_key", key)
+        return None if i is None else self.string(self._sections[f"{prefix}_{column}"][i])
+
+    def ean_by_name(self, name_norm):
+        return self._get("name", name_norm, "ean") or None
+
+    def ean_by_key(self, name_key):
+        return self._get("key", name_key, "ean") or None
+
+    def ean_by_code(self, ean_norm):
+        return self._get("code", ean_norm, "ean") or None
+
+    def image_by_ean(self, ean_norm):
+        return self._get("code", ean_norm, "image") or None
+
+    def fuzzy_index(self):
+        if self._fuzzy_index is None:
+            self._fuzzy_index = SnapshotFuzzyIndex(self)
+        return self._fuzzy_index
+
+class SqliteCatalog:
+    """Die bisherigen Index-Lookups auf der Katalog-DB (Standard-Backend)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _ean(self, column, value):
+        row = self.conn.execute(f"SELECT ean FROM products WHERE {column} = ? ORDER BY id LIMIT 1",
+                                (value,)).fetchone()
+        return row[0] if row and row[0] else None
+
+    def ean_by_name(self, name_norm):
+        return self._ean("name_norm", name_norm)
+
+    def ean_by_key(self, name_key):
+        return self._ean("name_key", name_key)
+
+    def ean_by_code(self, ean_norm):
+        return self._ean("ean_norm", ean_norm)
+
+    def image_by_ean(self, ean_norm):
+        row = self.conn.execute("SELECT image FROM products WHERE ean_norm = ?", (ean_norm,)).fetchone()
+        return row[0] if row and row[0] else None
+
+    def fuzzy_index(self):
+        # Wird nur neu aufgebaut, wenn sich der Katalog geändert hat
+        ensure_fuzzy_index(self.conn)
+        return get_fuzzy_index(self.conn)
+
+def open_snapshot(path, conn=None):
+    """Öffnet den Snapshot, falls vorhanden und (mit `conn`) zum Stand der DB passend; sonst None."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = CatalogSnapshot(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if conn is not None and catalog_signature(conn) != snapshot.signature:
+        snapshot.close()
+        return None
+    return snapshot
+
+if __name__ == "__main__":
+    import argparse
+    from catalog_db import DB_FILE, connect
+    from colorTerminal import OK
+    from config import CATALOG_SNAPSHOT_FILE
+    from logger import log, flush as flush_log
+    parser = argparse.ArgumentParser(description="Katalog-Snapshot für CATALOG_BACKEND = \"snapshot\" schreiben")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--out", default=CATALOG_SNAPSHOT_FILE)
+    args = parser.parse_args()
+    conn = connect(args.db)
+    try:
+        count = export_snapshot(conn, args.out)
+    finally:
+        conn.close()
+    log.info(f"{OK} Snapshot mit {count} Produktnamen geschrieben: {args.out} ({os.path.getsize(args.out) / 1024:.0f} KiB)")
+    flush_log()
@@ -2,6 +2,7 @@ GROCY_API_URL = "https://example.com:443" # Your GROCY URL in format "https://ho
 GROCY_API_KEY = "abcdefg" # Create one at yourgrocyinstance.com/manageapikeys
 GROCY_LOCATION_ID = 1 # In Grocy you can setup stores, enter the ID for your Store Entry for REWE, only necessary if you want to use Price-tracking
 BON_HISTORY = 10 # The amount of REWE eBons listed in the overview. Default = 10
+SYNC_FIRST_RUN_RECEIPTS = BON_HISTORY  # Erster --sync-all/--serve-Lauf (leeres Ledger): nur die neuesten n eBons übertragen, ältere überspringen (--backfill holt sie nach)
 
 GROCY_LOCATION_ID_KUEHLSCHRANK = 2  # ID für Kühlschrank
 
@@ -9,3 +10,52 @@ GROCY_DEFAULT_BEST_BEFORE_DAYS = 30  # Standard-MHD in Tagen
 GROCY_MIN_STOCK_AMOUNT = 0           # Mindestbestand
 
 HARDCODED_RTSP_TOKEN = "YOUR_RTSP_TOKEN_HERE"  # Dein REWE RTSP-Token für die eBon-Abfrage
+
+GROCY_CACHE_FILE = "grocy_cache.json"  # Lokale Kopie der Grocy-Produkte/Barcodes
+GROCY_CACHE_MAX_AGE = 0                # Sekunden, die die Kopie gültig bleibt (0 = nur im Speicher, jeder Lauf lädt neu)
+
+HTTP_TIMEOUT = 10      # Sekunden pro Request
+HTTP_RETRIES = 3       # Wiederholungen bei Verbindungsfehlern, 429 und 5xx (POST nur bei Verbindungsfehlern)
+HTTP_BACKOFF = 0.5     # Wartezeit-Faktor zwischen Wiederholungen (0.5s, 1s, 2s, ...)
+HTTP_POOL_SIZE = 10    # Offene Verbindungen pro Host
+HTTP_HOST_CONCURRENCY = 8  # Gleichzeitige Requests pro Host über alle Threads/Haushalte (0 = unbegrenzt)
+HTTP_HOST_RATE = 0         # Requests pro Sekunde und Host im Mittel, z.B. 20 für ein Grocy auf dem Raspberry Pi (0 = unbegrenzt)
+HTTP_HOST_BURST = 10       # So viele Requests dürfen bei HTTP_HOST_RATE direkt hintereinander gehen
+
+BON_CONCURRENCY = 4    # Parallel verarbeitete Artikel pro eBon (1 = nacheinander wie bisher)
+BON_COALESCE_LINES = True  # Gleiche Artikel eines eBons (EAN + Kaufdatum) mit einer Bestandsbuchung übertragen
+
+IMAGE_CACHE_DIR = "image_cache"           # Lokaler Cache der Produktbilder
+IMAGE_CACHE_MAX_BYTES = 100 * 1024 * 1024  # Ältere Bilder werden ab dieser Größe gelöscht
+IMAGE_MAX_DIMENSION = 0                    # Bilder vor dem Upload auf max. Kantenlänge verkleinern (0 = aus, benötigt Pillow)
+IMAGE_WORKERS = 2                          # Parallele Bild-Downloads/-Uploads im Hintergrund
+
+OFF_SKIP_IF_BON_NAME = True        # Open Food Facts nicht abfragen, wenn der Bon-Name bekannt ist (er wird ohnehin verwendet)
+OFF_ONLINE = True                  # False = nur lokaler Cache/Dump (python off_cache.py <dump>), keine Live-Abfragen
+OFF_CACHE_TTL = 30 * 24 * 3600     # Sekunden, die ein gefundenes Produkt im Cache gültig bleibt
+OFF_NEGATIVE_TTL = 7 * 24 * 3600   # Sekunden, die "nicht gefunden" im Cache gültig bleibt
+
+LOG_LEVEL = "INFO"         # DEBUG zeigt jeden Einzelschritt pro Artikel, WARNING nur Probleme
+LOG_BUFFER_LINES = 200     # Ausgabe wird blockweise geschrieben (Warnungen/Fehler sofort)
+
+METRICS_JSON_FILE = "metrics.json"   # Zeiten und Zähler des letzten Laufs ("" = aus)
+METRICS_TEXTFILE = ""                # Zusätzlich als Textfile für Prometheus, z.B. node_exporter textfile collector ("" = aus)
+METRICS_TEXTFILE_FORMAT = "prometheus"  # oder "openmetrics"
+
+CATALOG_REFRESH_INTERVAL_DAYS = 1   # REWE-Katalog höchstens alle n Tage beim Start aktualisieren (0 = bei jedem Start)
+CATALOG_REFRESH_BACKGROUND = True   # Aktualisierung im Hintergrund, während die eBon-Liste geladen wird
+CATALOG_REGIONS = ["schleswig-holstein"]   # Bundesländer der Tages-CSVs; das erste liefert Produktpreis und Preishistorie
+CATALOG_IMPORT_PROCESSES = 0        # Worker-Prozesse für den Import (0 = eines je Bundesland, höchstens CPU-Kerne)
+CATALOG_BACKEND = "sqlite"          # "snapshot" = Katalog-Lookups aus einer per mmap geöffneten Datei statt SQLite
+CATALOG_SNAPSHOT_FILE = "rewe_products.snap"  # Wird nach jedem Import bzw. bei Bedarf neu geschrieben
+CATALOG_DELTA_DIR = "catalog_deltas"  # Tages-Deltas (catalog_delta.py), die vor dem Import eingespielt werden, falls vorhanden
+
+SERVE_HOST = "127.0.0.1"          # Adresse des Status-/Sync-Endpoints im Dienst-Modus (main.py --serve)
+SERVE_PORT = 8089                 # Port des Endpoints (0 = kein Endpoint)
+SERVE_POLL_INTERVAL = 15 * 60     # Sekunden zwischen zwei Abfragen der eBon-Liste
+SERVE_BACKOFF_BASE = 60           # Wartezeit nach dem ersten Fehler, verdoppelt sich bei jedem weiteren
+SERVE_BACKOFF_MAX = 60 * 60       # Längste Wartezeit nach Fehlern
+SERVE_GROCY_CACHE_MAX_AGE = 3600  # Grocy-Cache im Speicher nach so vielen Sekunden neu laden
+
+TENANTS_FILE = "tenants.json"     # Mehrere Haushalte in einem Prozess (main.py --tenants), Format siehe tenants.py
+TENANT_CONCURRENCY = 4            # Haushalte, die gleichzeitig synchronisiert werden
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lokale Attrappen der externen Dienste für Benchmarks, ohne Netz und ohne echtes Grocy.
+# Jede Antwort wird um `latency` Sekunden verzögert; mit Wahrscheinlichkeit
+# `error_rate` kommt statt der Antwort ein 503 (reproduzierbar über `seed`).
+
+FAKE_IMAGE = b"\xff\xd8\xff\xe0" + b"\x00" * 8192
+FAKE_IMAGE_ETAG = '"fake-image-1"'
+
+def json_response(status, obj):
+    return status, json.dumps(obj).encode(), {"Content-Type": "application/json"}
+
+class FakeServer:
+    """ThreadingHTTPServer auf 127.0.0.1; Unterklassen implementieren handle()."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=1, port=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.reset()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset(self):
+        with self.lock:
+            self.calls = Counter()
+            self.errors = 0
+            self.reset_state()
+
+    def reset_state(self):
+        pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method, path, headers, body):
+        """Liefert (status, body_bytes, header_dict)."""
+        return json_response(404, {"error_message": "not found"})
+
+    def _dispatch(self, request):
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        with self.lock:
+            self.calls[f"{request.command} {re.sub(r'/[0-9]+', '/{id}', request.path)}"] += 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            status, payload, headers = json_response(503, {"error_message": "simulierter Fehler"})
+        else:
+            status, payload, headers = self.handle(request.command, request.path, request.headers, body)
+        try:
+            request.send_response(status)
+            request.send_header("Content-Length", str(len(payload)))
+            for name, value in headers.items():
+                request.send_header(name, value)
+            request.end_headers()
+            request.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client hat aufgegeben (Timeout, beendeter Prozess)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._dispatch(self)
+
+            def do_POST(self):
+                fake._dispatch(self)
+
+            def do_PUT(self):
+                fake._dispatch(self)
+
+        return Handler
+
+class FakeGrocy(FakeServer):
+    """Minimales Grocy: Produkte, Barcodes, Bestand und Bild-Upload unter /api."""
+
+    def reset_state(self):
+        self.products = []
+        self.barcodes = []
+        self.stock = []
+
+    def handle(self, method, path, headers, body):
+        with self.lock:
+            if method == "GET":
+                if path == "/api/objects/products":
+                    return json_response(200, self.products)
+                if path == "/api/objects/product_barcodes":
+                    return json_response(200, self.barcodes)
+                match = re.fullmatch(r"/api/stock/products/by-barcode/(.+)", path)
+                if match:
+                    for barcode in self.barcodes:
+                        if barcode["barcode"] == match.group(1):
+                            return json_response(200, {"product": {"id": barcode["product_id"]}})
+                    return json_response(400, {"error_message": "No product with barcode found"})
+            elif method == "POST":
+                data = json.loads(body or b"{}")
+                if path == "/api/objects/products":
+                    self.products.append(dict(data, id=len(self.products) + 1))
+                    return json_response(200, {"created_object_id": len(self.products)})
+                if path == "/api/objects/product_barcodes":
+                    self.barcodes.append(data)
+                    return json_response(200, {"created_object_id": len(self.barcodes)})
+                match = re.fullmatch(r"/api/stock/products/([0-9]+)/add", path)
+                if match:
+                    self.stock.append(dict(data, product_id=int(match.group(1))))
+                    return json_response(200, [{"id": len(self.stock)}])
+            elif method == "PUT" and path.startswith("/api/"):
+                return 204, b"", {}
+        return json_response(404, {"error_message": "not found"})
+
+class FakeOpenFoodFacts(FakeServer):
+    """/api/v0/product/<ean>.json; bekannt sind nur die EANs aus `products`."""
+
+    def __init__(self, products=None, **kwargs):
+        self.products = products or {}
+        super().__init__(**kwargs)
+
+    @property
+    def product_url(self):
+        return self.url + "/api/v0/product/{ean}.json"
+
+    def handle(self, method, path, headers, body):
+        match = re.fullmatch(r"/api/v0/product/(.+)\.json", path)
+        if method == "GET" and match:
+            product = self.products.get(match.group(1))
+            if product:
+                return json_response(200, {"status": 1, "product": product})
+            return json_response(200, {"status": 0, "status_verbose": "product not found"})
+        return super().handle(method, path, headers, body)
+
+class FakeImageHost(FakeServer):
+    """Liefert unter /img/<name> immer dasselbe Bild, mit ETag und 304."""
+
+    def handle(self, method, path, headers, body):
+        if method == "GET" and path.startswith("/img/"):
+            if headers.get("If-None-Match") == FAKE_IMAGE_ETAG:
+                return 304, b"", {"ETag": FAKE_IMAGE_ETAG}
+            return 200, FAKE_IMAGE, {"Content-Type": "image/jpeg", "ETag": FAKE_IMAGE_ETAG}
+        return super().handle(method, path, headers, body)
+
+class FakeRewe(FakeServer):
+    """eBon-API (/api/receipts/) und Katalog-CSVs (/<datum>_<region>.csv).
+
+    `receipts` ist eine Liste wie die "items" der REWE-API, `articles` ordnet
+    jeder receiptId ihre Artikel zu, `csv_files` jedem Dateinamen den Inhalt.
+    """
+
+    def __init__(self, receipts=None, articles=None, csv_files=None, **kwargs):
+        self.receipts = receipts or []
+        self.articles = articles or {}
+        self.csv_files = csv_files or {}
+        super().__init__(**kwargs)
+
+    def reset_state(self):
+        self.not_modified = 0
+
+    def handle(self, method, path, headers, body):
+        if method != "GET":
+            return super().handle(method, path, headers, body)
+        if path == "/api/receipts/":
+            return json_response(200, {"items": self.receipts})
+        if path.startswith("/api/receipts/"):
+            receipt_id = path[len("/api/receipts/"):]
+            if receipt_id in self.articles:
+                return json_response(200, {"articles": self.articles[receipt_id]})
+        content = self.csv_files.get(path.lstrip("/"))
+        if content is not None:
+            etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+            if headers.get("If-None-Match") == etag:
+                with self.lock:
+                    self.not_modified += 1
+                return 304, b"", {"ETag": etag}
+            return 200, content, {"Content-Type": "text/csv", "ETag": etag}
+        return super().handle(method, path, headers, body)
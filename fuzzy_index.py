@@ -0,0 +1,198 @@
+import math
+import heapq
+from array import array
+from collections import Counter, defaultdict
+from catalog_db import CATALOG_EDITS_KEY
+
+# Persistenter Fuzzy-Index für die Produktnamen in rewe_products.db.
+#
+# Statt bei jedem Bon-Artikel alle ~19k Namen mit difflib zu vergleichen,
+# werden einmal pro Katalog-Import die Bigramme aller normalisierten Namen
+# als Postings-Listen gespeichert. Eine Suche betrachtet nur Kandidaten,
+# die die Schranke für ratio >= cutoff überhaupt erreichen können, und
+# bewertet diese danach exakt wie difflib.get_close_matches.
+#
+# Schranke: Liefert SequenceMatcher M übereinstimmende Zeichen in k Blöcken,
+# dann gilt k <= (la + lb - 2M) + 1 und die Blöcke teilen mindestens M - k
+# Bigramme. Mit M >= cutoff * (la + lb) / 2 folgt
+#     geteilte Bigramme >= (1.5 * cutoff - 1) * (la + lb) - 1
+# sowie 2 * min(la, lb) >= cutoff * (la + lb). Kein Treffer über dem
+# Cutoff wird dadurch verworfen.
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS fuzzy_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS fuzzy_names (
+    id INTEGER PRIMARY KEY,
+    name_norm TEXT NOT NULL,
+    ean TEXT,
+    len INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fuzzy_postings (
+    gram TEXT PRIMARY KEY,
+    ids BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Schwellwert für den ersten, schnellen Suchdurchlauf
+EARLY_THRESHOLD = 0.9
+
+def bigrams(s):
+    return Counter(s[i:i + 2] for i in range(len(s) - 1))
+
+def catalog_signature(conn):
+    # Neue/gelöschte Zeilen über COUNT(*) und MAX(id), Umbenennungen über den Zähler aus catalog_db
+    row = conn.execute("SELECT COUNT(*), MAX(id), (SELECT value FROM app_state WHERE key = ?) FROM products",
+                       (CATALOG_EDITS_KEY,)).fetchone()
+    return f"{row[0]}:{row[1]}:{row[2] or 0}"
+
+def build_fuzzy_index(conn):
+    conn.executescript(SCHEMA_SQL)
+    # Wie bisher: bei doppelten Namen gewinnt die zuletzt gelesene Zeile
+    name_to_ean = {}
+    for name_norm, ean in conn.execute("SELECT name_norm, ean FROM products WHERE name_norm IS NOT NULL ORDER BY id"):
+        name_to_ean[name_norm] = ean
+    postings = defaultdict(lambda: array("I"))
+    for i, n in enumerate(name_to_ean, start=1):
+        for gram in bigrams(n):
+            postings[gram].append(i)
+    with conn:
+        conn.execute("DELETE FROM fuzzy_postings")
+        conn.execute("DELETE FROM fuzzy_names")
+        conn.executemany(
+            "INSERT INTO fuzzy_names (id, name_norm, ean, len) VALUES (?, ?, ?, ?)",
+            ((i, n, ean, len(n)) for i, (n, ean) in enumerate(name_to_ean.items(), start=1))
+        )
+        conn.executemany(
+            "INSERT INTO fuzzy_postings (gram, ids) VALUES (?, ?)",
+            ((gram, ids.tobytes()) for gram, ids in postings.items())
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO fuzzy_meta (key, value) VALUES ('signature', ?)",
+            (catalog_signature(conn),)
+        )
+    return len(name_to_ean)
+
+def ensure_fuzzy_index(conn):
+    conn.executescript(SCHEMA_SQL)
+    row = conn.execute("SELECT value FROM fuzzy_meta WHERE key = 'signature'").fetchone()
+    if row and row[0] == catalog_signature(conn):
+        return False
+    build_fuzzy_index(conn)
+    return True
+
+class FuzzyIndex:
+    """Im Speicher gehaltene Kopie des persistierten Index (einmal pro Prozess geladen)."""
+
+    def __init__(self, conn):
+        self.names = [None]
+        self.eans = [None]
+        self.lens = [0]
+        self.by_len = defaultdict(list)
+        for i, name, ean, length in conn.execute("SELECT id, name_norm, ean, len FROM fuzzy_names ORDER BY id"):
+            self.names.append(name)
+            self.eans.append(ean)
+            self.lens.append(length)
+            self.by_len[length].append(i)
+        self.max_len = max(self.lens)
+        self.postings = {}
+        for gram, blob in conn.execute("SELECT gram, ids FROM fuzzy_postings"):
+            self.postings[gram] = array("I", blob)
+
+    def candidates(self, name_norm, cutoff=0.8):
+        """Kandidaten-IDs mit oberer Schranke für ratio, absteigend sortiert."""
+        lq = len(name_norm)
+        min_len = int(lq * cutoff / (2 - cutoff))
+        max_len = int(lq * (2 - cutoff) / cutoff) + 1
+        grams = bigrams(name_norm)
+        factor = 1.5 * cutoff - 1
+        # Präfix-Filter: Mindestanzahl geteilter Bigramme für den kürzesten
+        # zulässigen Namen. Wer keines der seltensten Bigramme teilt, kann
+        # höchstens die restlichen (häufigen) Vorkommen teilen.
+        min_shared = math.ceil(factor * (lq + min_len) - 1 - 1e-9)
+        remaining = sum(grams.values())
+        shared = Counter()
+        for gram in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+            if remaining < min_shared:
+                break
+            cnt = grams[gram]
+            ids = self.postings.get(gram)
+            if ids is not None:
+                for _ in range(cnt):
+                    shared.update(ids)
+            remaining -= cnt
+        # Namen ohne gemeinsames Bigramm können nur bei sehr kurzen Strings passen
+        for length in range(min_len, min(max_len, 5 - lq) + 1):
+            for i in self.by_len.get(length, ()):
+                shared.setdefault(i, 0)
+
+        # Schranke je Länge vorab als Mindestzahl geteilter Bigramme: die
+        # Kandidaten werden dann mit einem Vergleich je Eintrag gefiltert,
+        # die Schranke selbst nur noch für die verbliebenen berechnet
+        need = [math.inf] * (self.max_len + 1)
+        for lc in range(min_len, min(max_len, self.max_len) + 1):
+            total = lq + lc
+            if total == 0 or 2 * min(lq, lc) >= (cutoff - 1e-9) * total:
+                need[lc] = math.ceil(1.5 * (cutoff - 1e-9) * total - total - 1 - 1e-6) - remaining
+        lens = self.lens
+        result = []
+        for i, s in [(i, s) for i, s in shared.items() if s >= need[lens[i]]]:
+            # Obere Schranke für die tatsächlich geteilten Bigramme
+            s += remaining
+            lc = lens[i]
+            total = lq + lc
+            if total == 0:
+                result.append((1.0, i))
+                continue
+            bound = min(2 * min(lq, lc), 2 * (s + total + 1) / 3) / total
+            if bound >= cutoff - 1e-9:
+                result.append((bound, i))
+        result.sort(reverse=True)
+        return result
+
+    def lookup(self, name_norm, n=1, cutoff=0.8):
+        """Liefert die besten n Treffer als (score, name, ean), wie difflib.get_close_matches."""
+        # Erst mit hohem Schwellwert suchen (kleine Kandidatenmenge); reicht
+        # das nicht für n Treffer, folgt der Durchlauf mit dem echten Cutoff.
+        for threshold in sorted({max(cutoff, EARLY_THRESHOLD), cutoff}, reverse=True):
+            best = self._search(name_norm, n, threshold)
+            if len(best) >= n:
+                break
+        return sorted(best, key=lambda item: item[:2], reverse=True)
+
+    def _search(self, name_norm, n, cutoff):
+        from difflib import SequenceMatcher  # erst bei der ersten Fuzzy-Suche laden
+        best = []
+        s = SequenceMatcher()
+        s.set_seq2(name_norm)
+        for bound, i in self.candidates(name_norm, cutoff):
+            # Sortiert nach Schranke: sobald sie unter dem n-besten Score liegt,
+            # kann kein weiterer Kandidat mehr in die Top n kommen.
+            if len(best) >= n and bound < best[0][0]:
+                break
+            x = self.names[i]
+            s.set_seq1(x)
+            if s.real_quick_ratio() >= cutoff and \
+               s.quick_ratio() >= cutoff and \
+               s.ratio() >= cutoff:
+                item = (s.ratio(), x, self.eans[i])
+                if len(best) < n:
+                    heapq.heappush(best, item)
+                elif item[:2] > best[0][:2]:
+                    heapq.heapreplace(best, item)
+        return best
+
+_loaded = {}
+
+def get_fuzzy_index(conn):
+    signature = conn.execute("SELECT value FROM fuzzy_meta WHERE key = 'signature'").fetchone()[0]
+    cached = _loaded.get(id(conn))
+    if cached is None or cached[0] != signature:
+        cached = (signature, FuzzyIndex(conn))
+        _loaded[id(conn)] = cached
+    return cached[1]
+
+def fuzzy_lookup(conn, name_norm, n=1, cutoff=0.8):
+    return get_fuzzy_index(conn).lookup(name_norm, n=n, cutoff=cutoff)
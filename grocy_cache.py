@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+from colorTerminal import OK, WARN
+from logger import log
+from normalize import normalize_string
+from http_client import client
+
+class GrocyCache:
+    """Produkte und Barcodes aus Grocy, einmal pro Lauf geladen.
+
+    Ersetzt die by-barcode-Abfragen und den kompletten Produktlisten-Download
+    pro Artikel. Neu angelegte Produkte/Barcodes werden lokal nachgetragen.
+    Mit `cache_file` und `max_age` > 0 wird der Stand zusätzlich auf Platte
+    gehalten und bis zu `max_age` Sekunden wiederverwendet.
+    Nachträge sind thread-sicher (parallele Artikel-Pipeline).
+    """
+
+    def __init__(self, base_url, headers, cache_file=None, max_age=0):
+        self.base_url = base_url
+        self.headers = headers
+        self.cache_file = cache_file
+        self.max_age = max_age
+        self.by_barcode = {}
+        self.by_name = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._load_file():
+            return True
+        try:
+            products = self._get("/objects/products")
+            barcodes = self._get("/objects/product_barcodes")
+        except Exception as e:
+            log.warning(f"{WARN} Grocy-Cache konnte nicht geladen werden: {e}")
+            return False
+        self.by_barcode = {}
+        self.by_name = {}
+        for product in products:
+            if product.get("name"):
+                self.by_name.setdefault(normalize_string(product["name"]), product.get("id"))
+        for barcode in barcodes:
+            if barcode.get("barcode"):
+                self.by_barcode[str(barcode["barcode"]).strip()] = barcode.get("product_id")
+        self.loaded_at = time.time()
+        log.info(f"{OK} Grocy-Cache geladen: {len(self.by_name)} Produkte, {len(self.by_barcode)} Barcodes.")
+        self._save_file()
+        return True
+
+    def _get(self, path):
+        r = client.get(self.base_url + path, headers=self.headers, verify=False)
+        r.raise_for_status()
+        return r.json()
+
+    def _load_file(self):
+        if not self.cache_file or self.max_age <= 0 or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("base_url") != self.base_url or time.time() - data.get("loaded_at", 0) > self.max_age:
+            return False
+        self.by_barcode = data["by_barcode"]
+        self.by_name = data["by_name"]
+        self.loaded_at = data["loaded_at"]
+        log.info(f"{OK} Grocy-Cache aus {self.cache_file} übernommen.")
+        return True
+
+    def _save_file(self):
+        if not self.cache_file or self.max_age <= 0:
+            return
+        data = {
+            "base_url": self.base_url,
+            "loaded_at": self.loaded_at,
+            "by_barcode": self.by_barcode,
+            "by_name": self.by_name,
+        }
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def invalidate(self):
+        self.by_barcode = {}
+        self.by_name = {}
+        self.loaded_at = None
+        if self.cache_file and os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+
+    def product_id_by_barcode(self, barcode):
+        return self.by_barcode.get(str(barcode).strip())
+
+    def product_id_by_name(self, name):
+        return self.by_name.get(normalize_string(name))
+
+    def add_product(self, product_id, name):
+        with self._lock:
+            self.by_name.setdefault(normalize_string(name), product_id)
+            self._save_file()
+
+    def add_barcode(self, barcode, product_id):
+        with self._lock:
+            self.by_barcode[str(barcode).strip()] = product_id
+            self._save_file()
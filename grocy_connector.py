@@ -1,40 +1,132 @@
-import requests
-import unicodedata
-import difflib
-import os
 import base64
 import sqlite3
-import re
+import threading
+import time
+import requests
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from colorTerminal import OK, WARN, ERROR
-from config import GROCY_API_URL, GROCY_API_KEY, GROCY_LOCATION_ID_KUEHLSCHRANK, GROCY_LOCATION_ID, GROCY_DEFAULT_BEST_BEFORE_DAYS, GROCY_MIN_STOCK_AMOUNT
-
-GROCY_BASE_URL = GROCY_API_URL + "/api"
-GROCY_HEADER = {
-    "GROCY-API-KEY": GROCY_API_KEY,
-    "accept": "application/json",
-    "Content-Type": "application/json",
-}
-ENDPOINT_GET_BYBARCODE = GROCY_BASE_URL + "/stock/products/by-barcode/"
-ENDPOINT_ADD_PRODUCT = GROCY_BASE_URL + "/objects/products"
-ENDPOINT_ADD_BARCODE = GROCY_BASE_URL + "/objects/product_barcodes"
-ENDPOINT_ADD_STOCK = GROCY_BASE_URL + "/stock/products/{product_id}/add"
+from logger import log
+from metrics import metrics
+from normalize import normalize_string, match_key, remove_quantity_from_name
+from catalog_snapshot import SqliteCatalog, export_snapshot, open_snapshot
+from catalog_db import connect
+from price_history import price_at
+from off_cache import lookup_off_product, store_off_product
+from image_cache import ImageCache, downscale
+from name_resolution import ResolutionStats, lookup_resolution, store_resolution
+from grocy_journal import journal_begin, journal_update, journal_product_id
+from grocy_cache import GrocyCache
+from http_client import client
+from tenants import current_tenant, submit
+from config import GROCY_CACHE_MAX_AGE
+from config import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_MAX_DIMENSION, IMAGE_WORKERS
+from config import OFF_ONLINE, OFF_SKIP_IF_BON_NAME, OFF_CACHE_TTL, OFF_NEGATIVE_TTL
+from config import CATALOG_BACKEND, CATALOG_SNAPSHOT_FILE
+
+# Pfade relativ zur Grocy-API des aktiven Haushalts (tenants.current_tenant().grocy_base_url)
+ENDPOINT_GET_BYBARCODE = "/stock/products/by-barcode/"
+ENDPOINT_ADD_PRODUCT = "/objects/products"
+ENDPOINT_ADD_BARCODE = "/objects/product_barcodes"
+ENDPOINT_ADD_STOCK = "/stock/products/{product_id}/add"
+OFF_PRODUCT_URL = "https://world.openfoodfacts.org/api/v0/product/{ean}.json"
 
 DB_FILE = "rewe_products.db"
 
-# Globale Datenbankverbindung herstellen
-db_conn = sqlite3.connect(DB_FILE)
-db_conn.row_factory = sqlite3.Row
-
-def normalize_string(s):
-    s = unicodedata.normalize('NFKD', s)
-    s = s.replace("’", "'").replace("‘", "'")
-    s = s.lower().strip()
-    return s
+# Gemeinsame Datenbankverbindung, erst beim ersten Zugriff geöffnet (migriert
+# das Schema bei Bedarf). Die Artikel-Pipeline nutzt sie aus mehreren
+# Threads, daher alle Zugriffe über db_lock.
+_db_conn = None
+db_lock = threading.RLock()
+
+# Katalog-Lookups: SQLite oder der per mmap geöffnete Snapshot (CATALOG_BACKEND)
+_snapshot = None
+
+# Produktbilder: lokaler Cache und Hintergrund-Warteschlange für Download + Upload
+_image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+_image_executor = None
+_image_futures = []
+_image_lock = threading.Lock()
+
+# Trefferquote des Namensauflösungs-Caches in diesem Lauf
+resolution_stats = ResolutionStats()
+
+# Grocy-Cache und Namens-Locks gehören zum Haushalt, siehe tenants.Tenant
+
+def get_db():
+    global _db_conn
+    with db_lock:
+        if _db_conn is None:
+            _db_conn = connect(DB_FILE, check_same_thread=False)
+            _db_conn.row_factory = sqlite3.Row
+        return _db_conn
+
+def close_db():
+    global _db_conn, _snapshot
+    with db_lock:
+        if _snapshot is not None:
+            _snapshot.close()
+            _snapshot = None
+        if _db_conn is not None:
+            _db_conn.close()
+            _db_conn = None
+
+def get_catalog():
+    """Backend für die Katalog-Lookups; Aufrufer halten db_lock."""
+    global _snapshot
+    if CATALOG_BACKEND != "snapshot":
+        return SqliteCatalog(get_db())
+    if _snapshot is None:
+        conn = get_db()
+        _snapshot = open_snapshot(CATALOG_SNAPSHOT_FILE, conn)
+        if _snapshot is None:
+            # Fehlt oder passt nicht zum Katalog: einmal neu schreiben
+            count = export_snapshot(conn, CATALOG_SNAPSHOT_FILE)
+            log.info(f"{OK} Katalog-Snapshot mit {count} Produktnamen geschrieben: {CATALOG_SNAPSHOT_FILE}")
+            _snapshot = open_snapshot(CATALOG_SNAPSHOT_FILE, conn)
+    return _snapshot
+
+def reload_catalog():
+    """Nach einer Katalog-Aktualisierung: Snapshot beim nächsten Zugriff neu prüfen und öffnen."""
+    global _snapshot
+    with db_lock:
+        if _snapshot is not None:
+            _snapshot.close()
+            _snapshot = None
+
+def __getattr__(name):
+    # Kompatibilität: grocy_connector.db_conn öffnet die Verbindung bei Bedarf
+    if name == "db_conn":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_grocy_cache():
+    tenant = current_tenant()
+    with tenant.grocy_cache_lock:
+        if tenant.grocy_cache is None:
+            cache = GrocyCache(tenant.grocy_base_url, tenant.grocy_header, tenant.grocy_cache_file, GROCY_CACHE_MAX_AGE)
+            if not cache.load():
+                return None  # Fallback: Einzelabfragen wie bisher
+            tenant.grocy_cache = cache
+        return tenant.grocy_cache
+
+def expire_grocy_cache(max_age):
+    """Verwirft den Grocy-Cache im Speicher, wenn er älter als `max_age` Sekunden ist
+    (lange laufende Prozesse sehen so auch Änderungen, die direkt in Grocy gemacht wurden)."""
+    tenant = current_tenant()
+    with tenant.grocy_cache_lock:
+        if tenant.grocy_cache is not None and time.time() - (tenant.grocy_cache.loaded_at or 0) > max_age:
+            tenant.grocy_cache = None
+            return True
+    return False
 
 def grocy_product_name_exists(product_name):
-    url = GROCY_BASE_URL + "/objects/products"
+    cache = get_grocy_cache()
+    if cache:
+        return cache.product_id_by_name(product_name)
+    tenant = current_tenant()
     try:
-        r = requests.get(url, headers=GROCY_HEADER, timeout=10, verify=False)
+        r = client.get(tenant.grocy_base_url + "/objects/products", headers=tenant.grocy_header, verify=False)
         r.raise_for_status()
         products = r.json()
         for product in products:
@@ -42,178 +134,259 @@ def grocy_product_name_exists(product_name):
                 return product.get("id")
         return None
     except Exception as e:
-        print(f"{WARN} Fehler bei Grocy-Namensabfrage: {e}")
-        return None
-
-def create_product_in_grocy(product_data, ean):
-    product_name = product_data.get("product_name", "Unbenanntes Produkt")
-    # Prüfe, ob Produktname schon existiert
-    existing_id = grocy_product_name_exists(product_name)
-    if existing_id:
-        print(f"{WARN} Produktname '{product_name}' existiert bereits in Grocy (ID {existing_id}), lege nicht erneut an.")
-        return existing_id
-
-    product_info = {
-        "name": product_name,
-        "qu_id_stock": 2,
-        "qu_id_purchase": 2,
-        "qu_id_price": 2,
-        "default_best_before_days": GROCY_DEFAULT_BEST_BEFORE_DAYS,
-        "location_id": GROCY_LOCATION_ID_KUEHLSCHRANK,
-        "shopping_location_id": GROCY_LOCATION_ID,  # <-- jetzt wird die REWE-Location-ID aus config.py verwendet!
-        "min_stock_amount": GROCY_MIN_STOCK_AMOUNT,
-    }
-    try:
-        r = requests.post(
-            ENDPOINT_ADD_PRODUCT,
-            headers=GROCY_HEADER,
-            json=product_info,
-            timeout=10,
-            verify=False,
-        )
-        r.raise_for_status()
-        product_id = r.json().get("created_object_id")
-        print(f"{OK} Produkt '{product_info['name']}' in Grocy angelegt mit ID {product_id}.")
-
-        ean_str = str(ean).strip()
-        print(f"{OK} Verarbeite EAN: '{ean_str}'")
-
-        image_url = get_image_url_by_ean(ean_str)
-        if image_url:
-            print(f"{OK} Bild-URL aus DB für EAN '{ean_str}': {image_url}")
-        else:
-            print(f"{WARN} Keine Bild-URL in DB für EAN '{ean_str}'")
-        
-        if image_url:
-            image_filename = f"temp_product_image_{ean_str}.jpg"
-            if download_image(image_url, image_filename):
-                upload_product_image(product_id, image_filename)
-                try:
-                    os.remove(image_filename)
-                except Exception:
-                    pass
-
-        return product_id
-    except Exception as e:
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"{ERROR} Grocy-Fehler: {e.response.text}")
-        print(f"{WARN} Fehler beim Anlegen des Produkts in Grocy: {e}")
+        log.warning(f"{WARN} Fehler bei Grocy-Namensabfrage: {e}")
         return None
 
+@metrics.timed("get_ean_from_product_name", check_result=True)
 def get_ean_from_product_name(product_name):
     name_norm = normalize_string(product_name)
-    cur = db_conn.execute("SELECT ean FROM products WHERE lower(trim(name)) = ?", (name_norm,))
-    row = cur.fetchone()
-    if row and row["ean"]:
-        print(f"{OK} Direkter Namens-Treffer: '{product_name}' → EAN {row['ean']}")
-        return row["ean"]
-    print(f"{WARN} Kein direkter Namens-Treffer für '{product_name}'")
+    with db_lock:
+        ean = get_catalog().ean_by_name(name_norm)
+    if ean:
+        log.debug(f"{OK} Direkter Namens-Treffer: '{product_name}' → EAN {ean}")
+        return ean
+    log.debug(f"{WARN} Kein direkter Namens-Treffer für '{product_name}'")
     return None
 
 def get_ean_from_product_name_fuzzy(product_name, cutoff=0.8):
+    match = fuzzy_match_product_name(product_name, cutoff)
+    return match[1] if match else None
+
+@metrics.timed("get_ean_from_product_name_fuzzy", check_result=True)
+def fuzzy_match_product_name(product_name, cutoff=0.8):
+    """(score, ean) des besten Fuzzy-Treffers oder None."""
     name_norm = normalize_string(product_name)
-    # Hole alle Namen aus der DB
-    cur = db_conn.execute("SELECT name, ean FROM products")
-    names = []
-    name_to_ean = {}
-    for row in cur.fetchall():
-        n = normalize_string(row["name"])
-        names.append(n)
-        name_to_ean[n] = row["ean"]
-    import difflib
-    matches = difflib.get_close_matches(name_norm, names, n=1, cutoff=cutoff)
+    with db_lock:
+        matches = get_catalog().fuzzy_index().lookup(name_norm, n=1, cutoff=cutoff)
     if matches:
-        match = matches[0]
-        ean = name_to_ean.get(match)
-        print(f"{OK} Fuzzy-Treffer: '{product_name}' ≈ '{match}' → EAN {ean}")
-        return ean
-    print(f"{WARN} Kein fuzzy Namens-Treffer für '{product_name}'")
+        score, match, ean = matches[0]
+        log.debug(f"{OK} Fuzzy-Treffer: '{product_name}' ≈ '{match}' → EAN {ean}")
+        return score, ean
+    log.debug(f"{WARN} Kein fuzzy Namens-Treffer für '{product_name}'")
     return None
 
+@metrics.timed("get_ean_from_rewe_code", check_result=True)
 def get_ean_from_rewe_code(rewe_code):
-    cur = db_conn.execute("SELECT ean FROM products WHERE trim(ean) = ?", (str(rewe_code).strip(),))
-    row = cur.fetchone()
-    if row and row["ean"]:
-        print(f"{OK} REWE-Code-Treffer: {rewe_code} → EAN {row['ean']}")
-        return row["ean"]
-    print(f"{WARN} Kein REWE-Code-Treffer für {rewe_code}")
+    with db_lock:
+        ean = get_catalog().ean_by_code(str(rewe_code).strip())
+    if ean:
+        log.debug(f"{OK} REWE-Code-Treffer: {rewe_code} → EAN {ean}")
+        return ean
+    log.debug(f"{WARN} Kein REWE-Code-Treffer für {rewe_code}")
     return None
 
-def get_image_url_by_ean(ean):
-    cur = db_conn.execute("SELECT image FROM products WHERE ean = ?", (str(ean).strip(),))
-    row = cur.fetchone()
-    if row and row["image"]:
-        return row["image"]
-    return None
+def resolve_ean(product_name, rewe_code=None):
+    """EAN zu einem Bon-Artikel: erst der Cache, dann Name, Schlüssel, Fuzzy, REWE-Code, nan.
 
-def download_image(image_url, filename):
-    try:
-        response = requests.get(image_url, timeout=10, verify=False)
-        response.raise_for_status()
-        with open(filename, 'wb') as f:
-            f.write(response.content)
-        print(f"{OK} Bild heruntergeladen: {filename}")
-        return True
-    except Exception as e:
-        print(f"{WARN} Fehler beim Herunterladen des Bildes: {e}")
-        return False
+    Ohne `rewe_code` werden nur Name und Fuzzy versucht (None, falls nichts passt).
+    Jede erfolgreiche Auflösung landet in name_resolution.
+    """
+    result = resolve_eans([(product_name, rewe_code)], n=1)[0]
+    ean, method = result["ean"], result["method"]
+    if result["cached"]:
+        log.debug(f"{OK} Aufgelöst aus Cache: '{product_name}' → EAN {ean} ({method})")
+    elif method == "name":
+        log.debug(f"{OK} Direkter Namens-Treffer: '{product_name}' → EAN {ean}")
+    elif method == "key":
+        log.debug(f"{OK} Treffer über Matching-Schlüssel: '{product_name}' → EAN {ean}")
+    elif method == "fuzzy":
+        log.debug(f"{OK} Fuzzy-Treffer: '{product_name}' ≈ '{result['candidates'][0][1]}' → EAN {ean}")
+    elif method == "rewe_code":
+        log.debug(f"{OK} REWE-Code-Treffer: {rewe_code} → EAN {ean}")
+    elif method == "nan":
+        log.warning(f"{WARN} Kein Katalog-Treffer für '{product_name}', verwende REWE-Code {ean}")
+    else:
+        log.warning(f"{WARN} Kein Namens-Treffer für '{product_name}'")
+    return ean
+
+@metrics.timed("resolve_eans")
+def resolve_eans(articles, n=3, cutoff=0.8, use_cache=True):
+    """Löst viele Bon-Artikel in einem Durchgang auf.
+
+    `articles` ist eine Liste von (Bon-Name, REWE-Code oder None). Gleiche
+    Paare werden nur einmal gesucht, der Fuzzy-Index nur einmal geprüft und
+    geladen, und der Cache wird am Ende in einer Transaktion geschrieben.
+    Liefert je Artikel ein Dict mit ean, method, score, cached und den
+    besten n Fuzzy-Kandidaten als [(score, name, ean), ...].
+    """
+    keys = [(normalize_string(name), None if code is None else str(code).strip()) for name, code in articles]
+    unique = dict.fromkeys(keys)
+    with db_lock:
+        conn = get_db()
+        catalog = get_catalog()
+        index = None
+        for key in unique:
+            bon_name, nan = key
+            if use_cache:
+                cached = lookup_resolution(conn, bon_name, nan or "")
+                if cached:
+                    resolution_stats.hit()
+                    unique[key] = {"ean": cached[0], "method": cached[1], "score": None,
+                                   "cached": True, "candidates": []}
+                    continue
+            if index is None and bon_name:
+                index = catalog.fuzzy_index()
+            unique[key] = _resolve_uncached(catalog, index, bon_name, nan, n, cutoff)
+            result = unique[key]
+            resolution_stats.miss(result["method"])
+            if use_cache and result["ean"]:
+                store_resolution(conn, bon_name, nan or "", result["ean"], result["method"],
+                                 result["score"], commit=False)
+        conn.commit()
+    return [unique[key] for key in keys]
+
+def _resolve_uncached(catalog, index, bon_name, nan, n, cutoff):
+    result = {"ean": None, "method": None, "score": None, "cached": False, "candidates": []}
+    ean = catalog.ean_by_name(bon_name)
+    if ean:
+        result.update(ean=ean, method="name", score=1.0, candidates=[(1.0, bon_name, ean)])
+        return result
+    key = match_key(bon_name)
+    if key:
+        ean = catalog.ean_by_key(key)
+        if ean:
+            result.update(ean=ean, method="key", score=1.0, candidates=[(1.0, key, ean)])
+            return result
+    if index is not None:
+        result["candidates"] = index.lookup(bon_name, n=n, cutoff=cutoff)
+        if result["candidates"]:
+            score, _match, ean = result["candidates"][0]
+            result.update(ean=ean, method="fuzzy", score=score)
+            return result
+    if nan is None:
+        return result
+    ean = catalog.ean_by_code(nan)
+    if ean:
+        result.update(ean=ean, method="rewe_code", score=1.0)
+    elif nan:
+        result.update(ean=nan, method="nan")
+    return result
 
-def upload_product_image(product_id, image_path):
+def get_image_url_by_ean(ean):
+    with db_lock:
+        return get_catalog().image_by_ean(str(ean).strip())
+
+def get_price_at_purchase_date(ean, purchased_date):
+    with db_lock:
+        price = price_at(get_db(), ean, purchased_date)
+    if price is not None:
+        log.debug(f"{OK} Katalogpreis für EAN {ean} am {purchased_date}: {price:.2f}€")
+    return price
+
+@metrics.timed("fetch_image", check_result=True)
+def fetch_image(image_url):
+    data = _image_cache.get(image_url)
+    if data is None:
+        return None
+    log.debug(f"{OK} Bild geladen: {image_url} ({len(data) / 1024:.0f} KiB)")
+    return downscale(data, IMAGE_MAX_DIMENSION)
+
+def _process_image(product_id, image_url):
+    data = fetch_image(image_url)
+    if data:
+        return upload_product_image(product_id, data)
+    return False
+
+def queue_product_image(product_id, image_url):
+    """Bild im Hintergrund laden und hochladen, ohne die Bestandsbuchung aufzuhalten."""
+    global _image_executor
+    with _image_lock:
+        if _image_executor is None:
+            _image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="produktbilder")
+        _image_futures.append(submit(_image_executor, _process_image, product_id, image_url))
+
+def wait_for_image_uploads():
+    """Wartet auf alle Bild-Uploads aus der Warteschlange; liefert (erfolgreich, gesamt)."""
+    global _image_executor
+    with _image_lock:
+        futures = list(_image_futures)
+        _image_futures.clear()
+        executor, _image_executor = _image_executor, None
+    done = 0
+    for future in futures:
+        try:
+            done += bool(future.result())
+        except Exception as e:
+            log.warning(f"{WARN} Fehler bei der Bildverarbeitung: {e}")
+    if executor:
+        executor.shutdown()
+    if futures:
+        log.info(f"{OK} {done} von {len(futures)} Produktbildern hochgeladen.")
+    return done, len(futures)
+
+@metrics.timed("upload_product_image", check_result=True)
+def upload_product_image(product_id, image_data):
     file_name = f"{product_id}.jpg"
     # Base64-url-safe kodierter Dateiname ohne Padding "="
     file_name_b64 = base64.urlsafe_b64encode(file_name.encode()).decode().rstrip("=")
 
-    upload_url = f"{GROCY_API_URL}/api/files/productpictures/{file_name_b64}"
+    tenant = current_tenant()
+    upload_url = f"{tenant.grocy_base_url}/files/productpictures/{file_name_b64}"
     headers_upload = {
-        "GROCY-API-KEY": GROCY_API_KEY,
+        "GROCY-API-KEY": tenant.grocy_api_key,
         "Content-Type": "application/octet-stream"
     }
 
     try:
-        with open(image_path, "rb") as image_file:
-            resp = requests.put(upload_url, data=image_file, headers=headers_upload, timeout=10, verify=False)
-        print(f"Upload Status: {resp.status_code} {resp.text}")
+        # Als Bytes aus dem Speicher senden, damit ein Retry den vollständigen Body erneut schicken kann
+        resp = client.put(upload_url, data=image_data, headers=headers_upload, verify=False,
+                          endpoint="PUT Grocy Produktbild-Upload")
+        log.debug(f"Upload Status: {resp.status_code} {resp.text}")
         if resp.status_code not in (200, 204):
-            print(f"[WARN] Produktbild konnte nicht hochgeladen werden: {resp.status_code} {resp.text}")
+            log.warning(f"{WARN} Produktbild konnte nicht hochgeladen werden: {resp.status_code} {resp.text}")
             return False
     except Exception as e:
-        print(f"[WARN] Fehler beim Upload: {e}")
+        log.warning(f"{WARN} Fehler beim Upload: {e}")
         return False
 
     # Produkt mit Bilddateiname per PUT aktualisieren
     success = update_product_picture(product_id, file_name)
     if not success:
-        print(f"[WARN] Produktbild konnte nicht im Produkt hinterlegt werden.")
+        log.warning(f"{WARN} Produktbild konnte nicht im Produkt hinterlegt werden.")
         return False
 
-    print(f"{OK} Produktbild für Produkt-ID {product_id} erfolgreich hochgeladen und zugewiesen.")
+    log.debug(f"{OK} Produktbild für Produkt-ID {product_id} erfolgreich hochgeladen und zugewiesen.")
     return True
 
 def update_product_picture(product_id, file_name):
-    url = f"{GROCY_API_URL}/api/objects/products/{product_id}"
+    tenant = current_tenant()
+    url = f"{tenant.grocy_base_url}/objects/products/{product_id}"
     headers = {
-        "GROCY-API-KEY": GROCY_API_KEY,
+        "GROCY-API-KEY": tenant.grocy_api_key,
         "Content-Type": "application/json"
     }
     data = {
         "picture_file_name": file_name
     }
     try:
-        resp = requests.put(url, headers=headers, json=data, timeout=10, verify=False)
+        resp = client.put(url, headers=headers, json=data, verify=False)
         if resp.status_code not in (200, 204):
-            print(f"[WARN] Fehler beim Setzen des Bildnamens: {resp.status_code} {resp.text}")
+            log.warning(f"{WARN} Fehler beim Setzen des Bildnamens: {resp.status_code} {resp.text}")
             return False
         return True
     except Exception as e:
-        print(f"[WARN] Fehler beim Setzen des Bildnamens: {e}")
+        log.warning(f"{WARN} Fehler beim Setzen des Bildnamens: {e}")
         return False
 
-def create_product_in_grocy(product_data, ean):
+@metrics.timed("create_product_in_grocy", check_result=True)
+def create_product_in_grocy(product_data, ean, check_existing=True):
+    """Legt das Produkt an; liefert die ID (auch die eines gleichnamigen, schon vorhandenen Produkts).
+
+    Mit check_existing=False wird nur im geladenen Grocy-Cache nach dem Namen
+    gesucht, nie per Request (das Journal weiß, dass noch nichts angelegt ist).
+    """
     product_name = product_data.get("product_name", "Unbenanntes Produkt")
+    with current_tenant().lock_for_name(product_name):
+        return _create_product_in_grocy(product_data, ean, product_name, check_existing)
+
+def _create_product_in_grocy(product_data, ean, product_name, check_existing=True):
     # Prüfe, ob Produktname schon existiert
-    existing_id = grocy_product_name_exists(product_name)
+    tenant = current_tenant()
+    existing_id = None
+    if check_existing or tenant.grocy_cache is not None:
+        existing_id = grocy_product_name_exists(product_name)
     if existing_id:
-        print(f"{WARN} Produktname '{product_name}' existiert bereits in Grocy (ID {existing_id}), lege nicht erneut an.")
+        log.info(f"{WARN} Produktname '{product_name}' existiert bereits in Grocy (ID {existing_id}), lege nicht erneut an.")
         return existing_id
 
     product_info = {
@@ -221,71 +394,73 @@ def create_product_in_grocy(product_data, ean):
         "qu_id_stock": 2,
         "qu_id_purchase": 2,
         "qu_id_price": 2,
-        "default_best_before_days": GROCY_DEFAULT_BEST_BEFORE_DAYS,
-        "location_id": GROCY_LOCATION_ID_KUEHLSCHRANK,
-        "shopping_location_id": GROCY_LOCATION_ID,
-        "min_stock_amount": GROCY_MIN_STOCK_AMOUNT,
+        "default_best_before_days": tenant.default_best_before_days,
+        "location_id": tenant.location_id_kuehlschrank,
+        "shopping_location_id": tenant.location_id,
+        "min_stock_amount": tenant.min_stock_amount,
     }
     try:
-        r = requests.post(
-            ENDPOINT_ADD_PRODUCT,
-            headers=GROCY_HEADER,
+        r = client.post(
+            tenant.grocy_base_url + ENDPOINT_ADD_PRODUCT,
+            headers=tenant.grocy_header,
             json=product_info,
-            timeout=10,
             verify=False,
         )
         r.raise_for_status()
         product_id = r.json().get("created_object_id")
-        print(f"{OK} Produkt '{product_info['name']}' in Grocy angelegt mit ID {product_id}.")
+        log.info(f"{OK} Produkt '{product_info['name']}' in Grocy angelegt mit ID {product_id}.")
+        if tenant.grocy_cache:
+            tenant.grocy_cache.add_product(product_id, product_name)
 
+        if not ean:
+            return product_id
         ean_str = str(ean).strip()
-        print(f"{OK} Verarbeite EAN: '{ean_str}'")
+        log.debug(f"{OK} Verarbeite EAN: '{ean_str}'")
 
         image_url = get_image_url_by_ean(ean_str)
         if image_url:
-            print(f"{OK} Bild-URL aus DB für EAN '{ean_str}': {image_url}")
+            log.debug(f"{OK} Bild-URL aus DB für EAN '{ean_str}': {image_url}")
         else:
-            print(f"{WARN} Keine Bild-URL in DB für EAN '{ean_str}'")
+            log.info(f"{WARN} Keine Bild-URL in DB für EAN '{ean_str}'")
         
         if image_url:
-            image_filename = f"temp_product_image_{ean_str}.jpg"
-            if download_image(image_url, image_filename):
-                upload_product_image(product_id, image_filename)
-                try:
-                    os.remove(image_filename)
-                except Exception:
-                    pass
+            queue_product_image(product_id, image_url)
 
         return product_id
     except Exception as e:
         if hasattr(e, 'response') and e.response is not None:
-            print(f"{ERROR} Grocy-Fehler: {e.response.text}")
-        print(f"{WARN} Fehler beim Anlegen des Produkts in Grocy: {e}")
+            log.error(f"{ERROR} Grocy-Fehler: {e.response.text}")
+        log.warning(f"{WARN} Fehler beim Anlegen des Produkts in Grocy: {e}")
         return None
 
+@metrics.timed("add_barcode_to_product", check_result=True)
 def add_barcode_to_product(product_id, ean):
+    tenant = current_tenant()
     barcode_info = {
         "barcode": str(ean),
         "product_id": product_id,
         "amount": 1,
     }
     try:
-        r = requests.post(
-            ENDPOINT_ADD_BARCODE,
-            headers=GROCY_HEADER,
+        r = client.post(
+            tenant.grocy_base_url + ENDPOINT_ADD_BARCODE,
+            headers=tenant.grocy_header,
             json=barcode_info,
-            timeout=10,
             verify=False,
         )
         r.raise_for_status()
-        print(f"{OK} Barcode {ean} zum Produkt {product_id} hinzugefügt.")
+        log.debug(f"{OK} Barcode {ean} zum Produkt {product_id} hinzugefügt.")
+        if tenant.grocy_cache:
+            tenant.grocy_cache.add_barcode(ean, product_id)
         return True
     except Exception as e:
-        print(f"{WARN} Fehler beim Hinzufügen des Barcodes: {e}")
+        log.warning(f"{WARN} Fehler beim Hinzufügen des Barcodes: {e}")
         return False
 
+@metrics.timed("update_stock", check_result=True)
 def update_stock(product_id, amount, price, purchased_date=None):
-    url = ENDPOINT_ADD_STOCK.format(product_id=product_id)
+    tenant = current_tenant()
+    url = tenant.grocy_base_url + ENDPOINT_ADD_STOCK.format(product_id=product_id)
     stock_info = {
         "amount": amount,
         "transaction_type": "purchase",
@@ -294,36 +469,62 @@ def update_stock(product_id, amount, price, purchased_date=None):
     if purchased_date:
         stock_info["purchased_date"] = purchased_date  # Muss exakt so heißen!
     try:
-        r = requests.post(
+        r = client.post(
             url,
-            headers=GROCY_HEADER,
+            headers=tenant.grocy_header,
             json=stock_info,
-            timeout=10,
             verify=False,
         )
         r.raise_for_status()
-        print(f"{OK} Bestand für Produkt-ID {product_id} aktualisiert. (Kaufdatum: {purchased_date})")
+        log.debug(f"{OK} Bestand für Produkt-ID {product_id} aktualisiert. (Kaufdatum: {purchased_date})")
         return True
+    except requests.exceptions.HTTPError as e:
+        log.warning(f"{WARN} Fehler beim Aktualisieren des Bestands: {e}")
+        return False
+    except requests.exceptions.RequestException as e:
+        if _not_sent(e):
+            log.warning(f"{WARN} Grocy nicht erreichbar beim Aktualisieren des Bestands: {e}")
+            return False
+        # Anfrage kann raus sein, Antwort fehlt (Timeout, Verbindung abgebrochen):
+        # ob Grocy gebucht hat, ist unklar
+        log.warning(f"{WARN} Keine Antwort beim Aktualisieren des Bestands: {e}")
+        return None
     except Exception as e:
-        print(f"{WARN} Fehler beim Aktualisieren des Bestands: {e}")
+        log.warning(f"{WARN} Fehler beim Aktualisieren des Bestands: {e}")
         return False
 
+def _not_sent(e):
+    """True, wenn schon der Verbindungsaufbau scheiterte, die Anfrage Grocy also sicher nicht erreicht hat."""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = e.args[0] if e.args else None
+    reason = getattr(reason, "reason", reason)  # MaxRetryError nach den Wiederholungen
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+
 def grocy_product_exists(ean):
-    url = ENDPOINT_GET_BYBARCODE + str(ean)
+    cache = get_grocy_cache()
+    if cache:
+        return cache.product_id_by_barcode(ean) is not None
+    tenant = current_tenant()
+    url = tenant.grocy_base_url + ENDPOINT_GET_BYBARCODE + str(ean)
     try:
-        r = requests.get(url, headers=GROCY_HEADER, timeout=10, verify=False)
+        r = client.get(url, headers=tenant.grocy_header, verify=False)
         if r.status_code == 200:
             data = r.json()
             return "product" in data
         return False
     except Exception as e:
-        print(f"{WARN} Fehler bei Grocy-Abfrage: {e}")
+        log.warning(f"{WARN} Fehler bei Grocy-Abfrage: {e}")
         return False
 
 def get_grocy_product_id_by_ean(ean):
-    url = ENDPOINT_GET_BYBARCODE + str(ean)
+    cache = get_grocy_cache()
+    if cache:
+        return cache.product_id_by_barcode(ean)
+    tenant = current_tenant()
+    url = tenant.grocy_base_url + ENDPOINT_GET_BYBARCODE + str(ean)
     try:
-        r = requests.get(url, headers=GROCY_HEADER, timeout=10, verify=False)
+        r = client.get(url, headers=tenant.grocy_header, verify=False)
         if r.status_code == 200:
             data = r.json()
             product = data.get("product")
@@ -331,72 +532,165 @@ def get_grocy_product_id_by_ean(ean):
                 return product["id"]
         return None
     except Exception as e:
-        print(f"{WARN} Fehler beim Abrufen der Produkt-ID von Grocy: {e}")
+        log.warning(f"{WARN} Fehler beim Abrufen der Produkt-ID von Grocy: {e}")
         return None
 
-def remove_quantity_from_name(name):
-    """
-    Entfernt typische Mengen-/Gewichtsangaben am Ende des Produktnamens.
-    Beispiele: "191g", "1kg", "1 Stück", "ca. 200g", "0,25l", "8x100g", "1Stück", "1,5kg"
-    """
-    patterns = [
-        r"\s*\d+[.,]?\d*\s*([xX]\s*\d+)?\s*(Stück|Stk\.?|kg|g|l|ml|cl|dl|mg|µg|Packung|Becher|Dose|Flasche|Tüte|Bund|Pck|Pckg|Paket)\.?$",
-        r"\s*ca\.\s*\d+[.,]?\d*\s*(g|kg|l|ml|Stück)\.?$",
-        r"\s*\d+[.,]?\d*\s*(g|kg|l|ml|Stück)\.?$",
-        r"\s*\d+\s*x\s*\d+\s*(g|ml|Stück)\.?$",
-        r"\s*\d+[.,]?\d*\s*(%|vol|Vol)\.?$",
-    ]
-    new_name = name
-    for pattern in patterns:
-        new_name = re.sub(pattern, '', new_name, flags=re.IGNORECASE)
-    return new_name.strip()
-
-def add_or_update_product(ean, amount, price, bon_product_name=None, purchased_date=None):
+def add_or_update_product(ean, amount, price, bon_product_name=None, purchased_date=None, resolve_name=True,
+                          journal_key=None):
     # 1. EAN aus DB anhand des Bon-Namens bestimmen (direkt oder fuzzy)
-    if bon_product_name:
-        ean_db = get_ean_from_product_name(bon_product_name)
-        if not ean_db:
-            ean_db = get_ean_from_product_name_fuzzy(bon_product_name)
+    #    resolve_name=False, wenn der Aufrufer das bereits erledigt hat
+    if bon_product_name and resolve_name:
+        ean_db = resolve_ean(bon_product_name)
         if ean_db:
             ean = ean_db  # Überschreibe EAN mit der aus der DB gefundenen EAN
 
+    # Ohne Bon-Preis den Katalogpreis zum Kaufdatum aus der Preishistorie nehmen
+    if not price and purchased_date and ean:
+        price = get_price_at_purchase_date(ean, purchased_date) or price
+
+    # eBon-Zeilen (receipt_id, line) laufen über das Journal, siehe grocy_journal.py
+    if journal_key:
+        return _add_or_update_journaled(journal_key, ean, amount, price, bon_product_name, purchased_date)
+
+    if not ean:
+        return _add_without_ean(amount, price, bon_product_name, purchased_date)
+
     # 2. Suche in Grocy nach der EAN
     if grocy_product_exists(ean):
         product_id = get_grocy_product_id_by_ean(ean)
         if product_id:
             return update_stock(product_id, amount, price, purchased_date)
         else:
-            print(f"{WARN} Produkt-ID für EAN {ean} konnte nicht gefunden werden.")
+            log.warning(f"{WARN} Produkt-ID für EAN {ean} konnte nicht gefunden werden.")
             return False
     else:
-        product_data = fetch_product_from_off(ean) or {}
-        # Immer den Namen aus dem Bon verwenden, falls vorhanden!
-        if bon_product_name:
-            clean_name = remove_quantity_from_name(bon_product_name)
-            product_data["product_name"] = clean_name
-        else:
-            product_data["product_name"] = remove_quantity_from_name(product_data.get("product_name") or str(ean))
-        product_id = create_product_in_grocy(product_data, ean)
+        product_id = create_product_in_grocy(new_product_data(ean, bon_product_name), ean)
         if not product_id:
             return False
         if not add_barcode_to_product(product_id, ean):
             return False
         return update_stock(product_id, amount, price, purchased_date=purchased_date)
 
+def _add_without_ean(amount, price, bon_product_name, purchased_date=None):
+    # Weder Katalog noch REWE-Code liefern eine EAN: Produkt über den Namen
+    # finden oder anlegen, ohne Barcode (sonst bekäme Grocy den Barcode "None")
+    if not bon_product_name:
+        log.warning(f"{WARN} Artikel ohne EAN und ohne Namen, wird übersprungen.")
+        return False
+    log.warning(f"{WARN} Keine EAN für '{bon_product_name}', buche über den Produktnamen ohne Barcode.")
+    product_id = create_product_in_grocy(new_product_data(None, bon_product_name), None)
+    if not product_id:
+        return False
+    return update_stock(product_id, amount, price, purchased_date=purchased_date)
+
+def new_product_data(ean, bon_product_name=None):
+    # OFF liefert nur einen Ersatz-Namen; mit Bon-Namen ist die Abfrage überflüssig
+    if not ean or (bon_product_name and OFF_SKIP_IF_BON_NAME):
+        product_data = {}
+    else:
+        product_data = fetch_product_from_off(ean) or {}
+    # Immer den Namen aus dem Bon verwenden, falls vorhanden!
+    if bon_product_name:
+        product_data["product_name"] = remove_quantity_from_name(bon_product_name)
+    else:
+        product_data["product_name"] = remove_quantity_from_name(product_data.get("product_name") or str(ean))
+    return product_data
+
+def _journal(receipt_id, line, **fields):
+    with db_lock:
+        journal_update(get_db(), receipt_id, line, current_tenant().name, **fields)
+
+def _add_or_update_journaled(journal_key, ean, amount, price, bon_product_name=None, purchased_date=None):
+    """Erledigte Zeilen werden ohne Grocy-Abfrage übersprungen, angefangene
+    ab dem ersten offenen Schritt fortgesetzt. Eine abgeschickte, aber nie
+    bestätigte Bestandsbuchung wird nicht wiederholt.
+    """
+    receipt_id, line = journal_key
+    tenant = current_tenant().name
+    with db_lock:
+        entry = journal_begin(get_db(), receipt_id, line, bon_product_name, ean, amount, price, purchased_date, tenant)
+    if entry["status"] == "done":
+        log.info(f"{OK} Zeile {line} von eBon {receipt_id} ist bereits gebucht, überspringe.")
+        metrics.count("journal_skipped")
+        return True
+    if entry["merged_into"] is not None:
+        # Zusammengefasst: gebucht wird nur über die erste Zeile der Gruppe, mit der Gesamtmenge
+        log.info(f"{WARN} Zeile {line} von eBon {receipt_id} ist in Zeile {entry['merged_into']} zusammengefasst "
+                 f"und wird nicht einzeln gebucht.")
+        return False
+    if entry["stock_sent"]:
+        log.warning(f"{WARN} Zeile {line} von eBon {receipt_id} ({entry['product_name']}): Buchung wurde abgeschickt, "
+                    f"aber nie bestätigt. Bitte in Grocy prüfen, sie wird nicht erneut gebucht.")
+        return False
+    # Werte aus dem Journal: ein Wiederholungslauf bucht genau die ursprüngliche Zeile
+    ean, amount, price, purchased_date = entry["ean"], entry["amount"], entry["price"], entry["purchased_date"]
+
+    product_id = entry["product_id"]
+    if not ean:
+        # Ohne EAN zählt nur der Name: keine Suche per Barcode, kein Barcode
+        log.warning(f"{WARN} Keine EAN für '{bon_product_name}', buche über den Produktnamen ohne Barcode.")
+    elif product_id is None:
+        with db_lock:
+            product_id = journal_product_id(get_db(), ean, tenant)
+        if product_id is None and grocy_product_exists(ean):
+            product_id = get_grocy_product_id_by_ean(ean)
+        if product_id is not None:
+            _journal(receipt_id, line, product_id=product_id, barcode_done=1)
+            entry["barcode_done"] = 1
+    if product_id is None:
+        # Nur nach einem abgebrochenen Anlegen (oder ohne EAN) muss Grocy nach dem Namen gefragt werden
+        check_existing = bool(entry["create_sent"]) or not ean
+        _journal(receipt_id, line, create_sent=1)
+        product_id = create_product_in_grocy(new_product_data(ean, bon_product_name), ean, check_existing)
+        if not product_id:
+            _journal(receipt_id, line, create_sent=0, status="failed", error="Produkt nicht angelegt")
+            return False
+        _journal(receipt_id, line, create_sent=0, product_id=product_id)
+    if ean and not entry["barcode_done"]:
+        if not add_barcode_to_product(product_id, ean):
+            _journal(receipt_id, line, status="failed", error="Barcode nicht hinzugefügt")
+            return False
+        _journal(receipt_id, line, barcode_done=1)
+
+    _journal(receipt_id, line, stock_sent=1)
+    booked = update_stock(product_id, amount, price, purchased_date)
+    if booked is None:
+        # Timeout nach dem Senden: stock_sent bleibt stehen, die Zeile gilt als unklar
+        _journal(receipt_id, line, status="failed", error="Bestandsbuchung ohne Antwort")
+        return False
+    if not booked:
+        # Grocy hat mit einem Fehler geantwortet oder war nicht erreichbar: nicht gebucht
+        _journal(receipt_id, line, stock_sent=0, status="failed", error="Bestand nicht gebucht")
+        return False
+    _journal(receipt_id, line, stock_sent=0, status="done", error=None)
+    return True
+
+@metrics.timed("fetch_product_from_off")
 def fetch_product_from_off(ean):
-    """Hole Produktdaten von Open Food Facts anhand der EAN."""
-    url = f"https://world.openfoodfacts.org/api/v0/product/{ean}.json"
+    """Hole Produktdaten von Open Food Facts anhand der EAN (lokaler Cache zuerst)."""
+    with db_lock:
+        hit, product = lookup_off_product(get_db(), ean, OFF_CACHE_TTL, OFF_NEGATIVE_TTL)
+    if hit:
+        metrics.count("off_cache_hits")
+        if not product:
+            log.info(f"{WARN} Kein Produkt bei Open Food Facts für EAN {ean} (Cache)")
+        return product
+    if not OFF_ONLINE:
+        return None
+    url = OFF_PRODUCT_URL.format(ean=ean)
+    metrics.count("off_live_requests")
     try:
-        r = requests.get(url, timeout=10)
+        r = client.get(url, endpoint="GET Open Food Facts")
         r.raise_for_status()
         data = r.json()
-        if data.get("status") == 1:
-            return data.get("product", {})
-        else:
-            print(f"{WARN} Kein Produkt bei Open Food Facts für EAN {ean}")
-            return None
     except Exception as e:
-        print(f"{WARN} Fehler beim Abrufen von Open Food Facts: {e}")
+        log.warning(f"{WARN} Fehler beim Abrufen von Open Food Facts: {e}")
         return None
+    product = data.get("product", {}) if data.get("status") == 1 else None
+    with db_lock:
+        store_off_product(get_db(), ean, product)
+    if product is None:
+        log.info(f"{WARN} Kein Produkt bei Open Food Facts für EAN {ean}")
+    return product
 
 
@@ -0,0 +1,172 @@
+from datetime import datetime
+
+# Journal der Grocy-Änderungen je eBon-Zeile (receipt_id, line).
+#
+# Vor jedem Schritt wird die Absicht gespeichert, danach das Ergebnis:
+# create_sent/stock_sent = 1 heißt "POST ist unterwegs", product_id und
+# barcode_done halten fest, was schon angelegt ist. Ein erneuter Lauf
+# überspringt erledigte Zeilen ohne Grocy-Abfrage und setzt angefangene
+# an der richtigen Stelle fort. Zeilen mit stock_sent = 1 und ohne
+# Ergebnis (Abbruch während der Buchung) gelten als unklar und werden
+# nicht automatisch erneut gebucht.
+#
+# Im Mehrmandanten-Betrieb (tenants.py) trägt jede Zeile den Namen des
+# Haushalts, der Schlüssel ist ab Schema-Version 11 (tenant, receipt_id,
+# line): Haushalte mit demselben REWE-Konto teilen sich keine Zeilen.
+# Produkt-IDs gelten nur innerhalb derselben Grocy-Instanz.
+#
+# Zusammengefasste Zeilen (bon_pipeline.plan_articles): die erste Zeile
+# der Gruppe trägt Gesamtmenge und gewichteten Preis und wird gebucht, die
+# übrigen verweisen per merged_into auf sie, übernehmen status und
+# stock_sent und buchen nie selbst.
+
+CREATE_GROCY_JOURNAL_SQL = """
+CREATE TABLE IF NOT EXISTS grocy_journal (
+    receipt_id TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    product_name TEXT,
+    ean TEXT,
+    amount REAL,
+    price REAL,
+    purchased_date TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    product_id INTEGER,
+    create_sent INTEGER NOT NULL DEFAULT 0,
+    barcode_done INTEGER NOT NULL DEFAULT 0,
+    stock_sent INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (receipt_id, line)
+) WITHOUT ROWID
+"""
+
+CREATE_GROCY_JOURNAL_EAN_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_grocy_journal_ean ON grocy_journal (ean, product_id) WHERE barcode_done = 1
+"""
+
+# Ab Schema-Version 11 (Spalte tenant)
+CREATE_GROCY_JOURNAL_TENANT_EAN_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_grocy_journal_tenant_ean ON grocy_journal (tenant, ean, product_id) WHERE barcode_done = 1
+"""
+
+COLUMNS = ("receipt_id", "line", "product_name", "ean", "amount", "price", "purchased_date", "status",
+           "product_id", "create_sent", "barcode_done", "stock_sent", "attempts", "error", "merged_into")
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def _ean(ean):
+    # Zeilen ohne EAN speichern NULL, nie den Text "None"
+    return str(ean).strip() or None if ean else None
+
+def journal_begin(conn, receipt_id, line, product_name, ean, amount, price, purchased_date, tenant=""):
+    """Legt die Zeile an (falls neu), zählt den Versuch und liefert ihren Stand als Dict."""
+    conn.execute("""
+        INSERT OR IGNORE INTO grocy_journal
+            (tenant, receipt_id, line, product_name, ean, amount, price, purchased_date, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (tenant, receipt_id, line, product_name, _ean(ean), amount, price, purchased_date, _now()))
+    conn.execute("UPDATE grocy_journal SET attempts = attempts + 1 "
+                 "WHERE tenant = ? AND receipt_id = ? AND line = ? AND status != 'done'",
+                 (tenant, receipt_id, line))
+    conn.commit()
+    row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM grocy_journal WHERE tenant = ? AND receipt_id = ? AND line = ?",
+                       (tenant, receipt_id, line)).fetchone()
+    return dict(zip(COLUMNS, row))
+
+def journal_coalesce(conn, receipt_id, rows, tenant=""):
+    """Legt eine zusammengefasste Gruppe an: `rows` sind (line, product_name, ean, amount, price,
+    purchased_date), die erste mit den Gesamtwerten. Steht genau diese Gruppe schon im Journal
+    (früherer Lauf), bleibt sie wie sie ist und das Ergebnis ist True. Stehen die Zeilen anders
+    im Journal, passiert nichts und das Ergebnis ist False; sie werden dann einzeln gebucht.
+    """
+    lines = [row[0] for row in rows]
+    lead = lines[0]
+    placeholders = ", ".join("?" * len(lines))
+    existing = dict(conn.execute(f"SELECT line, merged_into FROM grocy_journal "
+                                 f"WHERE tenant = ? AND receipt_id = ? AND line IN ({placeholders})",
+                                 (tenant, receipt_id, *lines)).fetchall())
+    if existing:
+        return existing == {line: None if line == lead else lead for line in lines}
+    now = _now()
+    conn.executemany("""
+        INSERT INTO grocy_journal
+            (tenant, receipt_id, line, product_name, ean, amount, price, purchased_date, merged_into, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(tenant, receipt_id, line, name, _ean(ean), amount, price, purchased_date,
+          None if line == lead else lead, now)
+         for line, name, ean, amount, price, purchased_date in rows])
+    conn.commit()
+    return True
+
+def journal_update(conn, receipt_id, line, tenant="", **fields):
+    fields["updated_at"] = _now()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn.execute(f"UPDATE grocy_journal SET {assignments} WHERE tenant = ? AND receipt_id = ? AND line = ?",
+                 (*fields.values(), tenant, receipt_id, line))
+    shared = {name: fields[name] for name in ("status", "stock_sent") if name in fields}
+    if shared:
+        # Zusammengefasste Zeilen teilen Ergebnis und offene Buchung der gebuchten
+        assignments = ", ".join(f"{name} = ?" for name in shared)
+        conn.execute(f"UPDATE grocy_journal SET {assignments}, updated_at = ? "
+                     f"WHERE tenant = ? AND receipt_id = ? AND merged_into = ?",
+                     (*shared.values(), fields["updated_at"], tenant, receipt_id, line))
+    conn.commit()
+
+def journal_product_id(conn, ean, tenant=""):
+    """Grocy-Produkt-ID, die ein früherer Lauf für diese EAN angelegt oder gefunden hat."""
+    if not _ean(ean):
+        return None
+    row = conn.execute("SELECT product_id FROM grocy_journal "
+                       "WHERE tenant = ? AND ean = ? AND barcode_done = 1 AND product_id IS NOT NULL LIMIT 1",
+                       (tenant, _ean(ean))).fetchone()
+    return row[0] if row else None
+
+def open_journal_entries(conn, tenant=""):
+    """Fehlgeschlagene oder nie abgeschlossene Zeilen, die gefahrlos wiederholt werden können
+    (zusammengefasste nur über ihre gebuchte Zeile)."""
+    rows = conn.execute(f"""
+        SELECT {', '.join(COLUMNS)} FROM grocy_journal
+        WHERE tenant = ? AND status != 'done' AND stock_sent = 0 AND merged_into IS NULL
+        ORDER BY purchased_date, receipt_id, line
+    """, (tenant,)).fetchall()
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+def uncertain_journal_entries(conn, tenant=""):
+    """Zeilen, deren Bestandsbuchung abgeschickt, aber nie bestätigt wurde (je Gruppe die gebuchte)."""
+    rows = conn.execute(f"""
+        SELECT {', '.join(COLUMNS)} FROM grocy_journal
+        WHERE tenant = ? AND status != 'done' AND stock_sent = 1 AND merged_into IS NULL
+        ORDER BY purchased_date, receipt_id, line
+    """, (tenant,)).fetchall()
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+def resolve_uncertain(conn, receipt_id, line, booked, tenant=""):
+    """Klärt eine unklare Bestandsbuchung nach Prüfung in Grocy: booked=True markiert
+    sie als gebucht, booked=False gibt sie zur erneuten Buchung frei. Liefert False,
+    wenn die Zeile (für diesen Haushalt) nicht unklar ist; zusammengefasste Zeilen werden
+    über die Zeile geklärt, die für sie bucht."""
+    row = conn.execute("SELECT 1 FROM grocy_journal WHERE tenant = ? AND receipt_id = ? AND line = ? "
+                       "AND status != 'done' AND stock_sent = 1 AND merged_into IS NULL",
+                       (tenant, receipt_id, line)).fetchone()
+    if row is None:
+        return False
+    if booked:
+        journal_update(conn, receipt_id, line, tenant, stock_sent=0, status="done", error=None)
+    else:
+        journal_update(conn, receipt_id, line, tenant, stock_sent=0, status="failed",
+                       error="Zur erneuten Buchung freigegeben")
+    return True
+
+def open_line_counts(conn):
+    """{Haushalt: (offene Zeilen, davon unklar)} über alle nicht erledigten Journal-Zeilen."""
+    rows = conn.execute("SELECT tenant, COUNT(*), SUM(stock_sent = 1) FROM grocy_journal "
+                        "WHERE status != 'done' GROUP BY tenant").fetchall()
+    return {tenant: (count, uncertain or 0) for tenant, count, uncertain in rows}
+
+def receipt_journal_summary(conn, receipt_id, tenant=""):
+    """(Zeilen im Journal, davon erledigt, Kaufdatum) für einen eBon des Haushalts."""
+    row = conn.execute("SELECT COUNT(*), SUM(status = 'done'), max(purchased_date) FROM grocy_journal "
+                       "WHERE tenant = ? AND receipt_id = ?", (tenant, receipt_id)).fetchone()
+    return row[0], row[1] or 0, row[2]
@@ -0,0 +1,223 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF, HTTP_POOL_SIZE, HTTP_HOST_CONCURRENCY
+from config import HTTP_HOST_RATE, HTTP_HOST_BURST
+from logger import log
+
+# Statuscodes, bei denen ein erneuter Versuch sinnvoll ist
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class EndpointStats:
+    __slots__ = ("calls", "errors", "seconds", "bytes_sent", "bytes_received")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+class TokenBucket:
+    """Im Mittel `rate` Requests pro Sekunde, bis zu `burst` direkt hintereinander.
+
+    Wartende reservieren ihr Token vorab (Kontostand darf negativ werden),
+    so kommen sie in der Reihenfolge ihres Aufrufs dran.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wartet auf ein Token; liefert die Wartezeit in Sekunden."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class HttpClient:
+    """Gemeinsame HTTP-Schicht: eine Session (Keep-Alive-Pool) pro Host,
+    Retry mit Backoff und Latenz-/Byte-Zähler pro Endpoint.
+
+    Wiederholt werden Verbindungsfehler immer, Lesefehler und RETRY_STATUS
+    nur bei idempotenten Methoden (GET, PUT, ...). Ein POST wird also nie
+    doppelt an Grocy geschickt, nachdem er angekommen ist.
+
+    Mit `host_concurrency` > 0 laufen höchstens so viele Requests gleichzeitig
+    pro Host, egal aus wie vielen Threads bzw. Haushalten (tenants.py) sie
+    kommen; `host_rate` > 0 begrenzt zusätzlich die Requests pro Sekunde und
+    Host (TokenBucket mit `host_burst`). Die Sessions speichern keine Cookies aus Antworten, damit sich
+    Haushalte auf demselben Host nichts teilen; Cookies werden pro Request
+    mitgegeben.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, pool_size=HTTP_POOL_SIZE,
+                 host_concurrency=HTTP_HOST_CONCURRENCY, host_rate=HTTP_HOST_RATE, host_burst=HTTP_HOST_BURST):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.host_concurrency = host_concurrency
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.throttled = 0.0
+        self._sessions = {}
+        self._host_slots = {}
+        self._buckets = {}
+        self._stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff,
+                    status_forcelist=RETRY_STATUS,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount(f"{parts.scheme}://", adapter)
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                self._sessions[key] = session
+            return session
+
+    def host_slot(self, url):
+        """Semaphore, die die gleichzeitigen Requests an den Host von `url` begrenzt."""
+        if self.host_concurrency <= 0:
+            return nullcontext()
+        key = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(key)
+            if slot is None:
+                slot = self._host_slots[key] = threading.BoundedSemaphore(self.host_concurrency)
+            return slot
+
+    def throttle(self, url):
+        """Wartet, bis der Host von `url` laut host_rate den nächsten Request bekommen darf."""
+        if self.host_rate <= 0:
+            return
+        key = urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.host_rate, self.host_burst)
+        waited = bucket.acquire()
+        if waited:
+            with self._lock:
+                self.throttled += waited
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint or endpoint_name(method, url)
+        session = self.session_for(url)
+        self.throttle(url)
+        with self.host_slot(url):
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                self._record(endpoint, time.perf_counter() - start, error=True)
+                raise
+        sent = int(response.request.headers.get("Content-Length") or 0)
+        if kwargs.get("stream"):
+            received = int(response.headers.get("Content-Length") or 0)
+        else:
+            received = len(response.content)
+        self._record(endpoint, time.perf_counter() - start, sent, received, error=response.status_code >= 400)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def _record(self, endpoint, seconds, sent=0, received=0, error=False):
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.seconds += seconds
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "seconds": round(s.seconds, 4),
+                    "bytes_sent": s.bytes_sent,
+                    "bytes_received": s.bytes_received,
+                }
+                for endpoint, s in self._stats.items()
+            }
+
+    def merge_stats(self, stats):
+        """Addiert stats() eines anderen Prozesses."""
+        with self._lock:
+            for endpoint, s in stats.items():
+                target = self._stats[endpoint]
+                target.calls += s["calls"]
+                target.errors += s["errors"]
+                target.seconds += s["seconds"]
+                target.bytes_sent += s["bytes_sent"]
+                target.bytes_received += s["bytes_received"]
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+            self.throttled = 0.0
+
+    def print_stats(self):
+        stats = self.stats()
+        if not stats:
+            return
+        log.info("HTTP-Statistik:")
+        for endpoint, s in sorted(stats.items(), key=lambda item: -item[1]["seconds"]):
+            avg = s["seconds"] / s["calls"] * 1000 if s["calls"] else 0
+            log.info(f"  {endpoint:60s} {s['calls']:5d} Aufrufe  {s['errors']:3d} Fehler  "
+                     f"Ø {avg:7.1f} ms  ↑ {s['bytes_sent'] / 1024:8.1f} KiB  ↓ {s['bytes_received'] / 1024:8.1f} KiB")
+        if self.throttled:
+            log.info(f"  Gedrosselt (HTTP_HOST_RATE): {self.throttled:.1f} s gewartet")
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+def endpoint_name(method, url):
+    # IDs, EANs und Datumsangaben im Pfad zusammenfassen: /products/123 -> /products/{id}
+    parts = urlsplit(url)
+    path = re.sub(r"/\d[\d-]*(?=/|$)", "/{id}", parts.path)
+    return f"{method} {parts.netloc}{path}"
+
+# Standard-Client für das ganze Programm
+client = HttpClient()
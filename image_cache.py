@@ -0,0 +1,134 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from colorTerminal import OK, WARN
+from logger import log
+from http_client import client
+
+class ImageCache:
+    """Produktbilder lokal, adressiert über den SHA-256 der URL.
+
+    Pro Bild liegen `<hash>.img` (Inhalt) und `<hash>.json` (URL, ETag,
+    Last-Modified) im Verzeichnis. Vorhandene Bilder werden per
+    If-None-Match/If-Modified-Since revalidiert; bei 304 oder Netzfehler
+    wird die lokale Kopie verwendet. Übersteigt das Verzeichnis `max_bytes`,
+    werden die am längsten nicht benutzten Bilder (mtime) gelöscht.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".img", base + ".json"
+
+    def get(self, url):
+        """Bildinhalt als Bytes oder None."""
+        data_path, meta_path = self._paths(url)
+        meta = None
+        if os.path.exists(data_path):
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            r = client.get(url, headers=headers, verify=False, endpoint="GET Produktbild")
+            if r.status_code == 304 and meta is not None:
+                data = self._read(data_path)
+                if data is not None:
+                    return data
+                # Inzwischen verdrängt: ohne Bedingung neu laden
+                r = client.get(url, verify=False, endpoint="GET Produktbild")
+            r.raise_for_status()
+        except Exception as e:
+            data = self._read(data_path) if meta is not None else None
+            if data is not None:
+                log.warning(f"{WARN} Bild konnte nicht revalidiert werden, nutze lokale Kopie: {e}")
+                return data
+            log.warning(f"{WARN} Fehler beim Herunterladen des Bildes: {e}")
+            return None
+
+        self._write(data_path, meta_path, r.content, {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        })
+        return r.content
+
+    def _read(self, data_path):
+        # None, wenn die Verdrängung die Datei nach dem exists()-Check gelöscht hat
+        try:
+            with open(data_path, "rb") as f:
+                data = f.read()
+            os.utime(data_path)  # für LRU
+        except OSError:
+            return None
+        return data
+
+    def _write(self, data_path, meta_path, data, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            for path, content in ((data_path, data), (meta_path, json.dumps(meta).encode("utf-8"))):
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".img"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        while total > self.max_bytes and len(entries) > 1:
+            _mtime, size, path = entries.pop(0)
+            for p in (path, path[:-len(".img")] + ".json"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+def downscale(data, max_dimension):
+    """Verkleinert ein Bild auf höchstens max_dimension Pixel Kantenlänge (JPEG).
+
+    Ohne Pillow, bei max_dimension <= 0 oder wenn das Bild schon klein genug
+    ist, kommen die Originaldaten zurück.
+    """
+    if max_dimension <= 0:
+        return data
+    try:
+        from PIL import Image  # optional und nur beim Verkleinern gebraucht
+    except ImportError:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_dimension:
+                return data
+            image.thumbnail((max_dimension, max_dimension))
+            out = io.BytesIO()
+            image.convert("RGB").save(out, format="JPEG", quality=85)
+    except Exception as e:
+        log.warning(f"{WARN} Bild konnte nicht verkleinert werden: {e}")
+        return data
+    if out.tell() >= len(data):
+        return data
+    log.debug(f"{OK} Bild verkleinert: {len(data) / 1024:.0f} KiB → {out.tell() / 1024:.0f} KiB")
+    return out.getvalue()
@@ -0,0 +1,35 @@
+import logging
+import sys
+from logging.handlers import MemoryHandler
+from config import LOG_LEVEL, LOG_BUFFER_LINES
+
+# Gemeinsame Ausgabe für alle Module: log.debug/info/warning/error statt print.
+#
+# Die Meldungen tragen wie bisher die Präfixe aus colorTerminal, das Level
+# entscheidet nur, ob sie erscheinen (LOG_LEVEL bzw. --log-level). Ausgegeben
+# wird gepuffert in Blöcken von LOG_BUFFER_LINES Zeilen, Warnungen und Fehler
+# sofort. Vor input() und am Programmende muss flush() aufgerufen werden.
+
+class _StdoutHandler(logging.StreamHandler):
+    # sys.stdout erst beim Schreiben auflösen, damit redirect_stdout greift
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, _value):
+        pass
+
+log = logging.getLogger("rewe2grocy")
+log.propagate = False
+_target = _StdoutHandler()
+_target.setFormatter(logging.Formatter("%(message)s"))
+_buffer = MemoryHandler(LOG_BUFFER_LINES, flushLevel=logging.WARNING, target=_target)
+log.addHandler(_buffer)
+log.setLevel(LOG_LEVEL)
+
+def set_level(level):
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+def flush():
+    _buffer.flush()
@@ -1,111 +1,360 @@
+import time
+STARTED = time.perf_counter()  # Startzeitpunkt für time_to_receipt_list
+
+import argparse
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from colorTerminal import OK, WARN, ERROR
-from config import BON_HISTORY, HARDCODED_RTSP_TOKEN
-from grocy_connector import (
-    add_or_update_product,
-#    load_rewe_price_data,
-    get_ean_from_product_name,
-    get_ean_from_product_name_fuzzy,
-    get_ean_from_rewe_code,
-    grocy_product_exists,
-)
-from rewe_products_import import main as update_rewe_products_db
+from config import BON_HISTORY, BON_CONCURRENCY, CATALOG_REFRESH_BACKGROUND, SYNC_FIRST_RUN_RECEIPTS
+from config import SERVE_HOST, SERVE_PORT, SERVE_POLL_INTERVAL, TENANTS_FILE, TENANT_CONCURRENCY
+from rewe_products_import import refresh_catalog
+from bon_pipeline import process_articles, process_receipts, retry_journal
+from receipt_ledger import synced_receipt_ids, record_synced, record_skipped
+from grocy_journal import receipt_journal_summary, uncertain_journal_entries, resolve_uncertain
+from tenants import current_tenant, load_tenants, use_tenant
+from http_client import client
+from logger import log, flush as flush_log, set_level as set_log_level
+from metrics import metrics, export_metrics
 
 import grocy_connector
-import json
 
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 RECEIPT_URL = "https://shop.rewe.de/api/receipts/"
+RECEIPT_HEADERS = {"User-Agent": "Mozilla/5.0"}
 
 def prerequisites():
     try:
         with open("ignore.txt", "r", encoding='utf-8') as f:
             f.read().splitlines()
     except FileNotFoundError:
-        print(f"{ERROR} ignore.txt nicht gefunden. Datei wird erstellt..")
+        log.error(f"{ERROR} ignore.txt nicht gefunden. Datei wird erstellt..")
         with open("ignore.txt", "w", encoding='utf-8') as f:
             f.write("")
 
-def fetch_rewe_bon(rtsp: str):
-    headers = {"User-Agent": "Mozilla/5.0"}
+def fetch_receipt_list(rtsp: str):
     try:
-        response = requests.get(RECEIPT_URL, cookies={"rstp": rtsp}, headers=headers, timeout=10)
+        response = client.get(RECEIPT_URL, cookies={"rstp": rtsp}, headers=RECEIPT_HEADERS)
         response.raise_for_status()
         receipt_list = response.json()
     except requests.exceptions.RequestException as e:
-        print(f"{ERROR} HTTP-Fehler beim Abrufen der eBon-Liste: {e}")
-        return None, None
+        log.error(f"{ERROR} HTTP-Fehler beim Abrufen der eBon-Liste: {e}")
+        return None
     if 'items' not in receipt_list:
-        print(f"{ERROR} Keine 'items' in der Antwort gefunden.")
-        return None, None
+        log.error(f"{ERROR} Keine 'items' in der Antwort gefunden.")
+        return None
+    metrics.observe("time_to_receipt_list", time.perf_counter() - STARTED)
+    return receipt_list['items']
 
-    option_receipts = receipt_list['items']
-    print(f"{OK} Empfange eBon-Liste der letzten Einkäufe:")
+def fetch_receipt_articles(rtsp: str, receipt_id):
+    response = client.get(RECEIPT_URL + receipt_id, cookies={"rstp": rtsp}, headers=RECEIPT_HEADERS,
+                          endpoint="GET REWE eBon")
+    response.raise_for_status()
+    return response.json().get("articles", [])
+
+def fetch_rewe_bon(rtsp: str):
+    option_receipts = fetch_receipt_list(rtsp)
+    if option_receipts is None:
+        return None, None, None
+    with grocy_connector.db_lock:
+        synced = synced_receipt_ids(grocy_connector.get_db(), current_tenant().name, skipped=False)
+    log.info(f"{OK} Empfange eBon-Liste der letzten Einkäufe:")
     for x in range(min(BON_HISTORY, len(option_receipts))):
         receipt = option_receipts[x]
-        print(f"ID: {x}; Vom: {receipt['receiptTimestamp']}; Summe: {receipt['receiptTotalPrice']/100:.2f}€")
+        note = " (bereits übertragen)" if receipt['receiptId'] in synced else ""
+        log.info(f"ID: {x}; Vom: {receipt['receiptTimestamp']}; Summe: {receipt['receiptTotalPrice']/100:.2f}€{note}")
 
     while True:
         try:
+            flush_log()
             option = int(input(f"Welchen Bon möchtest du an Grocy senden? (ID 0-{min(BON_HISTORY, len(option_receipts))-1}): "))
             if 0 <= option < min(BON_HISTORY, len(option_receipts)):
                 break
             else:
-                print(f"{ERROR} Bitte wähle einen Bon zwischen 0 und {min(BON_HISTORY, len(option_receipts))-1} aus.")
+                log.error(f"{ERROR} Bitte wähle einen Bon zwischen 0 und {min(BON_HISTORY, len(option_receipts))-1} aus.")
         except ValueError:
-            print(f"{ERROR} Bitte eine gültige Zahl eingeben.")
+            log.error(f"{ERROR} Bitte eine gültige Zahl eingeben.")
 
+    receipt_id = option_receipts[option]['receiptId']
     try:
-        rewe_bon_response = requests.get(RECEIPT_URL + option_receipts[option]['receiptId'], cookies={"rstp": rtsp}, headers=headers, timeout=10)
-        rewe_bon_response.raise_for_status()
+        articles = fetch_receipt_articles(rtsp, receipt_id)
     except requests.exceptions.RequestException as e:
-        print(f"{ERROR} Fehler beim Abrufen des ausgewählten Rewe-Bons: {e}")
-        return None, None
+        log.error(f"{ERROR} Fehler beim Abrufen des ausgewählten Rewe-Bons: {e}")
+        return None, None, None
 
-    print(f"{OK} Rewe-Bon mit der UUID {option_receipts[option]['receiptId']} wurde erfolgreich abgerufen")
+    log.info(f"{OK} Rewe-Bon mit der UUID {receipt_id} wurde erfolgreich abgerufen")
     # Extrahiere das Kaufdatum
     purchased_date = option_receipts[option]['receiptTimestamp'][:10]  # "YYYY-MM-DD"
-    return rewe_bon_response.json().get("articles", []), purchased_date
-
-def processrewe_bon(rewe_bon, purchased_date=None):
-    for product in rewe_bon:
-        product_name = product.get("productName", "")
-        if not product_name:
-            print(f"{WARN} Produkt ohne 'productName' gefunden, wird übersprungen: {product}")
-            continue
-        ean = get_ean_from_product_name(product_name)
-        if not ean:
-            ean = get_ean_from_product_name_fuzzy(product_name)
-        if not ean:
-            rewe_code = product.get("nan", "")
-            ean = get_ean_from_rewe_code(rewe_code)
-        if not ean:
-            ean = str(product.get("nan", ""))
-        quantity = int(product.get("quantity", 0))
-        unit_price = product.get("unitPrice", 0) / 100
-        print(f"Verarbeite Produkt: Name='{product_name}', EAN={ean}, Menge={quantity}, Preis={unit_price:.2f}€")
-
-        # Hier das Kaufdatum mitgeben!
-        add_or_update_product(ean, quantity, unit_price, bon_product_name=product_name, purchased_date=purchased_date)
-
-def main():
+    return articles, purchased_date, receipt_id
+
+def processrewe_bon(rewe_bon, purchased_date=None, concurrency=BON_CONCURRENCY, receipt_id=None):
+    return process_articles(rewe_bon, purchased_date=purchased_date, concurrency=concurrency, receipt_id=receipt_id)
+
+def retry_failed(concurrency=BON_CONCURRENCY):
+    """Wiederholt fehlgeschlagene Zeilen aus dem Journal; vollständige eBons gelten danach als übertragen."""
+    summary = retry_journal(concurrency=concurrency)
+    tenant = current_tenant().name
+    if not summary:
+        log.info(f"{OK} Keine fehlgeschlagenen Zeilen im Journal.")
+    with grocy_connector.db_lock:
+        conn = grocy_connector.get_db()
+        for receipt_id, (lines, failed) in summary.items():
+            if failed:
+                log.warning(f"{WARN} eBon {receipt_id}: {failed} von {lines} Zeilen weiterhin fehlgeschlagen.")
+                continue
+            total, done, purchased_date = receipt_journal_summary(conn, receipt_id, tenant)
+            if done == total:
+                record_synced(conn, receipt_id, purchased_date, total, tenant)
+            log.info(f"{OK} eBon {receipt_id}: {lines} Zeilen nachgebucht.")
+        uncertain = uncertain_journal_entries(conn, tenant)
+    for entry in uncertain:
+        log.warning(f"{WARN} Unklar, ob gebucht (bitte in Grocy prüfen): eBon {entry['receipt_id']} Zeile {entry['line']} "
+                    f"'{entry['product_name']}' vom {entry['purchased_date']}")
+    if uncertain:
+        log.warning(f"{WARN} Nach der Prüfung: --resolve-line EBON ZEILE booked (ist gebucht) bzw. rebook (erneut buchen).")
+    return all(not failed for _lines, failed in summary.values()) and not uncertain
+
+RESOLVE_ACTIONS = ("booked", "rebook")
+
+def resolve_line(receipt_id, line, action, tenants_file=None, concurrency=BON_CONCURRENCY):
+    """Klärt eine unklare Bestandsbuchung nach Prüfung in Grocy.
+
+    "booked": die Buchung ist in Grocy angekommen, die Zeile gilt als erledigt.
+    "rebook": sie fehlt in Grocy, die Zeile wird sofort erneut gebucht.
+    Ist danach der ganze eBon erledigt, kommt er in den Ledger. Mit
+    `tenants_file` wird die Zeile bei allen Haushalten daraus gesucht.
+    """
+    tenants = load_tenants(tenants_file) if tenants_file else [current_tenant()]
+    for tenant in tenants:
+        with use_tenant(tenant):
+            with grocy_connector.db_lock:
+                conn = grocy_connector.get_db()
+                if not resolve_uncertain(conn, receipt_id, line, action == "booked", tenant.name):
+                    continue
+                if action == "booked":
+                    log.info(f"{OK} eBon {receipt_id} Zeile {line} als gebucht markiert.")
+                    total, done, purchased_date = receipt_journal_summary(conn, receipt_id, tenant.name)
+                    if done == total:
+                        record_synced(conn, receipt_id, purchased_date, total, tenant.name)
+                        log.info(f"{OK} eBon {receipt_id}: alle {total} Zeilen übertragen.")
+                    return True
+            log.info(f"eBon {receipt_id} Zeile {line} wird erneut gebucht.")
+            return retry_failed(concurrency=concurrency)
+    log.error(f"{ERROR} eBon {receipt_id} Zeile {line}: keine unklare Buchung im Journal.")
+    return False
+
+def sync_all(rtsp, concurrency=BON_CONCURRENCY, catalog_ready=None, backfill=False,
+             first_run_receipts=SYNC_FIRST_RUN_RECEIPTS):
+    """Überträgt alle noch nicht übertragenen eBons ohne Rückfrage.
+
+    Beim ersten Lauf (leeres Ledger) nur die neuesten `first_run_receipts`,
+    die älteren werden als übersprungen eingetragen; `backfill` überträgt
+    auch diese. `catalog_ready` wird vor der Namensauflösung aufgerufen
+    (wartet auf eine laufende Katalog-Aktualisierung). Liefert True, wenn
+    alles übertragen ist, False, wenn Zeilen offen bleiben, und None, wenn
+    schon die eBon-Liste nicht abrufbar war.
+    """
+    receipts = fetch_receipt_list(rtsp)
+    if receipts is None:
+        return None
+    tenant = current_tenant().name
+    with grocy_connector.db_lock:
+        synced = synced_receipt_ids(grocy_connector.get_db(), tenant, skipped=not backfill)
+    new_receipts = sorted(
+        (r for r in receipts if r['receiptId'] not in synced),
+        key=lambda r: r['receiptTimestamp']
+    )
+    if not synced and not backfill and len(new_receipts) > first_run_receipts:
+        # Kein Ledger: nicht jahrelange eBon-Historie auf einmal buchen
+        skipped = new_receipts[:len(new_receipts) - first_run_receipts]
+        new_receipts = new_receipts[len(skipped):]
+        with grocy_connector.db_lock:
+            record_skipped(grocy_connector.get_db(),
+                           [(r['receiptId'], r['receiptTimestamp'][:10]) for r in skipped], tenant)
+        log.warning(f"{WARN} Erster Lauf: {len(skipped)} ältere eBons übersprungen, "
+                    f"übertrage nur die neuesten {len(new_receipts)} (--backfill überträgt auch die älteren).")
+    if not new_receipts:
+        log.info(f"{OK} Keine neuen eBons, alle {len(receipts)} sind bereits übertragen.")
+        return True
+    log.info(f"{OK} {len(new_receipts)} neue eBons (von {len(receipts)}), lade Details...")
+
+    # Details parallel abrufen; Bons mit Fehler bleiben offen für den nächsten Lauf
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [(r, executor.submit(fetch_receipt_articles, rtsp, r['receiptId'])) for r in new_receipts]
+        fetched = []
+        for receipt, future in futures:
+            try:
+                fetched.append((receipt['receiptId'], receipt['receiptTimestamp'][:10], future.result()))
+            except requests.exceptions.RequestException as e:
+                log.error(f"{ERROR} Fehler beim Abrufen des eBons {receipt['receiptId']}: {e}")
+
+    if catalog_ready:
+        catalog_ready()
+    summary = process_receipts(fetched, concurrency=concurrency)
+    all_ok = len(fetched) == len(new_receipts)
+    with grocy_connector.db_lock:
+        for receipt_id, purchased_date, _articles in fetched:
+            lines, failed = summary[receipt_id]
+            if failed:
+                all_ok = False
+                log.warning(f"{WARN} eBon {receipt_id} vom {purchased_date}: {failed} von {lines} Zeilen fehlgeschlagen, bleibt offen.")
+                continue
+            record_synced(grocy_connector.get_db(), receipt_id, purchased_date, lines, tenant)
+            log.info(f"{OK} eBon {receipt_id} vom {purchased_date} übertragen ({lines} Zeilen).")
+    return all_ok
+
+def start_catalog_refresh(mode="auto", background=None):
+    """Startet die Katalog-Aktualisierung ("auto": höchstens einmal pro Tag,
+    "always", "never"); liefert eine Funktion, die auf ihr Ende wartet.
+
+    Im Hintergrund läuft sie, während die eBon-Liste geladen und ausgewählt
+    wird; erst die Namensauflösung braucht den neuen Stand.
+    """
+    if mode == "never":
+        return lambda: None
+    force = mode == "always"
+    if background is None:
+        background = CATALOG_REFRESH_BACKGROUND
+    if not background:
+        refresh_catalog(force=force)
+        return lambda: None
+
+    def run():
+        try:
+            refresh_catalog(force=force)
+        except Exception as e:
+            log.warning(f"{WARN} Katalog-Aktualisierung fehlgeschlagen, nutze den vorhandenen Stand: {e}")
+
+    # Die DB einmal im Hauptthread öffnen (und ggf. migrieren), bevor der Import startet
+    grocy_connector.get_db()
+    thread = threading.Thread(target=run, name="katalog-aktualisierung", daemon=True)
+    thread.start()
+
+    def wait():
+        if thread.is_alive():
+            log.info("Warte auf die Katalog-Aktualisierung...")
+        thread.join()
+    return wait
+
+def main(concurrency=BON_CONCURRENCY, sync_all_receipts=False, refresh="auto", retry=False, backfill=False):
     prerequisites()
-    print("Willkommen im Rewe2Grocy Connector!")
-    print("Der RTSP Token ist hart im Script hinterlegt und wird verwendet.\n")
+    log.info("Willkommen im Rewe2Grocy Connector!")
+    log.info("Der RTSP Token ist hart im Script hinterlegt und wird verwendet.\n")
 
-    rtsp = HARDCODED_RTSP_TOKEN
-    rewe_bon, purchased_date = fetch_rewe_bon(rtsp)
+    rtsp = current_tenant().rtsp_token
+    catalog_ready = start_catalog_refresh(refresh)
+    if retry:
+        catalog_ready()
+        retry_failed(concurrency=concurrency)
+    elif sync_all_receipts:
+        sync_all(rtsp, concurrency=concurrency, catalog_ready=catalog_ready, backfill=backfill)
+    else:
+        rewe_bon, purchased_date, receipt_id = fetch_rewe_bon(rtsp)
+        catalog_ready()
+        if rewe_bon:
+            ok = processrewe_bon(rewe_bon, purchased_date=purchased_date, concurrency=concurrency,
+                                 receipt_id=receipt_id)
+            if ok == len([p for p in rewe_bon if p.get("productName")]):
+                with grocy_connector.db_lock:
+                    record_synced(grocy_connector.get_db(), receipt_id, purchased_date, ok, current_tenant().name)
+        else:
+            log.error(f"{ERROR} Kein gültiger eBon abgerufen. Bitte Token prüfen und erneut versuchen.")
+    grocy_connector.wait_for_image_uploads()
+    catalog_ready()
+    grocy_connector.close_db()
+    grocy_connector.resolution_stats.print_stats()
+    client.print_stats()
+    export_metrics()
 
-    if rewe_bon:
-        processrewe_bon(rewe_bon, purchased_date=purchased_date)
+def tenant_scheduler(tenants_file, concurrency=BON_CONCURRENCY, tenant_concurrency=TENANT_CONCURRENCY, retry=False,
+                     backfill=False):
+    """Scheduler für alle Haushalte aus `tenants_file` (siehe tenants.py und tenant_scheduler.py)."""
+    from tenant_scheduler import TenantScheduler
+    tenants = load_tenants(tenants_file)
+    log.info(f"{OK} {len(tenants)} Haushalte aus {tenants_file}, bis zu {tenant_concurrency} gleichzeitig.")
+    if retry:
+        sync = lambda _tenant: retry_failed(concurrency=concurrency)
     else:
-        print(f"{ERROR} Kein gültiger eBon abgerufen. Bitte Token prüfen und erneut versuchen.")
-    grocy_connector.db_conn.close()
+        sync = lambda tenant: sync_all(tenant.rtsp_token, concurrency=concurrency, backfill=backfill)
+    return TenantScheduler(tenants, sync, concurrency=tenant_concurrency)
+
+def main_tenants(tenants_file=TENANTS_FILE, concurrency=BON_CONCURRENCY, tenant_concurrency=TENANT_CONCURRENCY,
+                 refresh="auto", retry=False, backfill=False):
+    """Ein Durchlauf über alle Haushalte ohne Rückfrage (wie --sync-all bzw. --retry-failed je Haushalt)."""
+    prerequisites()
+    scheduler = tenant_scheduler(tenants_file, concurrency, tenant_concurrency, retry, backfill)
+    # Der Katalog ist für alle Haushalte derselbe: einmal aktualisieren, bevor sie starten
+    start_catalog_refresh(refresh, background=False)
+    ok = scheduler.run_once()
+    grocy_connector.wait_for_image_uploads()
+    grocy_connector.close_db()
+    grocy_connector.resolution_stats.print_stats()
+    client.print_stats()
+    export_metrics()
+    return ok
+
+def serve(concurrency=BON_CONCURRENCY, host=SERVE_HOST, port=SERVE_PORT, interval=SERVE_POLL_INTERVAL,
+          tenants_file=None, tenant_concurrency=TENANT_CONCURRENCY, backfill=False):
+    """Dienst-Modus: neue eBons regelmäßig ohne Rückfrage übertragen (siehe receipt_daemon.py),
+    mit `tenants_file` für alle Haushalte daraus."""
+    from receipt_daemon import ReceiptDaemon
+    prerequisites()
+    if tenants_file:
+        scheduler = tenant_scheduler(tenants_file, concurrency, tenant_concurrency, backfill=backfill)
+        daemon = ReceiptDaemon(scheduler.run_once, interval=interval, details=scheduler.status)
+    else:
+        rtsp = current_tenant().rtsp_token
+        daemon = ReceiptDaemon(lambda: sync_all(rtsp, concurrency=concurrency, backfill=backfill), interval=interval)
+    daemon.run(host, port)
 
 if __name__ == "__main__":
-    # Prüfe und aktualisiere die REWE-Produktdatenbank, falls neue Daten vorhanden sind
-    update_rewe_products_db()
-    # Starte danach die eigentliche Hauptfunktion
-    main()
+    parser = argparse.ArgumentParser(description="REWE eBon nach Grocy übertragen")
+    parser.add_argument("--concurrency", type=int, default=BON_CONCURRENCY,
+                        help="Artikel, die parallel an Grocy übertragen werden (1 = nacheinander)")
+    parser.add_argument("--sync-all", action="store_true",
+                        help="Alle noch nicht übertragenen eBons ohne Rückfrage übertragen")
+    parser.add_argument("--backfill", action="store_true",
+                        help=f"Mit --sync-all/--serve auch eBons übertragen, die der erste Lauf übersprungen hat "
+                             f"(er überträgt nur die neuesten {SYNC_FIRST_RUN_RECEIPTS})")
+    parser.add_argument("--refresh-catalog", choices=["auto", "always", "never"], default="auto",
+                        help="REWE-Katalog aktualisieren: auto = höchstens einmal pro Tag (Standard)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper,
+                        help="Ausgabe-Level (Standard aus config.LOG_LEVEL; DEBUG zeigt jeden Einzelschritt)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Fehlgeschlagene eBon-Zeilen aus dem Journal erneut übertragen")
+    parser.add_argument("--resolve-line", nargs=3, metavar=("EBON", "ZEILE", "booked|rebook"),
+                        help="Unklare Bestandsbuchung nach Prüfung in Grocy klären: booked = ist gebucht, "
+                             "rebook = fehlt, erneut buchen")
+    parser.add_argument("--serve", action="store_true",
+                        help="Als Dienst laufen: eBon-Liste regelmäßig abfragen, neue eBons automatisch übertragen")
+    parser.add_argument("--port", type=int, default=SERVE_PORT,
+                        help="Port für /status, /sync und /metrics im Dienst-Modus (0 = aus)")
+    parser.add_argument("--interval", type=int, default=SERVE_POLL_INTERVAL,
+                        help="Sekunden zwischen zwei Abfragen im Dienst-Modus")
+    parser.add_argument("--tenants", nargs="?", const=TENANTS_FILE, metavar="DATEI",
+                        help=f"Alle Haushalte aus DATEI (Standard {TENANTS_FILE}) in einem Prozess synchronisieren")
+    parser.add_argument("--tenant-concurrency", type=int, default=TENANT_CONCURRENCY,
+                        help="Haushalte, die gleichzeitig synchronisiert werden")
+    args = parser.parse_args()
+    if args.log_level:
+        set_log_level(args.log_level)
+    if args.resolve_line:
+        receipt_id, line, action = args.resolve_line
+        if action not in RESOLVE_ACTIONS or not line.isdigit():
+            parser.error("--resolve-line erwartet EBON ZEILE booked|rebook")
+        resolve_line(receipt_id, int(line), action, tenants_file=args.tenants, concurrency=args.concurrency)
+        grocy_connector.wait_for_image_uploads()
+        grocy_connector.close_db()
+        flush_log()
+    elif args.serve:
+        serve(concurrency=args.concurrency, port=args.port, interval=args.interval,
+              tenants_file=args.tenants, tenant_concurrency=args.tenant_concurrency, backfill=args.backfill)
+    elif args.tenants:
+        main_tenants(args.tenants, concurrency=args.concurrency, tenant_concurrency=args.tenant_concurrency,
+                     refresh=args.refresh_catalog, retry=args.retry_failed, backfill=args.backfill)
+    else:
+        # Die REWE-Produktdatenbank wird in main() aktualisiert, höchstens einmal pro Tag
+        main(concurrency=args.concurrency, sync_all_receipts=args.sync_all, refresh=args.refresh_catalog,
+             retry=args.retry_failed, backfill=args.backfill)
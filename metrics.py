@@ -0,0 +1,182 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from colorTerminal import OK, WARN
+from config import METRICS_JSON_FILE, METRICS_TEXTFILE, METRICS_TEXTFILE_FORMAT
+from http_client import client
+from logger import log
+
+# Laufzeit und Aufrufe je Verarbeitungsschritt (EAN-Suche, OFF, Anlegen,
+# Bild, Bestand, CSV-Import) plus einfache Zähler. Am Ende eines Laufs als
+# JSON-Zusammenfassung und optional als Prometheus-Textfile (node_exporter
+# textfile collector) oder OpenMetrics geschrieben.
+
+METRIC_PREFIX = "rewe2grocy"
+
+class StageStats:
+    __slots__ = ("calls", "failures", "seconds", "max_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+class Metrics:
+    """Thread-sichere Timer und Zähler für einen Programmlauf."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._stages = defaultdict(StageStats)
+            self._counters = Counter()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self._record(stage, time.perf_counter() - start, failed)
+
+    def timed(self, stage, check_result=False):
+        """Decorator: misst jeden Aufruf; mit check_result zählt auch ein leeres Ergebnis als Fehlschlag."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = True
+                try:
+                    result = fn(*args, **kwargs)
+                    failed = check_result and not result
+                    return result
+                finally:
+                    self._record(stage, time.perf_counter() - start, failed)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds):
+        """Einzelne, anderswo gemessene Dauer (z.B. Zeit bis zur eBon-Liste)."""
+        self._record(stage, seconds, False)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _record(self, stage, seconds, failed):
+        with self._lock:
+            stats = self._stages[stage]
+            stats.calls += 1
+            stats.failures += int(failed)
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def merge(self, summary):
+        """Übernimmt Zeiten und Zähler aus summary() eines anderen Prozesses (z.B. Import-Worker)."""
+        with self._lock:
+            for stage, s in summary["stages"].items():
+                stats = self._stages[stage]
+                stats.calls += s["calls"]
+                stats.failures += s["failures"]
+                stats.seconds += s["seconds"]
+                stats.max_seconds = max(stats.max_seconds, s["max_seconds"])
+            self._counters.update(summary["counters"])
+        client.merge_stats(summary["http"])
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration": round(time.time() - self.started, 3),
+                "stages": {
+                    stage: {
+                        "calls": s.calls,
+                        "failures": s.failures,
+                        "seconds": round(s.seconds, 4),
+                        "max_seconds": round(s.max_seconds, 4),
+                    }
+                    for stage, s in sorted(self._stages.items())
+                },
+                "counters": dict(sorted(self._counters.items())),
+                "http": client.stats(),
+            }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2, ensure_ascii=False) + "\n")
+
+    def write_textfile(self, path, openmetrics=False):
+        _write_atomic(path, to_exposition(self.summary(), openmetrics))
+
+def to_exposition(summary, openmetrics=False):
+    """Prometheus-Textformat bzw. OpenMetrics (Zähler ohne _total im TYPE, # EOF am Ende)."""
+    families = [
+        ("run_duration_seconds", "gauge", "Laufzeit des Programms", [({}, summary["duration"])]),
+        ("run_start_time_seconds", "gauge", "Startzeitpunkt (Unixzeit)", [({}, summary["started"])]),
+        ("stage_calls", "counter", "Aufrufe je Verarbeitungsschritt",
+         [({"stage": k}, s["calls"]) for k, s in summary["stages"].items()]),
+        ("stage_failures", "counter", "Fehlgeschlagene Aufrufe je Verarbeitungsschritt",
+         [({"stage": k}, s["failures"]) for k, s in summary["stages"].items()]),
+        ("stage_seconds", "counter", "Summierte Laufzeit je Verarbeitungsschritt",
+         [({"stage": k}, s["seconds"]) for k, s in summary["stages"].items()]),
+        ("stage_max_seconds", "gauge", "Längster Einzelaufruf je Verarbeitungsschritt",
+         [({"stage": k}, s["max_seconds"]) for k, s in summary["stages"].items()]),
+        ("events", "counter", "Zähler (Artikel, Zeilen, ...)",
+         [({"name": k}, v) for k, v in summary["counters"].items()]),
+        ("http_requests", "counter", "HTTP-Aufrufe je Endpoint",
+         [({"endpoint": k}, s["calls"]) for k, s in summary["http"].items()]),
+        ("http_errors", "counter", "HTTP-Fehler je Endpoint",
+         [({"endpoint": k}, s["errors"]) for k, s in summary["http"].items()]),
+        ("http_seconds", "counter", "Summierte HTTP-Latenz je Endpoint",
+         [({"endpoint": k}, s["seconds"]) for k, s in summary["http"].items()]),
+    ]
+    lines = []
+    for name, kind, help_text, samples in families:
+        if not samples:
+            continue
+        full = f"{METRIC_PREFIX}_{name}"
+        sample_name = full + "_total" if kind == "counter" else full
+        family_name = full if openmetrics else sample_name
+        lines.append(f"# HELP {family_name} {help_text}")
+        lines.append(f"# TYPE {family_name} {kind}")
+        for labels, value in samples:
+            label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{sample_name}{{{label_str}}} {value}" if label_str else f"{sample_name} {value}")
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return re.sub(r'(["\\])', r"\\\1", str(value)).replace("\n", "\\n")
+
+def _write_atomic(path, text):
+    # node_exporter liest das Textfile jederzeit: erst schreiben, dann umbenennen
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# Gemeinsame Instanz für das ganze Programm
+metrics = Metrics()
+
+def export_metrics(json_file=METRICS_JSON_FILE, textfile=METRICS_TEXTFILE, textfile_format=METRICS_TEXTFILE_FORMAT):
+    """Schreibt die Zusammenfassung des Laufs; Fehler beim Schreiben brechen nichts ab."""
+    try:
+        if json_file:
+            metrics.write_json(json_file)
+            log.info(f"{OK} Metriken gespeichert: {json_file}")
+        if textfile:
+            metrics.write_textfile(textfile, openmetrics=textfile_format == "openmetrics")
+            log.info(f"{OK} Metriken für Prometheus gespeichert: {textfile}")
+    except OSError as e:
+        log.warning(f"{WARN} Metriken konnten nicht gespeichert werden: {e}")
@@ -0,0 +1,84 @@
+from collections import Counter
+from logger import log
+
+# Persistenter Cache der EAN-Auflösung von Bon-Namen (normalisiert) und
+# REWE-Code ("nan"). Wiederkehrende Artikel wie "BANANE" kosten so nur
+# noch einen Lookup über den Primärschlüssel.
+#
+# Gültigkeit: Treffer über den exakten Namen, den Matching-Schlüssel oder
+# den REWE-Code bleiben gültig, bis ein Import eine Zeile mit demselben
+# normalisierten Namen oder Schlüssel hinzufügt (INVALIDATE_RESOLUTIONS_SQL). Fuzzy-Treffer und der nan-Fallback hängen
+# von allen Katalogzeilen ab und gelten nur, solange MAX(products.id) noch
+# dem gespeicherten catalog_version entspricht. Ändert sich Name oder EAN
+# einer vorhandenen Zeile, verwirft ein Trigger (catalog_db) die betroffenen
+# Einträge und alle Fuzzy-Treffer.
+
+CREATE_NAME_RESOLUTION_SQL = """
+CREATE TABLE IF NOT EXISTS name_resolution (
+    bon_name TEXT NOT NULL,
+    nan TEXT NOT NULL,
+    ean TEXT NOT NULL,
+    method TEXT NOT NULL,
+    score REAL,
+    catalog_version INTEGER,
+    PRIMARY KEY (bon_name, nan)
+) WITHOUT ROWID
+"""
+
+STABLE_METHODS = ("name", "key", "rewe_code")
+
+LOOKUP_SQL = f"""
+SELECT ean, method FROM name_resolution
+WHERE bon_name = ? AND nan = ?
+  AND (method IN {STABLE_METHODS} OR catalog_version IS (SELECT MAX(id) FROM products))
+"""
+
+STORE_SQL = """
+INSERT OR REPLACE INTO name_resolution (bon_name, nan, ean, method, score, catalog_version)
+VALUES (?, ?, ?, ?, ?, (SELECT MAX(id) FROM products))
+"""
+
+# Erwartet die Staging-Tabelle des Imports, vor INSERT_FROM_STAGING_SQL,
+# und die SQL-Funktion match_key (catalog_db.migrate registriert sie)
+INVALIDATE_RESOLUTIONS_SQL = """
+WITH new_rows AS (
+    SELECT s.name_norm, s.name_key FROM staging AS s
+    WHERE NOT EXISTS (SELECT 1 FROM products AS p WHERE p.ean_norm = s.ean_norm)
+)
+DELETE FROM name_resolution
+WHERE bon_name IN (SELECT name_norm FROM new_rows)
+   OR (method = 'key' AND match_key(bon_name) IN (SELECT name_key FROM new_rows))
+"""
+
+def lookup_resolution(conn, bon_name, nan):
+    """(ean, method) aus dem Cache oder None."""
+    row = conn.execute(LOOKUP_SQL, (bon_name, nan)).fetchone()
+    return (row[0], row[1]) if row else None
+
+def store_resolution(conn, bon_name, nan, ean, method, score=None, commit=True):
+    conn.execute(STORE_SQL, (bon_name, nan, str(ean), method, score))
+    if commit:
+        conn.commit()
+
+class ResolutionStats:
+    """Treffer/Fehlschläge des Caches und neu aufgelöste Artikel je Methode."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.methods = Counter()
+
+    def hit(self):
+        self.hits += 1
+
+    def miss(self, method):
+        self.misses += 1
+        self.methods[method or "keine"] += 1
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        if not total:
+            return
+        methods = ", ".join(f"{m} {n}" for m, n in self.methods.most_common())
+        log.info(f"Namensauflösung: {self.hits} Cache-Treffer, {self.misses} neu aufgelöst "
+                 f"({self.hits / total:.0%} Trefferquote){'; neu: ' + methods if methods else ''}")
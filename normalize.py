@@ -0,0 +1,119 @@
+import re
+import unicodedata
+
+def normalize_string(s):
+    s = unicodedata.normalize('NFKD', s)
+    s = s.replace("’", "'").replace("‘", "'")
+    s = s.lower().strip()
+    return s
+
+# Mengen-/Gewichtsangaben am Ende des Produktnamens (für den Namen in Grocy)
+QUANTITY_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"\s*\d+[.,]?\d*\s*([xX]\s*\d+)?\s*(Stück|Stk\.?|kg|g|l|ml|cl|dl|mg|µg|Packung|Becher|Dose|Flasche|Tüte|Bund|Pck|Pckg|Paket)\.?$",
+    r"\s*ca\.\s*\d+[.,]?\d*\s*(g|kg|l|ml|Stück)\.?$",
+    r"\s*\d+[.,]?\d*\s*(g|kg|l|ml|Stück)\.?$",
+    r"\s*\d+\s*x\s*\d+\s*(g|ml|Stück)\.?$",
+    r"\s*\d+[.,]?\d*\s*(%|vol|Vol)\.?$",
+)]
+
+def remove_quantity_from_name(name):
+    """
+    Entfernt typische Mengen-/Gewichtsangaben am Ende des Produktnamens.
+    Beispiele: "191g", "1kg", "1 Stück", "ca. 200g", "0,25l", "8x100g", "1Stück", "1,5kg"
+    """
+    new_name = name
+    for pattern in QUANTITY_PATTERNS:
+        new_name = pattern.sub('', new_name)
+    return new_name.strip()
+
+# Matching-Schlüssel für Katalog und Bon (Spalte products.name_key).
+#
+# Bon-Namen sind großgeschrieben, ohne Umlaute, oft ohne Menge und mit
+# Kürzeln ("RW BIO H-MILCH 1,5%"), Katalognamen dagegen ausgeschrieben
+# ("REWE Bio H-Milch 1,5% 1l"). match_key bringt beide auf dieselbe Form:
+# Umlaute/Diakritika falten, Mengen am Ende entfernen, Satzzeichen zu
+# Leerzeichen, Marken-Präfix und Bon-Kürzel vereinheitlichen.
+#
+# Wer die Schritte oder Wörterbücher ändert, muss name_key per Migration
+# neu berechnen (catalog_db.migrate_v7 als Vorlage).
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+# Mengen am Ende: "500g", "0,33l", "6x1l", "3x170ml", "100 stueck", "ca. 200g", "50g, 20 beutel"
+KEY_QUANTITY_RE = re.compile(
+    r"[\s,]+(?:ca\.?\s*)?\d+(?:[.,]\d+)?\s*(?:x\s*\d+(?:[.,]\d+)?\s*)?"
+    r"(?:stueck|stk|st|kg|g|l|ml|cl|dl|mg|beutel|rollen|blatt|tabs|pack|packung|pck|becher|dose|flasche|tuete|bund|paket)"
+    r"\.?\s*$"
+)
+DECIMAL_POINT_RE = re.compile(r"(?<=\d)\.(?=\d)")
+PERCENT_RE = re.compile(r"\s+%")
+# Alles außer Buchstaben, Ziffern, % und Dezimalkomma wird zu Leerzeichen
+SEPARATOR_RE = re.compile(r"(?:(?!(?<=\d),(?=\d))[^\w%])+")
+
+# Marken-Präfixe: Schreibweisen auf dem Bon -> Schreibweise im Katalog
+BRAND_PREFIXES = {
+    "rewe beste wahl": ("rewe beste wahl", "rewe bw", "rw beste wahl", "rw bw", "beste wahl"),
+    "rewe bio": ("rewe bio", "rw bio", "rewebio", "r bio"),
+    "rewe feine welt": ("rewe feine welt", "rw feine welt", "rewe fw", "rw fw", "feine welt"),
+    "rewe frei von": ("rewe frei von", "rw frei von"),
+    "rewe": ("rewe", "rw"),
+    "ja": ("ja",),
+}
+BRAND_PREFIX_RE = re.compile(
+    r"^(" + "|".join(sorted((re.escape(a) for aliases in BRAND_PREFIXES.values() for a in aliases),
+                            key=len, reverse=True)) + r")(?: |$)"
+)
+BRAND_BY_ALIAS = {alias: brand for brand, aliases in BRAND_PREFIXES.items() for alias in aliases}
+
+# Typische Kürzel auf REWE-Bons (nach dem Falten, ohne Punkt)
+BON_ABBREVIATIONS = {
+    "vollm": "vollmilch",
+    "fettarme": "fettarm",
+    "jogh": "joghurt",
+    "joghu": "joghurt",
+    "schoko": "schokolade",
+    "scho": "schokolade",
+    "erdb": "erdbeere",
+    "erdbeer": "erdbeere",
+    "zitr": "zitrone",
+    "orig": "original",
+    "klass": "klassik",
+    "nat": "natur",
+    "gem": "gemischt",
+    "geschn": "geschnitten",
+    "gerieb": "gerieben",
+    "tk": "tiefkuehl",
+    "mozz": "mozzarella",
+    "kaes": "kaese",
+    "schinkenw": "schinkenwurst",
+    "wuerstch": "wuerstchen",
+    "bananen": "banane",
+    "paprik": "paprika",
+    "gurk": "gurke",
+    "tomat": "tomaten",
+    "kart": "kartoffeln",
+    "mineralw": "mineralwasser",
+    "apfels": "apfelsaft",
+    "orangens": "orangensaft",
+}
+
+def split_brand(key):
+    """Trennt ein bekanntes Marken-Präfix ab: (Marke im Katalog-Schreibweise oder "", Rest)."""
+    m = BRAND_PREFIX_RE.match(key)
+    if not m:
+        return "", key
+    return BRAND_BY_ALIAS[m.group(1)], key[m.end():]
+
+def match_key(s):
+    """Gemeinsamer Matching-Schlüssel für Katalog- und Bon-Namen."""
+    s = unicodedata.normalize("NFC", normalize_string(s)).translate(UMLAUTS)
+    s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+    s = PERCENT_RE.sub("%", DECIMAL_POINT_RE.sub(",", s))
+    previous = None
+    while previous != s:
+        previous = s
+        s = KEY_QUANTITY_RE.sub("", s)
+    s = SEPARATOR_RE.sub(" ", s).strip()
+    brand, rest = split_brand(s)
+    words = [BON_ABBREVIATIONS.get(word, word) for word in rest.split()]
+    return " ".join(([brand] if brand else []) + words)
@@ -0,0 +1,112 @@
+import argparse
+import csv
+import gzip
+import json
+import sys
+import time
+from colorTerminal import OK, WARN
+from logger import log
+
+# Lokaler Open-Food-Facts-Cache in der Katalog-DB.
+#
+# Live-Abfragen werden mit Zeitstempel gespeichert, auch "nicht gefunden"
+# (found = 0), und gelten OFF_CACHE_TTL bzw. OFF_NEGATIVE_TTL Sekunden.
+# Zeilen aus einem importierten OFF-Dump (source = 'dump') laufen nicht ab,
+# sie werden erst vom nächsten Dump-Import ersetzt.
+
+CREATE_OFF_PRODUCTS_SQL = """
+CREATE TABLE IF NOT EXISTS off_products (
+    ean TEXT PRIMARY KEY,
+    found INTEGER NOT NULL,
+    product_name TEXT,
+    brands TEXT,
+    source TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+STORE_SQL = """
+INSERT OR REPLACE INTO off_products (ean, found, product_name, brands, source, fetched_at)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+def lookup_off_product(conn, ean, ttl, negative_ttl, now=None):
+    """(Treffer, Produkt-Dict oder None). Treffer=False heißt: nicht (mehr) im Cache."""
+    row = conn.execute(
+        "SELECT found, product_name, brands, source, fetched_at FROM off_products WHERE ean = ?",
+        (str(ean).strip(),)
+    ).fetchone()
+    if row is None:
+        return False, None
+    found, product_name, brands, source, fetched_at = row
+    age = (now or time.time()) - fetched_at
+    if source != "dump" and age > (ttl if found else negative_ttl):
+        return False, None
+    if not found:
+        return True, None
+    return True, {"product_name": product_name, "brands": brands}
+
+def store_off_product(conn, ean, product, source="api"):
+    product = product or {}
+    conn.execute(STORE_SQL, (
+        str(ean).strip(), int(bool(product)), off_product_name(product) or None,
+        product.get("brands") or None, source, time.time(),
+    ))
+    conn.commit()
+
+def off_product_name(product):
+    return product.get("product_name_de") or product.get("product_name") or ""
+
+def open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+def dump_records(f, path):
+    # OFF-Dumps: JSONL (ein Produkt je Zeile, countries_tags als Liste)
+    # oder CSV (Tab-getrennt, countries_tags kommagetrennt)
+    if ".jsonl" in path or ".json" in path:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+        return
+    csv.field_size_limit(sys.maxsize)
+    for row in csv.DictReader(f, delimiter="\t"):
+        row["countries_tags"] = (row.get("countries_tags") or "").split(",")
+        yield row
+
+def dump_rows(records, country, now):
+    tag = f"en:{country}"
+    for product in records:
+        ean = str(product.get("code") or "").strip()
+        if not ean or tag not in (product.get("countries_tags") or []):
+            continue
+        name = off_product_name(product)
+        if not name:
+            continue
+        yield ean, 1, name, product.get("brands") or None, "dump", now
+
+def import_off_dump(conn, path, country="germany"):
+    """Importiert einen OFF-Dump (JSONL/CSV, optional .gz), gefiltert auf ein Land."""
+    start = time.perf_counter()
+    before = conn.total_changes
+    with open_dump(path) as f, conn:
+        conn.executemany(STORE_SQL, dump_rows(dump_records(f, path), country, time.time()))
+    imported = conn.total_changes - before
+    elapsed = time.perf_counter() - start
+    log.info(f"{OK} {imported} Produkte ({country}) aus {path} in {elapsed:.1f}s übernommen.")
+    return imported
+
+if __name__ == "__main__":
+    from catalog_db import DB_FILE, connect
+    parser = argparse.ArgumentParser(description="Open-Food-Facts-Dump in den lokalen Cache importieren")
+    parser.add_argument("dump", help="OFF-Dump als .jsonl, .csv (Tab-getrennt), jeweils optional .gz")
+    parser.add_argument("--country", default="germany", help="Nur Produkte mit countries_tags en:<country>")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    conn = connect(args.db)
+    try:
+        if not import_off_dump(conn, args.dump, args.country):
+            log.warning(f"{WARN} Keine passenden Produkte im Dump gefunden.")
+    finally:
+        conn.close()
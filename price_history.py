@@ -0,0 +1,147 @@
+from datetime import date
+
+# Append-only Preishistorie: pro EAN nur die Tage, an denen sich der Preis
+# geändert hat. Der Preis an einem Tag ist der letzte Eintrag <= diesem Tag.
+# Tage werden als Ordinalzahl (date.toordinal()) gespeichert, Preise in Cent,
+# beides als kleine Integer im Clustered Key der WITHOUT-ROWID-Tabelle.
+
+# julianday('0001-01-01') = 1721425.5, date(1, 1, 1).toordinal() = 1
+SQL_DAY = "CAST(julianday({}) - 1721424.5 AS INTEGER)"
+
+CREATE_EANS_SQL = """
+CREATE TABLE IF NOT EXISTS eans (
+    id INTEGER PRIMARY KEY,
+    ean TEXT NOT NULL UNIQUE
+)
+"""
+
+CREATE_PRICE_HISTORY_SQL = """
+CREATE TABLE IF NOT EXISTS price_history (
+    ean_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    price_cents INTEGER NOT NULL,
+    PRIMARY KEY (ean_id, day)
+) WITHOUT ROWID
+"""
+
+# Erwartet die Staging-Tabelle des Imports (ean_norm, price) und :day
+INSERT_EANS_SQL = """
+INSERT OR IGNORE INTO eans (ean) SELECT ean_norm FROM staging WHERE price > 0
+"""
+
+DELETE_SAME_DAY_SQL = """
+DELETE FROM price_history
+WHERE day = :day AND ean_id IN (
+    SELECT e.id FROM staging AS s JOIN eans AS e ON e.ean = s.ean_norm
+)
+"""
+
+INSERT_CHANGES_SQL = """
+INSERT INTO price_history (ean_id, day, price_cents)
+SELECT e.id, :day, CAST(round(s.price * 100) AS INTEGER)
+FROM staging AS s
+JOIN eans AS e ON e.ean = s.ean_norm
+WHERE s.price > 0
+  AND CAST(round(s.price * 100) AS INTEGER) IS NOT (
+      SELECT h.price_cents FROM price_history AS h
+      WHERE h.ean_id = e.id AND h.day < :day
+      ORDER BY h.day DESC LIMIT 1
+  )
+"""
+
+# Preise je Bundesland (rewe_products_import mit mehreren CATALOG_REGIONS):
+# die Produktzeile gibt es nur einmal, hier steht je EAN und Region nur der
+# jüngste Preis als (ean_id, region_id, day, price_cents). Ab Schema-Version
+# 18 hält since den Tag, seit dem dieser Preis gilt (catalog_delta).
+CREATE_REGIONS_SQL = """
+CREATE TABLE IF NOT EXISTS regions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+)
+"""
+
+CREATE_REGION_PRICES_SQL = """
+CREATE TABLE IF NOT EXISTS region_prices (
+    ean_id INTEGER NOT NULL,
+    region_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    price_cents INTEGER NOT NULL,
+    PRIMARY KEY (ean_id, region_id)
+) WITHOUT ROWID
+"""
+
+UPSERT_REGION_PRICES_SQL = """
+INSERT INTO region_prices (ean_id, region_id, day, price_cents, since)
+SELECT e.id, :region_id, :day, CAST(round(s.price * 100) AS INTEGER), :day
+FROM staging AS s
+JOIN eans AS e ON e.ean = s.ean_norm
+WHERE s.price > 0
+ON CONFLICT (ean_id, region_id) DO UPDATE SET day = excluded.day, price_cents = excluded.price_cents,
+    since = CASE WHEN excluded.price_cents = region_prices.price_cents THEN region_prices.since ELSE excluded.day END
+WHERE excluded.day >= region_prices.day
+"""
+
+def to_day(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal()
+
+def from_day(day):
+    return date.fromordinal(day).isoformat()
+
+def record_prices(conn, date_str):
+    """Schreibt Preisänderungen aus der Staging-Tabelle; liefert die Anzahl neuer Einträge."""
+    params = {"day": to_day(date_str)}
+    conn.execute(INSERT_EANS_SQL)
+    conn.execute(DELETE_SAME_DAY_SQL, params)
+    return conn.execute(INSERT_CHANGES_SQL, params).rowcount
+
+def region_id(conn, name):
+    conn.execute("INSERT OR IGNORE INTO regions (name) VALUES (?)", (name,))
+    return conn.execute("SELECT id FROM regions WHERE name = ?", (name,)).fetchone()[0]
+
+def record_region_prices(conn, date_str, region, with_history=True):
+    """Wie record_prices, plus jüngster Preis je Region; ohne with_history nur die Region.
+
+    Nur die erste Region schreibt die Preishistorie, sonst würden die Preise
+    verschiedener Bundesländer am selben Tag einander überschreiben.
+    """
+    if with_history:
+        changed = record_prices(conn, date_str)
+    else:
+        conn.execute(INSERT_EANS_SQL)
+        changed = 0
+    conn.execute(UPSERT_REGION_PRICES_SQL, {"region_id": region_id(conn, region), "day": to_day(date_str)})
+    return changed
+
+def region_price(conn, ean, region):
+    """Jüngster Katalogpreis (in Euro) einer EAN in einem Bundesland, oder None."""
+    row = conn.execute(
+        """SELECT rp.price_cents FROM region_prices AS rp
+        JOIN eans AS e ON e.id = rp.ean_id
+        JOIN regions AS r ON r.id = rp.region_id
+        WHERE e.ean = ? AND r.name = ?""",
+        (str(ean).strip(), region)
+    ).fetchone()
+    return row[0] / 100 if row else None
+
+def price_at(conn, ean, purchased_date):
+    """Katalogpreis (in Euro) einer EAN am Kaufdatum, oder None."""
+    row = conn.execute(
+        """SELECT h.price_cents FROM price_history AS h
+        JOIN eans AS e ON e.id = h.ean_id
+        WHERE e.ean = ? AND h.day <= ?
+        ORDER BY h.day DESC LIMIT 1""",
+        (str(ean).strip(), to_day(purchased_date))
+    ).fetchone()
+    return row[0] / 100 if row else None
+
+def price_series(conn, ean):
+    """Alle Preisänderungen einer EAN als Liste von (Datum, Preis in Euro)."""
+    cur = conn.execute(
+        """SELECT h.day, h.price_cents FROM price_history AS h
+        JOIN eans AS e ON e.id = h.ean_id
+        WHERE e.ean = ? ORDER BY h.day""",
+        (str(ean).strip(),)
+    )
+    return [(from_day(day), cents / 100) for day, cents in cur]
@@ -0,0 +1,192 @@
+import json
+import signal
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from colorTerminal import OK, WARN, ERROR
+from config import (SERVE_POLL_INTERVAL, SERVE_BACKOFF_BASE, SERVE_BACKOFF_MAX, SERVE_GROCY_CACHE_MAX_AGE,
+                    CATALOG_REFRESH_INTERVAL_DAYS)
+from logger import log, flush as flush_log
+from metrics import metrics, export_metrics, to_exposition
+from receipt_ledger import synced_receipt_counts
+from grocy_journal import open_line_counts
+from rewe_products_import import refresh_catalog
+import grocy_connector
+
+# Dienst-Modus (main.py --serve): ein Prozess, der die eBon-Liste regelmäßig
+# abfragt und neue eBons sofort überträgt. Katalog-Index, Grocy-Cache,
+# SQLite-Verbindung und HTTP-Pools bleiben zwischen den Durchläufen warm.
+#
+# Lokaler Endpoint:
+#   GET  /status   Zustand als JSON
+#   POST /sync     nächsten Durchlauf sofort starten
+#   GET  /metrics  Zähler und Zeiten im Prometheus-Textformat
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds") if timestamp else None
+
+class ReceiptDaemon:
+    """Fragt die eBon-Liste alle `interval` Sekunden ab, nach Fehlern mit wachsender Wartezeit.
+
+    `sync` überträgt alle neuen eBons und liefert True, wenn nichts offen
+    geblieben ist, False bei offenen Zeilen und None, wenn REWE bzw. Grocy
+    nicht erreichbar war (z.B. main.sync_all). Fehlgeschlagene eBons bleiben
+    im Ledger offen und werden im nächsten Durchlauf erneut versucht; bereits
+    gebuchte Zeilen überspringt das Journal.
+
+    Nur None und Ausnahmen verlängern die Wartezeit. Einzelne Zeilen, die
+    immer wieder scheitern (z.B. unklare Buchungen), sollen neue eBons nicht
+    verzögern; sie stehen mit ihrer Anzahl in /status.
+
+    `details` liefert optional weitere Angaben für /status, z.B.
+    TenantScheduler.status im Mehrmandanten-Betrieb.
+    """
+
+    def __init__(self, sync, interval=SERVE_POLL_INTERVAL, backoff_base=SERVE_BACKOFF_BASE,
+                 backoff_max=SERVE_BACKOFF_MAX, grocy_cache_max_age=SERVE_GROCY_CACHE_MAX_AGE,
+                 refresh_interval_days=CATALOG_REFRESH_INTERVAL_DAYS, details=None):
+        self.sync = sync
+        self.details = details
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.grocy_cache_max_age = grocy_cache_max_age
+        self.refresh_interval_days = refresh_interval_days
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._state = {
+            "state": "starting",
+            "started_at": time.time(),
+            "cycles": 0,
+            "failures": 0,
+            "last_sync_at": None,
+            "last_success_at": None,
+            "last_complete_at": None,
+            "last_error": None,
+            "next_sync_at": None,
+        }
+
+    def trigger(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def status(self):
+        with self._lock:
+            state = dict(self._state)
+        with grocy_connector.db_lock:
+            state["synced_receipts"] = sum(synced_receipt_counts(grocy_connector.get_db()).values())
+            open_lines = open_line_counts(grocy_connector.get_db()).values()
+        state["open_lines"] = sum(count for count, _uncertain in open_lines)
+        state["uncertain_lines"] = sum(uncertain for _count, uncertain in open_lines)
+        for key in ("started_at", "last_sync_at", "last_success_at", "last_complete_at", "next_sync_at"):
+            state[key] = _iso(state[key])
+        state["uptime"] = round(time.time() - self._state["started_at"], 1)
+        if self.details:
+            state["tenants"] = self.details()
+        return state
+
+    def next_delay(self, failures):
+        if not failures:
+            return self.interval
+        return min(self.backoff_base * 2 ** (failures - 1), self.backoff_max)
+
+    def cycle(self):
+        """Ein Durchlauf: Katalog ggf. aktualisieren, neue eBons übertragen.
+
+        Liefert False nur bei Transport- bzw. Ausnahmefehlern, offene Zeilen zählen als Erfolg."""
+        self._update(state="syncing", last_sync_at=time.time())
+        try:
+            if refresh_catalog(interval_days=self.refresh_interval_days):
+                grocy_connector.reload_catalog()
+            if grocy_connector.expire_grocy_cache(self.grocy_cache_max_age):
+                log.debug("Grocy-Cache abgelaufen, wird beim nächsten Zugriff neu geladen.")
+            with metrics.timer("serve_cycle"):
+                result = self.sync()
+            grocy_connector.wait_for_image_uploads()
+            error = None if result is not None else "REWE oder Grocy nicht erreichbar"
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+            log.error(f"{ERROR} Durchlauf fehlgeschlagen: {error}")
+        ok = result is not None
+        with self._lock:
+            self._state["cycles"] += 1
+            self._state["failures"] = 0 if ok else self._state["failures"] + 1
+            self._state["last_error"] = error
+            if ok:
+                self._state["last_success_at"] = time.time()
+            if result:
+                self._state["last_complete_at"] = time.time()
+        metrics.count("serve_cycles_failed" if not ok else "serve_cycles_ok" if result else "serve_cycles_open")
+        export_metrics()
+        return ok
+
+    def run(self, host=None, port=0):
+        """Läuft bis SIGINT/SIGTERM; mit `port` zusätzlich der lokale Endpoint."""
+        server = None
+        if port:
+            server = ThreadingHTTPServer((host, port), _handler_for(self))
+            threading.Thread(target=server.serve_forever, name="serve-endpoint", daemon=True).start()
+            log.info(f"{OK} Endpoint: http://{host}:{server.server_address[1]}/status")
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda _signum, _frame: self.stop())
+        log.info(f"{OK} Dienst gestartet, eBon-Liste alle {self.interval} s.")
+        try:
+            while not self._stop.is_set():
+                self._wake.clear()
+                self.cycle()
+                delay = self.next_delay(self._state["failures"])
+                if self._state["failures"]:
+                    log.warning(f"{WARN} Nächster Versuch in {delay} s.")
+                self._update(state="idle", next_sync_at=time.time() + delay)
+                flush_log()
+                self._wake.wait(delay)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._update(state="stopped", next_sync_at=None)
+            if server:
+                server.shutdown()
+                server.server_close()
+            grocy_connector.wait_for_image_uploads()
+            grocy_connector.close_db()
+            export_metrics()
+            log.info("Dienst beendet.")
+            flush_log()
+
+def _handler_for(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/status":
+                self._send(200, json.dumps(daemon.status(), ensure_ascii=False).encode("utf-8"), "application/json")
+            elif self.path == "/metrics":
+                self._send(200, to_exposition(metrics.summary()).encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self._send(404, b"not found\n", "text/plain")
+
+        def do_POST(self):
+            if self.path == "/sync":
+                daemon.trigger()
+                self._send(202, b'{"queued": true}', "application/json")
+            else:
+                self._send(404, b"not found\n", "text/plain")
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(f"Endpoint: {format % args}")
+
+    return Handler
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+# Bereits nach Grocy übertragene eBons, damit --sync-all nur neue Bons holt;
+# lines = NULL: beim ersten Lauf übersprungen (main.sync_all, --backfill)
+# Ab Schema-Version 11 je Haushalt: Schlüssel (tenant, receipt_id)
+CREATE_SYNCED_RECEIPTS_SQL = """
+CREATE TABLE IF NOT EXISTS synced_receipts (
+    receipt_id TEXT PRIMARY KEY,
+    purchased_date TEXT,
+    lines INTEGER,
+    synced_at TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+def synced_receipt_ids(conn, tenant="", skipped=True):
+    """eBon-IDs im Ledger; mit skipped=False ohne die beim ersten Lauf übersprungenen."""
+    sql = "SELECT receipt_id FROM synced_receipts WHERE tenant = ?"
+    if not skipped:
+        sql += " AND lines IS NOT NULL"
+    return {row[0] for row in conn.execute(sql, (tenant,))}
+
+def synced_receipt_counts(conn):
+    """{Haushalt: übertragene eBons}; der Standard-Haushalt heißt ""."""
+    return dict(conn.execute(
+        "SELECT tenant, COUNT(*) FROM synced_receipts WHERE lines IS NOT NULL GROUP BY tenant").fetchall())
+
+def record_skipped(conn, receipts, tenant=""):
+    """Trägt [(eBon-ID, Kaufdatum)] als übersprungen ein, ohne übertragene zu überschreiben."""
+    synced_at = datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        "INSERT OR IGNORE INTO synced_receipts (receipt_id, purchased_date, lines, synced_at, tenant) "
+        "VALUES (?, ?, NULL, ?, ?)",
+        [(receipt_id, purchased_date, synced_at, tenant) for receipt_id, purchased_date in receipts]
+    )
+    conn.commit()
+
+def record_synced(conn, receipt_id, purchased_date, lines, tenant=""):
+    conn.execute(
+        "INSERT OR REPLACE INTO synced_receipts (receipt_id, purchased_date, lines, synced_at, tenant) VALUES (?, ?, ?, ?, ?)",
+        (receipt_id, purchased_date, lines, datetime.now().isoformat(timespec="seconds"), tenant)
+    )
+    conn.commit()
@@ -1,96 +1,261 @@
 import os
-import sqlite3
+import io
 import csv
+import gzip
+import time
+import argparse
+import multiprocessing
 import requests
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from normalize import normalize_string, match_key
+from catalog_db import DB_FILE, TABLE_NAME, STAGING_TABLE_SQL, UPDATE_FROM_STAGING_SQL, INSERT_FROM_STAGING_SQL, connect
+from fuzzy_index import ensure_fuzzy_index
+from catalog_snapshot import export_snapshot, open_snapshot
+from catalog_delta import apply_deltas, export_deltas
+from price_history import record_region_prices
+from name_resolution import INVALIDATE_RESOLUTIONS_SQL
+from http_client import client
+from colorTerminal import OK
+from config import CATALOG_REFRESH_INTERVAL_DAYS, CATALOG_REGIONS, CATALOG_IMPORT_PROCESSES
+from config import CATALOG_BACKEND, CATALOG_SNAPSHOT_FILE, CATALOG_DELTA_DIR
+from logger import log, flush as flush_log, set_level as set_log_level
+from metrics import metrics, export_metrics
 
-DB_FILE = "rewe_products.db"
-TABLE_NAME = "products"
 BASE_URL = "https://rewe.nicoo.org/"
-BUNDESLAND = "schleswig-holstein"
+REGIONS = CATALOG_REGIONS
+BUNDESLAND = REGIONS[0]     # Erste Region: liefert Produktpreis und Preishistorie
 START_DATE = datetime(2025, 6, 15)
 END_DATE = datetime.today()
+MAX_WORKERS = 4             # Parallele Downloads
+REQUEST_TIMEOUT = 30        # Sekunden
+REFRESH_DAYS = 1            # Importierte Tage, die noch bedingt nachgeprüft werden
+MAX_DAYS_WITHOUT_FILE = 10
+RAW_ARCHIVE_DIR = "raw"     # Ziel für --keep-raw
+LOCK_TIMEOUT = 600          # Sekunden, die ein Import-Worker auf die Schreibsperre wartet
 
-CREATE_TABLE_SQL = f"""
-CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT,
-    brand TEXT,
-    ean TEXT,
-    price REAL,
-    grammage TEXT,
-    category TEXT,
-    sale TEXT,
-    image TEXT,
-    date TEXT
-);
-"""
+@metrics.timed("open_csv")
+def open_csv(date, etag=None, last_modified=None, region=BUNDESLAND):
+    """Öffnet die Tages-CSV als Stream; liefert (status, response, etag, last_modified).
 
-def download_csv(date):
+    status ist "ok", "not_modified" (304 auf bedingten Request) oder "missing".
+    Bei "ok" ist der Body noch nicht gelesen, er wird direkt beim Import gestreamt.
+    """
     date_str = date.strftime("%Y-%m-%d")
-    filename = f"{date_str}_{BUNDESLAND}.csv"
-    url = f"{BASE_URL}{filename}"
-    print(f"Versuche Download: {url}")
-    r = requests.get(url)
-    if r.status_code == 200 and r.content:
-        with open(filename, "wb") as f:
-            f.write(r.content)
-        print(f"Heruntergeladen: {filename}")
-        return filename
-    print(f"Keine Datei für {date_str} gefunden.")
-    return None
+    url = f"{BASE_URL}{date_str}_{region}.csv"
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    # Läuft in Worker-Threads: Ausgaben macht der Aufrufer in Datumsreihenfolge
+    try:
+        r = client.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True,
+                       endpoint="GET REWE-Katalog-CSV")
+    except requests.exceptions.RequestException:
+        return "missing", None, None, None
+    if r.status_code == 200:
+        return "ok", r, r.headers.get("ETag"), r.headers.get("Last-Modified")
+    r.close()
+    if r.status_code == 304:
+        return "not_modified", None, etag, last_modified
+    return "missing", None, None, None
 
-def import_csv_to_db(csv_file, conn, date_str):
-    with open(csv_file, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        rows_new = []
-        rows_update = []
-        for row in reader:
-            price_raw = row.get("price")
-            if price_raw is None or price_raw.strip().upper() == "NA" or price_raw.strip() == "":
-                price = 0
-            else:
-                try:
-                    price = float(price_raw.replace(",", "."))
-                except Exception:
-                    price = 0
-            ean = row.get("ean")
-            if ean:
-                cur = conn.execute(f"SELECT id FROM {TABLE_NAME} WHERE ean = ?", (ean,))
-                result = cur.fetchone()
-                if result:
-                    rows_update.append((price, date_str, ean))
-                else:
-                    rows_new.append((
-                        row.get("name"),
-                        row.get("brand"),
-                        ean,
-                        price,
-                        row.get("grammage"),
-                        row.get("category"),
-                        row.get("sale"),
-                        row.get("image"),
-                        date_str
-                    ))
-        if rows_new:
-            conn.executemany(
-                f"""INSERT INTO {TABLE_NAME}
-                (name, brand, ean, price, grammage, category, sale, image, date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                rows_new
-            )
-            print(f"{len(rows_new)} neue Zeilen aus {csv_file} importiert.")
-        if rows_update:
-            conn.executemany(
-                f"""UPDATE {TABLE_NAME} SET price = ?, date = ? WHERE ean = ?""",
-                rows_update
-            )
-            print(f"{len(rows_update)} Zeilen in {csv_file} aktualisiert.")
+class ChunkStream(io.RawIOBase):
+    """Macht aus den Chunks einer Response einen lesbaren Stream, optional mit Kopie in `sink`."""
+
+    def __init__(self, chunks, sink=None):
+        self._chunks = chunks
+        self._buffer = b""
+        self._sink = sink
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            if self._sink:
+                self._sink.write(chunk)
+            self.bytes_read += len(chunk)
+            self._buffer = chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+def import_response(conn, response, date_str, keep_raw=False, region=BUNDESLAND, primary=True):
+    """Streamt den HTTP-Body zeilenweise in die DB, ohne Zwischendatei."""
+    filename = f"{date_str}_{region}.csv"
+    sink = None
+    if keep_raw:
+        os.makedirs(RAW_ARCHIVE_DIR, exist_ok=True)
+        sink = gzip.open(os.path.join(RAW_ARCHIVE_DIR, filename + ".gz"), "wb")
+    try:
+        with response:
+            raw = ChunkStream(response.iter_content(chunk_size=64 * 1024), sink)
+            text = io.TextIOWrapper(io.BufferedReader(raw), encoding="utf-8", newline="")
+            total = import_rows(conn, csv.DictReader(text), date_str, filename, region, primary)
+    finally:
+        if sink:
+            sink.close()
+    if keep_raw:
+        log.info(f"Rohdatei archiviert: {os.path.join(RAW_ARCHIVE_DIR, filename + '.gz')}")
+    return total, raw.bytes_read
+
+def load_manifest(conn, region=BUNDESLAND):
+    cur = conn.execute(
+        "SELECT date, status, etag, last_modified FROM import_manifest WHERE region = ?", (region,)
+    )
+    return {date: (status, etag, last_modified) for date, status, etag, last_modified in cur}
+
+def record_manifest(conn, date_str, status, etag=None, last_modified=None, rows=None, region=BUNDESLAND):
+    conn.execute(
+        """INSERT OR REPLACE INTO import_manifest
+        (date, region, status, etag, last_modified, rows, checked_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (date_str, region, status, etag, last_modified, rows, datetime.now().isoformat(timespec="seconds"))
+    )
+    conn.commit()
+
+def prefetch(executor, fn, items, window, discard=None):
+    """Wie executor.map, aber mit höchstens `window` Aufträgen im Voraus.
+
+    Wird der Generator vorzeitig geschlossen, erhält `discard` die Ergebnisse
+    bereits gestarteter Aufträge (z.B. um offene Responses zu schließen).
+    """
+    futures = deque()
+    items = iter(items)
+    for item in items:
+        futures.append((item, executor.submit(fn, item)))
+        if len(futures) >= window:
+            break
+    try:
+        while futures:
+            item, future = futures.popleft()
+            for next_item in items:
+                futures.append((next_item, executor.submit(fn, next_item)))
+                break
+            yield item, future.result()
+    finally:
+        for _item, future in futures:
+            if not future.cancel() and discard:
+                discard(future.result())
+
+def pending_dates(conn, manifest, today, primary=True):
+    """Tage, die (erneut) abgefragt werden müssen, aufsteigend sortiert."""
+    if manifest:
+        date = datetime.strptime(min(manifest), "%Y-%m-%d")
+    elif not primary:
+        # Neu hinzugekommene Region: kompletter Zeitraum
+        date = START_DATE
+    else:
+        # Alte DB ohne Manifest: einmalig ab dem letzten importierten Tag weitermachen
+        latest_date = get_latest_date_from_db(conn)
+        date = latest_date + timedelta(days=1) if latest_date else START_DATE
+    result = []
+    while date <= today:
+        date_str = date.strftime("%Y-%m-%d")
+        entry = manifest.get(date_str)
+        age = (today - date).days
+        if entry is None:
+            result.append(date)
+        elif entry[0] == "imported" and age <= REFRESH_DAYS:
+            # Jüngste Tage per If-None-Match/If-Modified-Since nachprüfen
+            result.append(date)
+        elif entry[0] == "missing" and age < MAX_DAYS_WITHOUT_FILE:
+            # Fehlende Tage können noch nachgeliefert werden
+            result.append(date)
+        date += timedelta(days=1)
+    return result
+
+# Innerhalb einer Datei gewinnt die letzte Zeile je EAN
+DEDUP_STAGING_SQL = """
+DELETE FROM staging
+WHERE rowid NOT IN (SELECT MAX(rowid) FROM staging GROUP BY ean_norm)
+"""
+
+def parse_price(price_raw):
+    if price_raw is None or price_raw.strip().upper() == "NA" or price_raw.strip() == "":
+        return 0
+    try:
+        return float(price_raw.replace(",", "."))
+    except Exception:
+        return 0
+
+def staging_rows(reader):
+    for row in reader:
+        ean = row.get("ean")
+        if not ean:
+            continue
+        name = row.get("name")
+        yield (
+            name,
+            row.get("brand"),
+            ean,
+            parse_price(row.get("price")),
+            row.get("grammage"),
+            row.get("category"),
+            row.get("sale"),
+            row.get("image"),
+            normalize_string(name) if name is not None else None,
+            ean.strip(),
+            match_key(name) or None if name is not None else None,
+        )
+
+@metrics.timed("csv_import")
+def import_rows(conn, reader, date_str, source, region=BUNDESLAND, primary=True):
+    """Merged die Zeilen eines CSV-Readers in einer Transaktion in die Produkttabelle.
+
+    Das Einlesen in die Temp-Tabelle sperrt die Katalog-DB nicht; parallele
+    Import-Worker warten nur beim eigentlichen Merge aufeinander. Nur die
+    erste Region (`primary`) aktualisiert Produktpreis und Preishistorie.
+    """
+    start = time.perf_counter()
+    conn.execute(STAGING_TABLE_SQL)
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DELETE FROM staging")
+        conn.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", staging_rows(reader))
+        total = conn.execute("SELECT COUNT(*) FROM staging").fetchone()[0]
+        conn.execute(DEDUP_STAGING_SQL)
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        updated = conn.execute(UPDATE_FROM_STAGING_SQL, {"date": date_str}).rowcount if primary else 0
+        conn.execute(INVALIDATE_RESOLUTIONS_SQL)
+        inserted = conn.execute(INSERT_FROM_STAGING_SQL, {"date": date_str}).rowcount
+        changed = record_region_prices(conn, date_str, region, with_history=primary)
+        conn.execute("DELETE FROM staging")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    elapsed = time.perf_counter() - start
+    metrics.count("csv_rows", total)
+    metrics.count("csv_rows_inserted", inserted)
+    if inserted:
+        log.info(f"{inserted} neue Zeilen aus {source} importiert.")
+    if updated:
+        log.info(f"{updated} Zeilen in {source} aktualisiert.")
+    if changed:
+        log.info(f"{changed} Preisänderungen aus {source} in der Preishistorie.")
+    rate = total / elapsed if elapsed > 0 else 0
+    log.info(f"{total} Zeilen aus {source} in {elapsed:.2f}s verarbeitet ({rate:.0f} Zeilen/s).")
+    return total
+
+def import_csv_to_db(csv_file, conn, date_str, region=BUNDESLAND, primary=True):
+    with open(csv_file, encoding="utf-8", newline="") as f:
+        total = import_rows(conn, csv.DictReader(f), date_str, csv_file, region, primary)
     try:
         os.remove(csv_file)
-        print(f"{csv_file} gelöscht.")
+        log.info(f"{csv_file} gelöscht.")
     except Exception as e:
-        print(f"Fehler beim Löschen von {csv_file}: {e}")
+        log.warning(f"Fehler beim Löschen von {csv_file}: {e}")
+    return total
 
 def get_latest_date_from_db(conn):
     cur = conn.execute(f"SELECT MAX(date) FROM {TABLE_NAME}")
@@ -102,43 +267,193 @@ def get_latest_date_from_db(conn):
             pass
     return None
 
-def main():
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute(CREATE_TABLE_SQL)
-    conn.commit()
-
-    latest_date = get_latest_date_from_db(conn)
-    if latest_date:
-        date = latest_date + timedelta(days=1)
-    else:
-        date = datetime(2025, 6, 15)  # Fallback-Startdatum
+def region_dates(conn, region=BUNDESLAND, primary=True):
+    """Offene Tage einer Region als (Manifest, Tage)."""
+    today = datetime.combine(datetime.today().date(), datetime.min.time())
+    manifest = load_manifest(conn, region)
+    return manifest, pending_dates(conn, manifest, today, primary)
 
-    END_DATE = datetime.today()
+def import_region(conn, region=BUNDESLAND, keep_raw=False, primary=True, pending=None):
+    """Importiert alle offenen Tages-CSVs eines Bundeslands; liefert die Anzahl importierter Tage."""
+    manifest, dates = pending or region_dates(conn, region, primary)
     days_without_file = 0
-    max_days_without_file = 10
+    imported = 0
 
-    while date <= END_DATE:
+    def fetch(date):
         date_str = date.strftime("%Y-%m-%d")
-        filename = f"{date_str}_{BUNDESLAND}.csv"
-        if not os.path.exists(filename):
-            downloaded = download_csv(date)
-            if not downloaded:
+        filename = f"{date_str}_{region}.csv"
+        if os.path.exists(filename):
+            return "local", filename, None, None
+        _status, etag, last_modified = manifest.get(date_str, (None, None, None))
+        return open_csv(date, etag, last_modified, region)
+
+    def discard(result):
+        if result[0] == "ok":
+            result[1].close()
+
+    # Requests laufen parallel, importiert wird streng in Datumsreihenfolge,
+    # damit immer der Preis des jüngsten Tages stehen bleibt. Der Body wird
+    # erst beim Import gelesen, daher nur so viele offene Responses wie Verbindungen.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for date, (status, source, etag, last_modified) in prefetch(executor, fetch, dates, MAX_WORKERS, discard):
+            date_str = date.strftime("%Y-%m-%d")
+            if status == "missing":
+                log.info(f"Keine Datei für {date_str}_{region} gefunden.")
+                if manifest.get(date_str, ("missing",))[0] != "imported":
+                    record_manifest(conn, date_str, "missing", region=region)
                 days_without_file += 1
-                if days_without_file >= max_days_without_file:
-                    print(f"{max_days_without_file} Tage in Folge keine Datei gefunden, Abbruch.")
+                if days_without_file >= MAX_DAYS_WITHOUT_FILE:
+                    log.warning(f"{MAX_DAYS_WITHOUT_FILE} Tage in Folge keine Datei für {region} gefunden, Abbruch.")
                     break
-                date += timedelta(days=1)
                 continue
-        else:
-            print(f"{filename} bereits vorhanden, überspringe Download.")
+            days_without_file = 0  # Reset, wenn eine Datei gefunden wurde
+            if status == "not_modified":
+                log.info(f"{date_str}_{region}.csv unverändert (304), überspringe Import.")
+                continue
+            if status == "local":
+                log.info(f"{source} bereits vorhanden, überspringe Download.")
+                rows = import_csv_to_db(source, conn, date_str, region, primary)
+            else:
+                try:
+                    rows, size = import_response(conn, source, date_str, keep_raw, region, primary)
+                except requests.exceptions.RequestException as e:
+                    # Abbruch mitten im Body: Transaktion ist zurückgerollt, Tag bleibt offen
+                    log.warning(f"Fehler beim Streamen von {date_str}_{region}.csv: {e}")
+                    continue
+                log.info(f"Gestreamt: {date_str}_{region}.csv ({size / 1024:.0f} KiB)")
+            record_manifest(conn, date_str, "imported", etag, last_modified, rows, region)
+            imported += 1
+    return imported
 
-        import_csv_to_db(filename, conn, date_str)
-        conn.commit()
-        date += timedelta(days=1)
-        days_without_file = 0  # Reset, wenn eine Datei gefunden wurde
+def _init_worker(base_url, start_date, log_level):
+    # Mit "spawn" starten Worker mit den Modul-Standardwerten: Einstellungen des Elternprozesses übernehmen
+    global BASE_URL, START_DATE
+    BASE_URL, START_DATE = base_url, start_date
+    set_log_level(log_level)
+
+def _import_region_worker(region, keep_raw, primary, pending):
+    """Läuft in einem Worker-Prozess: eigene Verbindung, Metriken gehen an den Elternprozess zurück."""
+    metrics.reset()
+    client.reset_stats()
+    conn = connect(DB_FILE, timeout=LOCK_TIMEOUT)
+    try:
+        imported = import_region(conn, region, keep_raw, primary, pending)
+    finally:
+        conn.close()
+        flush_log()
+    return imported, metrics.summary()
+
+def import_processes(regions, processes=CATALOG_IMPORT_PROCESSES):
+    if processes <= 0:
+        processes = os.cpu_count() or 1
+    return max(1, min(processes, len(regions)))
 
+def main(keep_raw=False, regions=None, processes=CATALOG_IMPORT_PROCESSES, delta_dir=None):
+    """Importiert die Tages-CSVs aller Bundesländer in `regions` (Standard: REGIONS).
+
+    Mit mehreren Regionen läuft je Region ein Worker-Prozess: Download, CSV-
+    Parsing und Normalisierung parallel, nur der Merge in die DB nacheinander.
+    Produkte, die es in mehreren Regionen gibt, werden einmal gespeichert.
+    Vorhandene Tages-Deltas (CATALOG_DELTA_DIR) werden vorher eingespielt, mit
+    `delta_dir` danach neu geschrieben.
+    """
+    regions = regions or REGIONS
+    # Legt die Tabelle an und migriert ältere DBs (PRAGMA user_version)
+    conn = connect(DB_FILE, timeout=LOCK_TIMEOUT)
+    # Bulk-Import: WAL + synchronous=NORMAL. Die Staging-Tabelle bleibt im
+    # Temp-File, damit der Speicherbedarf nicht mit der CSV-Größe wächst.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    # Frische Installation: Tages-Deltas statt aller CSVs seit START_DATE
+    apply_deltas(conn, CATALOG_DELTA_DIR)
+
+    processes = import_processes(regions, processes)
+    if processes == 1:
+        for region in regions:
+            import_region(conn, region, keep_raw, primary=region == regions[0])
+    else:
+        log.info(f"Importiere {len(regions)} Bundesländer in {processes} Prozessen.")
+        flush_log()
+        # Offene Tage vorab bestimmen: eine alte DB ohne Manifest setzt am letzten
+        # Importtag fort, den die anderen Worker sonst schon verschoben hätten
+        pending = {region: region_dates(conn, region, region == regions[0]) for region in regions}
+        # "spawn": der Import läuft ggf. in einem Hintergrund-Thread mit offenen Verbindungen
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(BASE_URL, START_DATE, log.level)) as executor:
+            futures = {region: executor.submit(_import_region_worker, region, keep_raw, region == regions[0], pending[region])
+                       for region in regions}
+            for region, future in futures.items():
+                imported, summary = future.result()
+                metrics.merge(summary)
+                log.info(f"{OK} {region}: {imported} Tage importiert.")
+
+    # Fuzzy-Index einmal pro Import neu aufbauen (nur wenn sich etwas geändert hat)
+    if ensure_fuzzy_index(conn):
+        log.info("Fuzzy-Index neu aufgebaut.")
+    if CATALOG_BACKEND == "snapshot":
+        snapshot = open_snapshot(CATALOG_SNAPSHOT_FILE, conn)
+        if snapshot is None:
+            export_snapshot(conn, CATALOG_SNAPSHOT_FILE)
+            log.info(f"Katalog-Snapshot neu geschrieben: {CATALOG_SNAPSHOT_FILE}")
+        else:
+            snapshot.close()
+    if delta_dir:
+        written, unchanged, _bytes = export_deltas(conn, delta_dir)
+        log.info(f"{OK} Tages-Deltas in {delta_dir}/: {written} geschrieben, {unchanged} unverändert.")
     conn.close()
-    print("Import abgeschlossen.")
+    log.info("Import abgeschlossen.")
+
+REFRESH_STATE_KEY = "catalog_refreshed_at"
+
+def last_catalog_refresh(conn):
+    row = conn.execute("SELECT value FROM app_state WHERE key = ?", (REFRESH_STATE_KEY,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def record_catalog_refresh(conn, when=None):
+    conn.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)",
+                 (REFRESH_STATE_KEY, (when or datetime.now()).isoformat(timespec="seconds")))
+    conn.commit()
+
+def catalog_refresh_due(conn, interval_days, today=None):
+    last = last_catalog_refresh(conn)
+    if last is None or interval_days <= 0:
+        return True
+    return ((today or datetime.today().date()) - last.date()).days >= interval_days
+
+def refresh_catalog(force=False, keep_raw=False, interval_days=CATALOG_REFRESH_INTERVAL_DAYS,
+                    regions=None, processes=CATALOG_IMPORT_PROCESSES, delta_dir=None):
+    """Aktualisiert den Katalog höchstens alle `interval_days` Kalendertage.
+
+    Der Zeitpunkt steht in app_state, ein Neustart am selben Tag überspringt
+    damit die Abfragen der Tages-CSVs. Liefert True, wenn importiert wurde.
+    """
+    conn = connect(DB_FILE)
+    try:
+        if not force and not catalog_refresh_due(conn, interval_days):
+            log.info(f"{OK} Katalog am {last_catalog_refresh(conn):%d.%m.%Y %H:%M} aktualisiert, überspringe Prüfung.")
+            return False
+    finally:
+        conn.close()
+    with metrics.timer("catalog_refresh"):
+        main(keep_raw=keep_raw, regions=regions, processes=processes, delta_dir=delta_dir)
+    conn = connect(DB_FILE)
+    try:
+        record_catalog_refresh(conn)
+    finally:
+        conn.close()
+    return True
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="REWE-Produktkatalog aktualisieren")
+    parser.add_argument("--keep-raw", action="store_true",
+                        help=f"Rohdaten zusätzlich gzip-komprimiert in {RAW_ARCHIVE_DIR}/ ablegen")
+    parser.add_argument("--regions", nargs="+", metavar="BUNDESLAND",
+                        help="Bundesländer (Standard: config.CATALOG_REGIONS, das erste liefert die Preishistorie)")
+    parser.add_argument("--processes", type=int, default=CATALOG_IMPORT_PROCESSES,
+                        help="Worker-Prozesse (0 = eines je Bundesland, höchstens CPU-Kerne)")
+    parser.add_argument("--export-deltas", nargs="?", const=CATALOG_DELTA_DIR, metavar="DIR",
+                        help=f"Nach dem Import die Tages-Deltas schreiben (Standard: {CATALOG_DELTA_DIR}/)")
+    args = parser.parse_args()
+    refresh_catalog(force=True, keep_raw=args.keep_raw, regions=args.regions, processes=args.processes,
+                    delta_dir=args.export_deltas)
+    export_metrics()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from colorTerminal import OK, WARN, ERROR
+from config import TENANT_CONCURRENCY, SERVE_GROCY_CACHE_MAX_AGE
+from logger import log
+from metrics import metrics
+from receipt_ledger import synced_receipt_counts
+from grocy_journal import open_line_counts
+from tenants import use_tenant
+import grocy_connector
+
+# Mehrere Haushalte (tenants.py) in einem Prozess synchronisieren.
+#
+# Jeder Haushalt läuft in einem eigenen Thread mit eigenem Tenant-Kontext,
+# höchstens `concurrency` gleichzeitig. Katalog-DB, Fuzzy-Index bzw.
+# Snapshot, Namensauflösungs-Cache und Bild-Cache gibt es nur einmal; pro
+# Haushalt kommen nur Grocy-Cache und die Zeilen in Ledger/Journal dazu.
+# Die Requests aller Haushalte an denselben Host teilen sich Verbindungspool
+# und Limit (HTTP_HOST_CONCURRENCY in http_client).
+
+class TenantScheduler:
+    """Führt `sync(tenant)` für alle Haushalte aus; sync liefert True, wenn nichts offen geblieben ist,
+    False bei offenen Zeilen und None, wenn der Haushalt nicht erreichbar war (wie main.sync_all)."""
+
+    def __init__(self, tenants, sync, concurrency=TENANT_CONCURRENCY, grocy_cache_max_age=SERVE_GROCY_CACHE_MAX_AGE):
+        self.tenants = tenants
+        self.sync = sync
+        self.concurrency = concurrency
+        self.grocy_cache_max_age = grocy_cache_max_age
+        self._state = {tenant.name: {"ok": None, "complete": None, "last_sync_at": None, "seconds": None,
+                                     "error": None} for tenant in tenants}
+
+    def sync_tenant(self, tenant):
+        with use_tenant(tenant):
+            start = time.perf_counter()
+            try:
+                if self.grocy_cache_max_age:
+                    grocy_connector.expire_grocy_cache(self.grocy_cache_max_age)
+                result = self.sync(tenant)
+                error = None if result is not None else "Haushalt nicht erreichbar"
+            except Exception as e:
+                result, error = None, f"{type(e).__name__}: {e}"
+                log.error(f"{ERROR} Synchronisierung fehlgeschlagen: {error}")
+            seconds = time.perf_counter() - start
+        metrics.observe("tenant_sync", seconds)
+        metrics.count("tenant_sync_failed" if result is None else "tenant_sync_ok")
+        self._state[tenant.name] = {"ok": result is not None, "complete": bool(result), "last_sync_at": time.time(),
+                                    "seconds": round(seconds, 3), "error": error}
+        return result
+
+    def run_once(self):
+        """Ein Durchlauf über alle Haushalte: True, wenn bei allen alles übertragen wurde,
+        None, wenn mindestens einer nicht erreichbar war, sonst False (offene Zeilen)."""
+        workers = max(1, min(self.concurrency, len(self.tenants)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="haushalt") as executor:
+            results = list(executor.map(self.sync_tenant, self.tenants))
+        failed = [tenant.name for tenant, result in zip(self.tenants, results) if result is None]
+        incomplete = [tenant.name for tenant, result in zip(self.tenants, results) if result is False]
+        if failed:
+            log.warning(f"{WARN} {len(failed)} von {len(results)} Haushalten nicht synchronisiert: {', '.join(failed)}")
+        if incomplete:
+            log.warning(f"{WARN} Offene Zeilen bei {len(incomplete)} Haushalten: {', '.join(incomplete)}")
+        if not failed and not incomplete:
+            log.info(f"{OK} {len(results)} Haushalte synchronisiert.")
+        if failed:
+            return None
+        return not incomplete
+
+    def status(self):
+        """Zustand je Haushalt für den /status-Endpoint."""
+        with grocy_connector.db_lock:
+            counts = synced_receipt_counts(grocy_connector.get_db())
+            open_lines = open_line_counts(grocy_connector.get_db())
+        state = {}
+        for tenant in self.tenants:
+            entry = dict(self._state[tenant.name])
+            if entry["last_sync_at"]:
+                entry["last_sync_at"] = datetime.fromtimestamp(entry["last_sync_at"]).isoformat(timespec="seconds")
+            entry["synced_receipts"] = counts.get(tenant.name, 0)
+            entry["open_lines"], entry["uncertain_lines"] = open_lines.get(tenant.name, (0, 0))
+            state[tenant.name] = entry
+        return state
@@ -0,0 +1,122 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import config
+from logger import log
+from normalize import normalize_string
+
+# Mehrere Haushalte (REWE-Konto + Grocy-Instanz) in einem Prozess.
+#
+# Alles, was zu einem Haushalt gehört – RTSP-Token, Grocy-URL/API-Key,
+# Lagerorte, Grocy-Cache, Namens-Locks – hängt an einem Tenant-Objekt. Der
+# aktive Tenant steht in einer Kontextvariable: grocy_connector und main
+# fragen current_tenant() statt der Konstanten aus config.py. Ohne
+# use_tenant() gilt der Standard-Tenant aus config.py, der Einzelbetrieb
+# bleibt also unverändert.
+#
+# Gemeinsam genutzt werden Katalog-DB, Fuzzy-Index/Snapshot, Bild-Cache und
+# die HTTP-Sessions pro Host; Ledger und Journal sind nach Tenant getrennt.
+#
+# tenants.json (TENANTS_FILE) ist eine Liste von Objekten:
+#   [{"name": "mueller", "rtsp_token": "...", "grocy_api_url": "https://...",
+#     "grocy_api_key": "...", "location_id": 1, "location_id_kuehlschrank": 2}]
+# Optional: default_best_before_days, min_stock_amount.
+
+class Tenant:
+    def __init__(self, name, rtsp_token, grocy_api_url, grocy_api_key,
+                 location_id=None, location_id_kuehlschrank=None,
+                 default_best_before_days=None, min_stock_amount=None, grocy_cache_file=None):
+        self.name = name
+        self.rtsp_token = rtsp_token
+        self.grocy_api_url = grocy_api_url.rstrip("/")
+        self.grocy_api_key = grocy_api_key
+        self.location_id = config.GROCY_LOCATION_ID if location_id is None else location_id
+        self.location_id_kuehlschrank = (config.GROCY_LOCATION_ID_KUEHLSCHRANK if location_id_kuehlschrank is None
+                                         else location_id_kuehlschrank)
+        self.default_best_before_days = (config.GROCY_DEFAULT_BEST_BEFORE_DAYS if default_best_before_days is None
+                                         else default_best_before_days)
+        self.min_stock_amount = config.GROCY_MIN_STOCK_AMOUNT if min_stock_amount is None else min_stock_amount
+        if grocy_cache_file is None:
+            root, ext = os.path.splitext(config.GROCY_CACHE_FILE)
+            grocy_cache_file = f"{root}.{name}{ext}" if name else config.GROCY_CACHE_FILE
+        self.grocy_cache_file = grocy_cache_file
+
+        self.grocy_base_url = self.grocy_api_url + "/api"
+        self.grocy_header = {
+            "GROCY-API-KEY": grocy_api_key,
+            "accept": "application/json",
+            "Content-Type": "application/json",
+        }
+
+        # Produkte/Barcodes aus Grocy, beim ersten Zugriff einmal geladen (grocy_connector.get_grocy_cache)
+        self.grocy_cache = None
+        self.grocy_cache_lock = threading.Lock()
+        # Ein Lock pro Produktname, damit zwei Threads denselben Namen nicht doppelt anlegen
+        self._name_locks = {}
+        self._name_locks_lock = threading.Lock()
+
+    def lock_for_name(self, product_name):
+        with self._name_locks_lock:
+            return self._name_locks.setdefault(normalize_string(product_name), threading.Lock())
+
+    def __repr__(self):
+        return f"Tenant({self.name or 'Standard'!r}, {self.grocy_api_url!r})"
+
+_current = contextvars.ContextVar("tenant", default=None)
+_default = None
+_default_lock = threading.Lock()
+
+def default_tenant():
+    """Der Haushalt aus config.py; erst beim ersten Zugriff gebaut (Tests setzen config vorher um)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Tenant("", config.HARDCODED_RTSP_TOKEN, config.GROCY_API_URL, config.GROCY_API_KEY)
+        return _default
+
+def current_tenant():
+    return _current.get() or default_tenant()
+
+@contextmanager
+def use_tenant(tenant):
+    """Alles innerhalb des with-Blocks (im selben Thread) arbeitet für `tenant`."""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit mit dem aktiven Tenant: Worker-Threads erben die Kontextvariable sonst nicht."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def load_tenants(path=None):
+    """Liest die Haushalte aus `path` (Standard: config.TENANTS_FILE)."""
+    path = path or config.TENANTS_FILE
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    tenants = []
+    names = set()
+    for entry in entries:
+        name = str(entry.get("name") or "").strip()
+        if not name or name in names:
+            raise ValueError(f"{path}: jeder Haushalt braucht einen eindeutigen Namen ({entry.get('name')!r})")
+        missing = [key for key in ("rtsp_token", "grocy_api_url", "grocy_api_key") if not entry.get(key)]
+        if missing:
+            raise ValueError(f"{path}: Haushalt {name!r} ohne {', '.join(missing)}")
+        names.add(name)
+        tenants.append(Tenant(name, **{key: value for key, value in entry.items() if key != "name"}))
+    return tenants
+
+class _TenantPrefix(logging.Filter):
+    # Meldungen aus parallelen Haushalten unterscheidbar machen
+    def filter(self, record):
+        tenant = _current.get()
+        if tenant is not None and tenant.name:
+            record.msg = f"[{tenant.name}] {record.msg}"
+        return True
+
+log.addFilter(_TenantPrefix())
@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+
+# Die Module liegen flach im Repo-Wurzelverzeichnis
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def fixture_path(name):
+    return os.path.join(FIXTURES, name)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Relative Pfade (Katalog-DB, Caches, raw/) landen im Temp-Verzeichnis statt im Repo."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def grocy(workdir):
+    """FakeGrocy als Grocy des aktiven Haushalts; Katalog-DB leer im Temp-Verzeichnis."""
+    import grocy_connector
+    from fake_servers import FakeGrocy
+    from tenants import Tenant, use_tenant
+    fake = FakeGrocy().start()
+    try:
+        with use_tenant(Tenant("", "test-token", fake.url, "test-key")):
+            yield fake
+    finally:
+        grocy_connector.wait_for_image_uploads()
+        grocy_connector.close_db()
+        fake.stop()
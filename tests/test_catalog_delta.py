@@ -0,0 +1,107 @@
+import csv
+import gzip
+import json
+import pytest
+import rewe_products_import as importer
+from catalog_db import connect
+from catalog_delta import apply_delta, apply_deltas, export_deltas
+from conftest import fixture_path
+from catalog_snapshot import export_snapshot, open_snapshot
+from fuzzy_index import ensure_fuzzy_index, fuzzy_lookup
+from name_resolution import lookup_resolution, store_resolution
+
+# Tages-Deltas folgen den Regeln des CSV-Imports; Umbenennungen im Katalog
+# erneuern Fuzzy-Index, Snapshot und Namensauflösungen.
+
+BANANE = ["REWE Beste Wahl Banane ca. 200g", "REWE Beste Wahl", "22590541", 0.4, "1 Stück ca. 200 g", "Obst",
+          "False", "https://img.rewe-static.de/1028378/banane.png"]
+GURKE = ["REWE Bio Gurke 1 Stück", "REWE Bio", "7610632984741", 0.79, "1 Stück", "Gemüse", "False", None]
+
+def delta(day, *products, delisted=()):
+    return {"day": day, "products": [list(p) for p in products], "price_history": [], "region_prices": [],
+            "delisted": list(delisted)}
+
+@pytest.fixture
+def conn(workdir):
+    conn = connect("rewe_products.db")
+    apply_delta(conn, delta("2026-10-01", BANANE, GURKE))
+    yield conn
+    conn.close()
+
+def products(conn):
+    return [tuple(row) for row in conn.execute("SELECT name, sale, price, date FROM products ORDER BY id")]
+
+def test_delta_updates_only_price_and_date_of_existing_products(conn):
+    renamed = ["Banane Neu"] + BANANE[1:3] + [0.55, BANANE[4], BANANE[5], "True", BANANE[7]]
+    assert apply_delta(conn, delta("2026-10-03", renamed, delisted=[GURKE[2]])) == 1
+    # Ältere Stände ändern nichts mehr
+    assert apply_delta(conn, delta("2026-10-02", BANANE[:3] + [0.45] + BANANE[4:])) == 0
+    assert products(conn) == [("REWE Beste Wahl Banane ca. 200g", "False", 0.55, "2026-10-03"),
+                              ("REWE Bio Gurke 1 Stück", "False", 0.79, "2026-10-01")]
+
+def test_rename_rebuilds_fuzzy_index_and_snapshot(conn, workdir):
+    path = str(workdir / "catalog.snap")
+    export_snapshot(conn, path)
+    store_resolution(conn, "banane", "", "22590541", "fuzzy", 0.9)
+    store_resolution(conn, "gurke", "", "7610632984741", "name")
+    assert not ensure_fuzzy_index(conn)
+
+    conn.execute("UPDATE products SET name = 'Zzqx Wunderprodukt Neu', name_norm = 'zzqx wunderprodukt neu' "
+                 "WHERE ean_norm = '22590541'")
+    conn.commit()
+    snapshot = open_snapshot(path, conn)
+    assert snapshot is None
+    assert ensure_fuzzy_index(conn)
+    assert [ean for _score, _name, ean in fuzzy_lookup(conn, "zzqx wunderprodukt neu")] == ["22590541"]
+    assert fuzzy_lookup(conn, "rewe beste wahl banane ca. 200g") == []
+    # Auflösungen der umbenannten EAN und Fuzzy-Treffer sind verworfen, andere bleiben
+    assert lookup_resolution(conn, "banane", "") is None
+    assert lookup_resolution(conn, "gurke", "") == ("7610632984741", "name")
+
+def import_csv(conn, day, name):
+    with open(fixture_path(name), encoding="utf-8") as f:
+        importer.import_rows(conn, csv.DictReader(f), day, name)
+
+CATALOG_SQL = {
+    "products": "SELECT name, brand, ean, price, grammage, category, sale, image, date, first_date "
+                "FROM products ORDER BY ean_norm",
+    "price_history": "SELECT e.ean, h.day, h.price_cents FROM price_history AS h "
+                     "JOIN eans AS e ON e.id = h.ean_id ORDER BY e.ean, h.day",
+    "region_prices": "SELECT e.ean, r.name, p.price_cents FROM region_prices AS p "
+                     "JOIN eans AS e ON e.id = p.ean_id JOIN regions AS r ON r.id = p.region_id ORDER BY e.ean, r.name",
+}
+
+def catalog(conn):
+    return {table: conn.execute(sql).fetchall() for table, sql in CATALOG_SQL.items()}
+
+def payload(day):
+    with gzip.open(f"deltas/{day}.json.gz", "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def test_deltas_rebuild_the_imported_catalog(workdir):
+    source = connect("quelle.db")
+    # Tag 2: Trauben fehlen, Milch ist neu; Tag 3: Milch fehlt, Trauben wieder da
+    for day, name in (("2026-10-01", "katalog_tag1.csv"), ("2026-10-02", "katalog_tag2.csv"),
+                      ("2026-10-03", "katalog_tag3.csv")):
+        import_csv(source, day, name)
+    assert export_deltas(source, "deltas")[:2] == (3, 0)
+
+    # Jedes Produkt nur am ersten Tag, danach Preisänderungen und Auslistungen
+    assert [p[2] for p in payload("2026-10-01")["products"]] == ["22590541", "7610632984741", "4046434245910"]
+    assert [p[2] for p in payload("2026-10-02")["products"]] == ["4388840218328"]
+    assert payload("2026-10-03")["products"] == []
+    assert payload("2026-10-03")["delisted"] == ["4388840218328"]
+    assert payload("2026-10-03")["price_history"] == [["22590541", 55], ["7610632984741", 69], ["4046434245910", 199]]
+
+    target = connect("ziel.db")
+    assert apply_deltas(target, "deltas") == 3
+    assert catalog(target) == catalog(source)
+
+    # Ein weiterer Tag schreibt nur seine eigene Datei, sie enthält nur Änderungen
+    import_csv(source, "2026-10-04", "katalog_tag3.csv")
+    assert export_deltas(source, "deltas")[:2] == (1, 3)
+    assert all(not payload("2026-10-04")[key] for key in ("products", "price_history", "region_prices", "delisted"))
+    assert apply_deltas(target, "deltas") == 1
+    assert catalog(target) == catalog(source)
+    source.close()
+    target.close()
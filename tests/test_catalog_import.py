@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timedelta
+import pytest
+import rewe_products_import as importer
+from catalog_db import connect
+from conftest import fixture_path
+from fake_servers import FakeRewe
+
+# Tages-CSVs von einem lokalen FakeRewe: paralleler Abruf, bedingte Requests,
+# Neustart über das Manifest und nachgelieferte Tage.
+
+REGION = importer.BUNDESLAND
+TODAY = datetime.combine(datetime.today().date(), datetime.min.time())
+
+def day(offset):
+    return TODAY - timedelta(days=offset)
+
+def csv_name(date):
+    return f"{date:%Y-%m-%d}_{REGION}.csv"
+
+def fixture_csv(name):
+    with open(fixture_path(name), "rb") as f:
+        return f.read()
+
+def product(conn, ean):
+    return conn.execute("SELECT price, date FROM products WHERE ean_norm = ?", (ean,)).fetchone()
+
+@pytest.fixture
+def rewe(workdir, monkeypatch):
+    fake = FakeRewe().start()
+    monkeypatch.setattr(importer, "BASE_URL", fake.url + "/")
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def conn(workdir):
+    conn = connect("rewe_products.db")
+    yield conn
+    conn.close()
+
+def serve_days(rewe, monkeypatch, files):
+    """files: {Tage vor heute: Fixture-Datei}; der Import beginnt beim ältesten Tag."""
+    for offset, name in files.items():
+        rewe.csv_files[csv_name(day(offset))] = fixture_csv(name)
+    monkeypatch.setattr(importer, "START_DATE", day(max(files)))
+
+def test_days_are_fetched_concurrently(rewe, conn, monkeypatch):
+    days = 2 * importer.MAX_WORKERS
+    serve_days(rewe, monkeypatch, {offset: "katalog_tag1.csv" for offset in range(days)})
+    rewe.latency = 0.2
+    start = time.perf_counter()
+    assert importer.import_region(conn) == days
+    # Nacheinander wären es days * latency
+    assert time.perf_counter() - start < days * rewe.latency / 2
+    assert sum(rewe.calls.values()) == days
+
+def test_restart_skips_manifest_days_and_revalidates_recent_ones(rewe, conn, monkeypatch):
+    serve_days(rewe, monkeypatch, {5: "katalog_tag1.csv", 4: "katalog_tag1.csv", 3: "katalog_tag2.csv",
+                                   2: "katalog_tag2.csv", 1: "katalog_tag3.csv", 0: "katalog_tag3.csv"})
+    assert importer.import_region(conn) == 6
+    rewe.reset()
+
+    assert importer.import_region(conn) == 0
+    # Nur die jüngsten Tage werden nachgeprüft, jeweils mit If-None-Match -> 304
+    recent = importer.REFRESH_DAYS + 1
+    assert sum(rewe.calls.values()) == recent
+    assert rewe.not_modified == recent
+    manifest = importer.load_manifest(conn)
+    assert {status for status, _etag, _last_modified in manifest.values()} == {"imported"}
+    assert len(manifest) == 6
+
+def test_late_day_does_not_overwrite_newer_prices(rewe, conn, monkeypatch):
+    serve_days(rewe, monkeypatch, {2: "katalog_tag1.csv", 0: "katalog_tag3.csv"})
+    assert importer.import_region(conn) == 2
+    assert importer.load_manifest(conn)[f"{day(1):%Y-%m-%d}"][0] == "missing"
+    assert product(conn, "22590541") == (0.55, f"{day(0):%Y-%m-%d}")
+
+    # Tag 1 wird nachgeliefert, mit älterem Preis und einem neuen Produkt
+    rewe.csv_files[csv_name(day(1))] = fixture_csv("katalog_tag2.csv")
+    assert importer.import_region(conn) == 1
+    assert importer.load_manifest(conn)[f"{day(1):%Y-%m-%d}"][0] == "imported"
+    assert product(conn, "22590541") == (0.55, f"{day(0):%Y-%m-%d}")
+    assert product(conn, "7610632984741") == (0.69, f"{day(0):%Y-%m-%d}")
+    assert product(conn, "4388840218328") == (0.99, f"{day(1):%Y-%m-%d}")
@@ -0,0 +1,32 @@
+import pytest
+from catalog_db import connect
+from catalog_snapshot import SqliteCatalog, export_snapshot, open_snapshot
+
+# Exakte Namens-Lookups: bei gleichem Namen für mehrere EANs gewinnt wie vor
+# den Indizes die zuerst angelegte Zeile, nicht die kleinste EAN.
+
+@pytest.fixture
+def conn(workdir):
+    conn = connect("rewe_products.db")
+    conn.executemany(
+        "INSERT INTO products (name, ean, name_norm, ean_norm, name_key) VALUES (?, ?, ?, ?, ?)",
+        [("Milch 1,5%", "4000000000009", "milch 1,5%", "4000000000009", "milch"),
+         ("Milch 1,5%", "4000000000001", "milch 1,5%", "4000000000001", "milch")])
+    conn.commit()
+    yield conn
+    conn.close()
+
+def test_sqlite_lookup_returns_first_row(conn):
+    catalog = SqliteCatalog(conn)
+    assert catalog.ean_by_name("milch 1,5%") == "4000000000009"
+    assert catalog.ean_by_key("milch") == "4000000000009"
+
+def test_snapshot_lookup_returns_first_row(conn, workdir):
+    path = str(workdir / "catalog.snap")
+    export_snapshot(conn, path)
+    snapshot = open_snapshot(path, conn)
+    try:
+        assert snapshot.ean_by_name("milch 1,5%") == "4000000000009"
+        assert snapshot.ean_by_key("milch") == "4000000000009"
+    finally:
+        snapshot.close()
@@ -0,0 +1,217 @@
+import sqlite3
+import requests
+import urllib3
+import grocy_connector
+from bon_pipeline import process_articles, retry_journal
+from main import resolve_line
+from grocy_journal import uncertain_journal_entries
+from receipt_ledger import record_synced, synced_receipt_ids
+from catalog_db import migrate
+from fake_servers import FakeGrocy
+from tenants import Tenant, use_tenant
+
+# Journal je eBon-Zeile gegen ein FakeGrocy: Wiederholungen buchen nichts doppelt.
+
+PURCHASED = "2026-10-01"
+
+def bon_line(name, quantity=1, cents=199, nan=""):
+    return {"productName": name, "quantity": quantity, "unitPrice": cents, "nan": nan}
+
+def journal(receipt_id):
+    with grocy_connector.db_lock:
+        rows = grocy_connector.get_db().execute(
+            "SELECT line, ean, status, product_id FROM grocy_journal WHERE receipt_id = ? ORDER BY line",
+            (receipt_id,)).fetchall()
+    return [tuple(row) for row in rows]
+
+def stock_by_product(fake):
+    totals = {}
+    for entry in fake.stock:
+        totals[entry["product_id"]] = totals.get(entry["product_id"], 0) + entry["amount"]
+    return totals
+
+def test_lines_without_ean_keep_their_own_product(grocy):
+    bon = [bon_line("Xyzzy Quux Frobnitz"), bon_line("Plugh Wibble Wobble", quantity=2)]
+    assert process_articles(bon, PURCHASED, receipt_id="ohne-ean") == 2
+
+    assert [p["name"] for p in grocy.products] == ["Xyzzy Quux Frobnitz", "Plugh Wibble Wobble"]
+    assert grocy.barcodes == []
+    assert stock_by_product(grocy) == {1: 1, 2: 2}
+    # NULL statt "None": keine Zeile findet über journal_product_id das Produkt einer anderen
+    assert journal("ohne-ean") == [(0, None, "done", 1), (1, None, "done", 2)]
+
+    # Ein zweiter eBon mit einem bekannten und einem neuen Namen
+    bon = [bon_line("Plugh Wibble Wobble"), bon_line("Grault Garply Waldo")]
+    assert process_articles(bon, PURCHASED, receipt_id="ohne-ean-2") == 2
+    assert [p["name"] for p in grocy.products][2:] == ["Grault Garply Waldo"]
+    assert stock_by_product(grocy) == {1: 1, 2: 3, 3: 1}
+    assert grocy.barcodes == []
+
+def lose_stock_responses(monkeypatch, reach_grocy=True):
+    """Bestandsbuchungen ohne Antwort (Timeout); mit reach_grocy sind sie trotzdem in Grocy angekommen."""
+    update_stock = grocy_connector.update_stock
+
+    def timed_out(*args, **kwargs):
+        if reach_grocy:
+            update_stock(*args, **kwargs)
+        return None
+    monkeypatch.setattr(grocy_connector, "update_stock", timed_out)
+
+def break_stock_connection(monkeypatch, error, reach_grocy):
+    """Bestandsbuchungen enden mit `error`; mit reach_grocy hat Grocy sie vorher verbucht."""
+    post = grocy_connector.client.post
+
+    def broken(url, **kwargs):
+        if "/stock/products/" not in url:
+            return post(url, **kwargs)
+        if reach_grocy:
+            post(url, **kwargs)
+        raise error
+    monkeypatch.setattr(grocy_connector.client, "post", broken)
+
+def synced(receipt_id):
+    with grocy_connector.db_lock:
+        return receipt_id in synced_receipt_ids(grocy_connector.get_db())
+
+def test_unconfirmed_booking_is_not_resent(grocy, monkeypatch):
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011")]
+    with monkeypatch.context() as patch:
+        lose_stock_responses(patch)
+        assert process_articles(bon, PURCHASED, receipt_id="unklar") == 0
+    assert process_articles(bon, PURCHASED, receipt_id="unklar") == 0
+    assert len(grocy.stock) == 1
+
+def test_resolve_line_booked(grocy, monkeypatch):
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011"), bon_line("Plugh Wibble Wobble", nan="4000000000012")]
+    with monkeypatch.context() as patch:
+        lose_stock_responses(patch)
+        assert process_articles(bon[:1], PURCHASED, receipt_id="unklar") == 0
+    assert process_articles(bon, PURCHASED, receipt_id="unklar") == 1
+    assert not synced("unklar")
+
+    assert resolve_line("unklar", 0, "booked")
+    assert synced("unklar")
+    assert len(grocy.stock) == 2
+    # Nur unklare Zeilen lassen sich klären
+    assert not resolve_line("unklar", 0, "rebook")
+    assert not resolve_line("unklar", 5, "booked")
+
+def test_resolve_line_rebook(grocy, monkeypatch):
+    bon = [bon_line("Xyzzy Quux Frobnitz", quantity=2, nan="4000000000011")]
+    with monkeypatch.context() as patch:
+        lose_stock_responses(patch, reach_grocy=False)
+        assert process_articles(bon, PURCHASED, receipt_id="verloren") == 0
+    assert grocy.stock == []
+
+    assert resolve_line("verloren", 0, "rebook")
+    assert [(entry["product_id"], entry["amount"]) for entry in grocy.stock] == [(1, 2)]
+    assert synced("verloren")
+    assert journal("verloren") == [(0, "4000000000011", "done", 1)]
+
+def test_coalesced_unconfirmed_booking_is_not_rebooked_per_line(grocy, monkeypatch):
+    # Drei gleiche Zeilen, eine Buchung über 3; sie erreicht Grocy, die Antwort fehlt
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011") for _ in range(3)]
+    with monkeypatch.context() as patch:
+        lose_stock_responses(patch)
+        assert process_articles(bon, PURCHASED, receipt_id="gruppe") == 0
+    assert [entry["amount"] for entry in grocy.stock] == [3]
+
+    # Erneuter Lauf, zusammengefasst wie einzeln: keine Zeile bucht noch einmal
+    assert process_articles(bon, PURCHASED, receipt_id="gruppe") == 0
+    assert process_articles(bon, PURCHASED, receipt_id="gruppe", coalesce=False) == 0
+    assert [entry["amount"] for entry in grocy.stock] == [3]
+    with grocy_connector.db_lock:
+        conn = grocy_connector.get_db()
+        assert [e["line"] for e in uncertain_journal_entries(conn)] == [0]
+        assert [tuple(row) for row in conn.execute(
+            "SELECT line, stock_sent, merged_into FROM grocy_journal WHERE receipt_id = 'gruppe' ORDER BY line")] == \
+            [(0, 1, None), (1, 1, 0), (2, 1, 0)]
+
+    assert resolve_line("gruppe", 0, "booked")
+    assert [status for _line, _ean, status, _id in journal("gruppe")] == ["done"] * 3
+    assert synced("gruppe")
+    assert process_articles(bon, PURCHASED, receipt_id="gruppe") == 3
+    assert [entry["amount"] for entry in grocy.stock] == [3]
+
+def test_coalesced_group_is_rebooked_once_after_failure(grocy, monkeypatch):
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011") for _ in range(3)]
+    with monkeypatch.context() as patch:
+        # Grocy lehnt die Buchung ab: sicher nicht gebucht, darf wiederholt werden
+        patch.setattr(grocy_connector, "update_stock", lambda *args, **kwargs: False)
+        assert process_articles(bon, PURCHASED, receipt_id="gruppe") == 0
+    assert process_articles(bon, PURCHASED, receipt_id="gruppe") == 3
+    assert [entry["amount"] for entry in grocy.stock] == [3]
+
+def test_connection_dropped_after_booking_is_not_rebooked(grocy, monkeypatch):
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011")]
+    dropped = requests.exceptions.ConnectionError(
+        urllib3.exceptions.ProtocolError("Connection aborted.", ConnectionResetError(104, "Connection reset by peer")))
+    with monkeypatch.context() as patch:
+        break_stock_connection(patch, dropped, reach_grocy=True)
+        assert process_articles(bon, PURCHASED, receipt_id="abbruch") == 0
+    assert len(grocy.stock) == 1
+    with grocy_connector.db_lock:
+        assert [e["line"] for e in uncertain_journal_entries(grocy_connector.get_db())] == [0]
+
+    # --retry-failed bucht die unklare Zeile nicht noch einmal
+    retry_journal()
+    assert process_articles(bon, PURCHASED, receipt_id="abbruch") == 0
+    assert len(grocy.stock) == 1
+
+def test_refused_connection_is_rebooked(grocy, monkeypatch):
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011")]
+    refused = requests.exceptions.ConnectionError(urllib3.exceptions.MaxRetryError(
+        None, "/api/stock", urllib3.exceptions.NewConnectionError(None, "Connection refused")))
+    with monkeypatch.context() as patch:
+        break_stock_connection(patch, refused, reach_grocy=False)
+        assert process_articles(bon, PURCHASED, receipt_id="abgelehnt") == 0
+    with grocy_connector.db_lock:
+        assert uncertain_journal_entries(grocy_connector.get_db()) == []
+
+    assert retry_journal() == {"abgelehnt": (1, 0)}
+    assert len(grocy.stock) == 1
+
+def test_households_sharing_a_receipt_book_separately(grocy, monkeypatch):
+    # Zwei Haushalte mit demselben REWE-Konto: gleiche eBon-ID, eigenes Grocy
+    bon = [bon_line("Xyzzy Quux Frobnitz", nan="4000000000011") for _ in range(2)] + \
+          [bon_line("Plugh Wibble Wobble", nan="4000000000012")]
+    assert process_articles(bon, PURCHASED, receipt_id="gemeinsam") == 3
+    with grocy_connector.db_lock:
+        record_synced(grocy_connector.get_db(), "gemeinsam", PURCHASED, 3)
+
+    other = FakeGrocy().start()
+    try:
+        with use_tenant(Tenant("zwei", "test-token", other.url, "test-key")):
+            with grocy_connector.db_lock:
+                assert "gemeinsam" not in synced_receipt_ids(grocy_connector.get_db(), "zwei")
+            assert process_articles(bon, PURCHASED, receipt_id="gemeinsam") == 3
+            with grocy_connector.db_lock:
+                record_synced(grocy_connector.get_db(), "gemeinsam", PURCHASED, 3, "zwei")
+    finally:
+        other.stop()
+    assert stock_by_product(other) == stock_by_product(grocy) == {1: 2, 2: 1}
+    with grocy_connector.db_lock:
+        conn = grocy_connector.get_db()
+        assert [tuple(row) for row in conn.execute("SELECT tenant, COUNT(*) FROM grocy_journal "
+                                                   "WHERE receipt_id = 'gemeinsam' GROUP BY tenant ORDER BY tenant")] == \
+            [("", 3), ("zwei", 3)]
+        assert synced_receipt_ids(conn) == synced_receipt_ids(conn, "zwei") == {"gemeinsam"}
+
+def test_tenant_key_migration_keeps_rows(workdir):
+    # Stand vor dem Neuaufbau: v11 hatte tenant nur als Spalte angehängt
+    conn = sqlite3.connect("rewe_products.db")
+    migrate(conn, version=10)
+    conn.execute("ALTER TABLE synced_receipts ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+    conn.execute("ALTER TABLE grocy_journal ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+    conn.execute("PRAGMA user_version = 11")
+    conn.execute("INSERT INTO synced_receipts (receipt_id, lines, synced_at) VALUES ('alt', 2, '2026-10-01')")
+    conn.execute("INSERT INTO grocy_journal (receipt_id, line, status, updated_at) VALUES ('alt', 0, 'done', '2026-10-01')")
+    conn.commit()
+
+    migrate(conn)
+    for table, key in (("synced_receipts", ["tenant", "receipt_id"]), ("grocy_journal", ["tenant", "receipt_id", "line"])):
+        columns = sorted((pk, name) for _cid, name, _type, _notnull, _default, pk in conn.execute(f"PRAGMA table_info({table})"))
+        assert [name for pk, name in columns if pk] == key
+    assert conn.execute("SELECT tenant, receipt_id, lines FROM synced_receipts").fetchall() == [("", "alt", 2)]
+    assert conn.execute("SELECT tenant, receipt_id, line, status FROM grocy_journal").fetchall() == [("", "alt", 0, "done")]
+    conn.close()
@@ -0,0 +1,41 @@
+import os
+import pytest
+import requests
+import image_cache
+from fake_servers import FAKE_IMAGE, FakeImageHost
+from image_cache import ImageCache
+
+# Lokale Kopie, die zwischen exists()-Check und Lesen verdrängt wird.
+
+@pytest.fixture
+def host():
+    host = FakeImageHost().start()
+    yield host
+    host.stop()
+
+def evict_before_request(monkeypatch, cache, url, fail=False):
+    """Löscht das Bild wie die LRU-Verdrängung, kurz bevor revalidiert wird."""
+    get = image_cache.client.get
+
+    def evicting_get(*args, **kwargs):
+        data_path = cache._paths(url)[0]
+        if os.path.exists(data_path):
+            os.remove(data_path)
+        if fail:
+            raise requests.exceptions.ConnectionError("Bildserver weg")
+        return get(*args, **kwargs)
+    monkeypatch.setattr(image_cache.client, "get", evicting_get)
+
+def test_evicted_copy_is_downloaded_again_after_304(host, workdir, monkeypatch):
+    cache = ImageCache(str(workdir / "images"), 10 * 1024 * 1024)
+    url = f"{host.url}/img/milch.jpg"
+    assert cache.get(url) == FAKE_IMAGE
+    evict_before_request(monkeypatch, cache, url)
+    assert cache.get(url) == FAKE_IMAGE
+
+def test_evicted_copy_without_server_is_a_miss(host, workdir, monkeypatch):
+    cache = ImageCache(str(workdir / "images"), 10 * 1024 * 1024)
+    url = f"{host.url}/img/milch.jpg"
+    assert cache.get(url) == FAKE_IMAGE
+    evict_before_request(monkeypatch, cache, url, fail=True)
+    assert cache.get(url) is None
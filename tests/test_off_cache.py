@@ -0,0 +1,55 @@
+import time
+import pytest
+from catalog_db import connect
+from conftest import fixture_path
+from off_cache import import_off_dump, lookup_off_product, store_off_product
+
+# OFF-Cache: Dump-Import nur für deutsche Produkte, TTL für Treffer und "nicht gefunden".
+
+TTL = 3600
+NEGATIVE_TTL = 600
+
+@pytest.fixture
+def conn(workdir):
+    conn = connect("rewe_products.db")
+    yield conn
+    conn.close()
+
+def cached_eans(conn):
+    return {ean for (ean,) in conn.execute("SELECT ean FROM off_products")}
+
+@pytest.mark.parametrize("dump", ["off_dump.jsonl", "off_dump.csv"])
+def test_dump_imports_only_german_products(conn, dump):
+    assert import_off_dump(conn, fixture_path(dump)) == 2
+    # Frankreich/Italien fallen weg, ebenso Produkte ohne Namen oder Code
+    assert cached_eans(conn) == {"4388840218328", "4006040004306"}
+    found, product = lookup_off_product(conn, "4388840218328", TTL, NEGATIVE_TTL)
+    assert found
+    assert product == {"product_name": "Ja! H-Milch 1,5% Fett", "brands": "Ja!"}
+
+def test_dump_rows_do_not_expire(conn):
+    import_off_dump(conn, fixture_path("off_dump.jsonl"))
+    much_later = time.time() + 100 * TTL
+    assert lookup_off_product(conn, "4006040004306", TTL, NEGATIVE_TTL, now=much_later)[0]
+
+def test_dump_for_other_country(conn):
+    assert import_off_dump(conn, fixture_path("off_dump.jsonl"), country="france") == 1
+    assert cached_eans(conn) == {"3017620422003"}
+
+def test_positive_entry_expires_after_ttl(conn):
+    store_off_product(conn, "4000000000001", {"product_name": "Testprodukt", "brands": "Test"})
+    now = time.time()
+    assert lookup_off_product(conn, "4000000000001", TTL, NEGATIVE_TTL, now=now + TTL - 5) == \
+        (True, {"product_name": "Testprodukt", "brands": "Test"})
+    # Die kurze Negativ-TTL gilt für Treffer nicht
+    assert lookup_off_product(conn, "4000000000001", TTL, NEGATIVE_TTL, now=now + NEGATIVE_TTL + 5)[0]
+    assert lookup_off_product(conn, "4000000000001", TTL, NEGATIVE_TTL, now=now + TTL + 5) == (False, None)
+
+def test_negative_entry_expires_after_negative_ttl(conn):
+    store_off_product(conn, "4000000000002", None)
+    now = time.time()
+    assert lookup_off_product(conn, "4000000000002", TTL, NEGATIVE_TTL, now=now + NEGATIVE_TTL - 5) == (True, None)
+    assert lookup_off_product(conn, "4000000000002", TTL, NEGATIVE_TTL, now=now + NEGATIVE_TTL + 5) == (False, None)
+
+def test_unknown_ean_is_a_miss(conn):
+    assert lookup_off_product(conn, "4000000000003", TTL, NEGATIVE_TTL) == (False, None)
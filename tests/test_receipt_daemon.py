@@ -0,0 +1,42 @@
+import pytest
+import grocy_connector
+import receipt_daemon
+from grocy_journal import journal_begin, journal_update
+from receipt_daemon import ReceiptDaemon
+
+# Backoff nur bei Transport-/Ausnahmefehlern; offene Zeilen stehen in /status.
+
+@pytest.fixture
+def daemon_for(workdir, monkeypatch):
+    monkeypatch.setattr(receipt_daemon, "refresh_catalog", lambda **kwargs: False)
+    yield lambda sync: ReceiptDaemon(sync, interval=900, backoff_base=60, backoff_max=3600)
+    grocy_connector.close_db()
+
+def failing_sync():
+    raise ConnectionError("Grocy weg")
+
+@pytest.mark.parametrize("sync, ok, failures", [
+    (lambda: True, True, 0),
+    (lambda: False, True, 0),      # offene Zeilen: normaler Takt
+    (lambda: None, False, 1),      # eBon-Liste nicht abrufbar
+    (failing_sync, False, 1),
+])
+def test_backoff_only_on_transport_errors(daemon_for, sync, ok, failures):
+    daemon = daemon_for(sync)
+    for _ in range(3):
+        assert daemon.cycle() is ok
+    assert daemon.status()["failures"] == 3 * failures
+    assert daemon.next_delay(daemon.status()["failures"]) == (900 if ok else 240)
+
+def test_status_reports_open_and_uncertain_lines(daemon_for):
+    with grocy_connector.db_lock:
+        conn = grocy_connector.get_db()
+        for line in range(3):
+            journal_begin(conn, "offen", line, f"Artikel {line}", f"400000000001{line}", 1, 1.0, "2026-10-01")
+        journal_update(conn, "offen", 0, status="done")
+        journal_update(conn, "offen", 1, stock_sent=1, status="failed")
+    daemon = daemon_for(lambda: False)
+    daemon.cycle()
+    status = daemon.status()
+    assert (status["open_lines"], status["uncertain_lines"]) == (2, 1)
+    assert status["last_success_at"] and status["last_complete_at"] is None
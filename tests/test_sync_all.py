@@ -0,0 +1,52 @@
+import pytest
+import grocy_connector
+import main
+from receipt_ledger import synced_receipt_counts, synced_receipt_ids
+
+# --sync-all/--serve: der erste Lauf bucht nicht die ganze eBon-Historie.
+
+RECEIPTS = [{"receiptId": f"bon-{day:02d}", "receiptTimestamp": f"2026-10-{day:02d}T18:00:00"}
+            for day in range(1, 8)]
+
+@pytest.fixture
+def booked(workdir, monkeypatch):
+    """Liste der übertragenen eBon-IDs; REWE und Grocy sind ersetzt."""
+    booked = []
+
+    def process_receipts(fetched, concurrency):
+        booked.extend(receipt_id for receipt_id, _date, _articles in fetched)
+        return {receipt_id: (1, 0) for receipt_id, _date, _articles in fetched}
+    monkeypatch.setattr(main, "fetch_receipt_list", lambda rtsp: list(RECEIPTS))
+    monkeypatch.setattr(main, "fetch_receipt_articles", lambda rtsp, receipt_id: [])
+    monkeypatch.setattr(main, "process_receipts", process_receipts)
+    yield booked
+    grocy_connector.close_db()
+
+def ledger(skipped=True):
+    with grocy_connector.db_lock:
+        return synced_receipt_ids(grocy_connector.get_db(), skipped=skipped)
+
+def test_first_run_books_only_newest(booked):
+    assert main.sync_all("token", first_run_receipts=3)
+    assert booked == ["bon-05", "bon-06", "bon-07"]
+    # Die älteren gelten als erledigt, zählen aber nicht als übertragen
+    assert ledger() == {r["receiptId"] for r in RECEIPTS}
+    assert ledger(skipped=False) == set(booked)
+    with grocy_connector.db_lock:
+        assert synced_receipt_counts(grocy_connector.get_db()) == {"": 3}
+
+    # Folgeläufe buchen nur neue eBons, nicht die übersprungenen
+    RECEIPTS.append({"receiptId": "bon-08", "receiptTimestamp": "2026-10-08T18:00:00"})
+    try:
+        assert main.sync_all("token", first_run_receipts=3)
+    finally:
+        RECEIPTS.pop()
+    assert booked[3:] == ["bon-08"]
+
+    assert main.sync_all("token", backfill=True, first_run_receipts=3)
+    assert booked[4:] == ["bon-01", "bon-02", "bon-03", "bon-04"]
+    assert ledger(skipped=False) == ledger()
+
+def test_backfill_on_first_run_books_everything(booked):
+    assert main.sync_all("token", backfill=True, first_run_receipts=3)
+    assert booked == [r["receiptId"] for r in RECEIPTS]